@@ -193,6 +193,7 @@ class PipelineRunRequest(BaseModel):
     config_id: Optional[str] = Field(None, description="Configuration ID to use (uses active if not specified)")
     use_existing_data: bool = Field(True, description="Use existing intermediate data if available")
     file_selection: Optional[DataFileSelection] = Field(None, description="File selection for Phase 1 (if included)")
+    resume_run_id: Optional[str] = Field(None, description="Resume Phase 1/2 of this earlier run from its last checkpoint")
 
 
 class PipelineRunResponse(BaseModel):
@@ -342,7 +343,8 @@ def get_pipeline_run(run_id: str) -> Optional[Dict]:
 
 
 # ========== PIPELINE EXECUTION ==========
-def run_phase_script(phase: str, config_id: Optional[str] = None, file_selection: Optional[Dict] = None) -> Tuple[bool, str, Optional[str]]:
+def run_phase_script(phase: str, config_id: Optional[str] = None, file_selection: Optional[Dict] = None,
+                     checkpoint_run_id: Optional[str] = None, resume: bool = False) -> Tuple[bool, str, Optional[str]]:
     """
     Run a specific phase script
     Returns: (success, logs, output_path)
@@ -374,6 +376,10 @@ def run_phase_script(phase: str, config_id: Optional[str] = None, file_selection
             if file_selection.get(key):
                 cmd.extend([f'--{folder_num}'] + file_selection[key])
 
+    # Phase 1/2 checkpoint under the run id, so a failed or timed-out run can be resumed
+    if phase in ("phase1", "phase2") and checkpoint_run_id:
+        cmd.extend(["--resume" if resume else "--run-id", checkpoint_run_id])
+
     # Set environment variables for configuration
     env = os.environ.copy()
     if config_id:
@@ -397,7 +403,7 @@ def run_phase_script(phase: str, config_id: Optional[str] = None, file_selection
         output_path = None
         if success:
             if phase == "phase1":
-                output_path = "output/datasets/master_full_202503-202508.parquet"
+                output_path = "output/datasets/master_full/"
             elif phase == "phase2":
                 output_path = "output/datasets/dataset_with_features_202503-202508_CORRECTED.parquet"
             elif phase == "phase3b":
@@ -413,7 +419,8 @@ def run_phase_script(phase: str, config_id: Optional[str] = None, file_selection
         return False, f"Error executing script: {str(e)}", None
 
 
-def run_pipeline_background(run_id: str, phases: List[str], config_id: Optional[str], file_selection: Optional[Dict] = None):
+def run_pipeline_background(run_id: str, phases: List[str], config_id: Optional[str], file_selection: Optional[Dict] = None,
+                            resume_run_id: Optional[str] = None):
     """Background task to run the pipeline"""
     all_logs = []
     all_outputs = []
@@ -432,7 +439,9 @@ def run_pipeline_background(run_id: str, phases: List[str], config_id: Optional[
         conn.close()
 
         # Run the phase
-        success, logs, output_path = run_phase_script(phase, config_id, file_selection)
+        success, logs, output_path = run_phase_script(phase, config_id, file_selection,
+                                                      checkpoint_run_id=resume_run_id or run_id,
+                                                      resume=resume_run_id is not None)
 
         all_logs.append(f"\n{'='*60}\nPHASE: {phase}\n{'='*60}\n{logs}")
         if output_path:
@@ -617,7 +626,8 @@ async def run_pipeline(request: PipelineRunRequest, background_tasks: Background
         }
 
     # Start background task
-    background_tasks.add_task(run_pipeline_background, run_id, request.phases, config_id, file_selection_dict)
+    background_tasks.add_task(run_pipeline_background, run_id, request.phases, config_id, file_selection_dict,
+                              request.resume_run_id)
 
     return PipelineRunResponse(
         id=run_id,
@@ -695,12 +705,14 @@ async def get_pipeline_logs(run_id: str):
 
 @app.get("/api/data/files")
 async def list_data_files(folder: Optional[str] = None):
-    """List available CSV files in data folders. If folder not specified, lists all folders."""
+    """List available CSV files (.csv, .csv.gz, .csv.zst) in data folders. If folder not specified, lists all folders."""
     try:
         import glob
         import re
 
         all_folders = ["N1", "N2", "N3", "N4", "N5", "N6", "N7", "N8", "N10"]
+        # Phase 1 reads gzip / zstd compressed drops directly
+        csv_suffixes = {".csv": None, ".csv.gz": "gzip", ".csv.zst": "zstd"}
 
         # If specific folder requested
         if folder:
@@ -711,9 +723,11 @@ async def list_data_files(folder: Optional[str] = None):
             if not folder_path.exists():
                 return {"folder": folder, "files": [], "message": f"Folder not found: {folder_path}"}
 
-            # Get all CSV files
-            pattern = str(folder_path / f"{folder}_*.csv")
-            files = sorted(glob.glob(pattern))
+            # Get all CSV files (plain or compressed)
+            files = sorted(
+                f for suffix in csv_suffixes
+                for f in glob.glob(str(folder_path / f"{folder}_*{suffix}"))
+            )
 
             file_info = []
             for file_path in files:
@@ -727,6 +741,7 @@ async def list_data_files(folder: Optional[str] = None):
                     "name": p.name,
                     "month": month,
                     "size_mb": round(size_mb, 2),
+                    "compression": next((c for suf, c in csv_suffixes.items() if c and p.name.endswith(suf)), None),
                     "modified": datetime.fromtimestamp(p.stat().st_mtime).isoformat()
                 })
 
@@ -745,8 +760,10 @@ async def list_data_files(folder: Optional[str] = None):
                 result[folder_name] = {"exists": False, "files": [], "count": 0}
                 continue
 
-            pattern = str(folder_path / f"{folder_name}_*.csv")
-            files = sorted(glob.glob(pattern))
+            files = sorted(
+                f for suffix in csv_suffixes
+                for f in glob.glob(str(folder_path / f"{folder_name}_*{suffix}"))
+            )
 
             file_info = []
             for file_path in files:
@@ -760,6 +777,7 @@ async def list_data_files(folder: Optional[str] = None):
                     "name": p.name,
                     "month": month,
                     "size_mb": round(size_mb, 2),
+                    "compression": next((c for suf, c in csv_suffixes.items() if c and p.name.endswith(suf)), None),
                     "modified": datetime.fromtimestamp(p.stat().st_mtime).isoformat()
                 })
 
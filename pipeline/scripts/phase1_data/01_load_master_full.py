@@ -8,14 +8,38 @@ Output: File master có ~30 cột base để Phase 2 tạo features
 import pandas as pd
 import numpy as np
 from pathlib import Path
-import glob
+import hashlib
+import os
+import re
+import sys
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from multiprocessing import cpu_count
 import argparse
 import warnings
 warnings.filterwarnings('ignore')
 
+from partial_aggregation import PartialAggregator
+from grouped_mode import grouped_mode
+from keyed_join import multiway_left_join
+from source_schemas import csv_compression, get_schema, glob_source_files, read_csv_projected, schema_signature
+from staging_cache import read_csv_staged, lookup_staged, iter_staged_chunks
+from parse_workers import parse_csv_to_ipc, read_ipc_handoff, write_ipc_handoff
+from n10_membership import SemiJoinFilter, SubscriberMonthBitmap
+from n10_dedup import dedupe_n10
+from aggregate_cache import (AGGREGATE_CACHE_DIR, combine, fingerprint, load_cached, params_signature,
+                             save_cached, split_months)
+from source_scheduler import (TaskClock, available_memory_bytes, estimate_source_memory,
+                              format_timeline, parse_memory_size, run_sources, run_sources_sequential)
+from spill_aggregation import SpillingAggregator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.master_dataset import (MASTER_DATASET_DIR, ROW_GROUP_SIZE, load_manifest, list_months,
+                                  assert_unique_keys, sort_master, write_master_partitions,
+                                  write_sorted_parquet)
+from utils.isdn_dictionary import ISDN_DICTIONARY_FILE, IsdnDictionary
+from utils.run_checkpoints import RunCheckpoints, new_run_id
+
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Phase 1: Load and merge data sources')
 parser.add_argument('--n1', nargs='*', help='N1 (ARPU) file paths')
@@ -27,17 +51,80 @@ parser.add_argument('--n6', nargs='*', help='N6 (Usage Detail) file paths')
 parser.add_argument('--n7', nargs='*', help='N7 (Location) file paths')
 parser.add_argument('--n8', nargs='*', help='N8 (Device) file paths')
 parser.add_argument('--n10', nargs='*', help='N10 (Subscriber Info) file paths')
+parser.add_argument('--streaming', action='store_true',
+                    help='Read N4/N5/N2/N3 in chunks and fold them into partial aggregates (bounded memory)')
+parser.add_argument('--chunk-size', type=int, default=1_000_000,
+                    help='Rows per CSV chunk in streaming mode')
+parser.add_argument('--no-staging-cache', action='store_true',
+                    help='Always parse raw CSVs, bypassing the Parquet staging cache')
+parser.add_argument('--loader', choices=['process', 'thread'], default='process',
+                    help='CSV parsing engine: worker processes (Arrow IPC handoff) or threads')
+parser.add_argument('--workers', type=int, default=None,
+                    help='Parallel CSV parsing workers (default: min(cpu_count, 128))')
+parser.add_argument('--months', nargs='*', help='Months (YYYYMM) to load (default: 202503-202508)')
+parser.add_argument('--incremental', action='store_true',
+                    help='Only rebuild master partitions whose month has new or changed input files')
+parser.add_argument('--no-aggregate-cache', action='store_true',
+                    help='Recompute every source aggregate instead of reusing cached per-source results')
+parser.add_argument('--scheduler', choices=['concurrent', 'sequential'], default='concurrent',
+                    help='Load/aggregate sources concurrently in worker processes, or one after another')
+parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE,
+                    help='Rows per Parquet row group in the master output')
+parser.add_argument('--memory-budget-gb', type=float, default=None,
+                    help='Memory budget for concurrently running sources (default: 60%% of available RAM)')
+parser.add_argument('--run-id', default=None,
+                    help='Id of this run; checkpoints are kept under it (default: timestamp)')
+parser.add_argument('--resume', metavar='RUN_ID', default=None,
+                    help='Continue run RUN_ID from its last completed checkpoint')
+parser.add_argument('--max-memory', default=None,
+                    help='Hard memory cap for Phase 1, e.g. 64G: oversized sources are streamed and '
+                         'spill hash-partitioned partial aggregates to disk')
+parser.add_argument('--spill-dir', default='/data/ut360/staging/spill',
+                    help='Local directory for spilled partial aggregates')
+parser.add_argument('--spill-partitions', type=int, default=32,
+                    help='Hash partitions (by isdn_id) used when partial aggregates spill')
 args = parser.parse_args()
 
 # Configuration
 DATA_DIR = Path('/data/ut360/data')
 OUTPUT_DIR = Path('/data/ut360/output/datasets')
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
-
-NUM_WORKERS = min(cpu_count(), 128)
-
-# Filter months to match existing dataset: 202503-202508 (6 months only, NO 202509!)
-MONTHS_FILTER = ['202503', '202504', '202505', '202506', '202507', '202508']
+STAGING_DIR = Path('/data/ut360/staging')  # Typed Parquet copies of raw CSVs
+USE_AGG_CACHE = not args.no_aggregate_cache  # Per-source, per-month aggregates (aggregate_cache.py)
+
+NUM_WORKERS = args.workers or min(cpu_count(), 128)
+LOADER = args.loader
+
+# Per-source scheduling: sources run side by side, each with a share of the file workers
+SCHEDULER = args.scheduler
+MAX_MEMORY = parse_memory_size(args.max_memory) if args.max_memory else None
+if args.memory_budget_gb:
+    MEMORY_BUDGET = int(args.memory_budget_gb * 1024**3)
+elif MAX_MEMORY:
+    MEMORY_BUDGET = MAX_MEMORY
+else:
+    MEMORY_BUDGET = int(available_memory_bytes() * 0.6)
+
+STREAMING = args.streaming
+CHUNK_SIZE = args.chunk_size
+USE_STAGING = not args.no_staging_cache
+
+# Phase 1 sources; a month partition is rebuilt when any of its input files changes
+SOURCE_FOLDERS = ['N10', 'N4', 'N5', 'N2', 'N1', 'N3']
+INCREMENTAL = args.incremental
+
+# Memory cap: each source that may run at the same time gets an equal share.
+# A streamed source holds two partial-aggregate states (running total + current
+# file), each capped at a quarter of its share; the rest is left for chunks and
+# the merge. Above the cap, partial aggregates spill to SPILL_DIR (spill_aggregation.py)
+SOURCE_SLOTS = len(SOURCE_FOLDERS) - 1 if SCHEDULER == 'concurrent' else 1
+AGG_MEMORY_LIMIT = MAX_MEMORY // SOURCE_SLOTS // 4 if MAX_MEMORY else None
+SPILL_DIR = Path(args.spill_dir)
+SPILL_PARTITIONS = args.spill_partitions
+
+# File-parsing workers per source; reduced while event sources run side by side
+FILE_WORKERS = NUM_WORKERS
+MAIN_PID = os.getpid()
 
 # File selection từ command line (nếu có)
 FILE_SELECTION = {
@@ -52,16 +139,41 @@ FILE_SELECTION = {
     'N10': args.n10
 }
 
+# Filter months to match existing dataset: 202503-202508 (6 months only, NO 202509!)
+# Files selected in the webapp define the months when --months is not given
+SELECTED_MONTHS = sorted({
+    match.group(1)
+    for files in FILE_SELECTION.values() if files
+    for match in [re.search(r'(\d{6})', Path(f).name) for f in files] if match
+})
+MONTHS_FILTER = args.months or SELECTED_MONTHS or ['202503', '202504', '202505', '202506', '202507', '202508']
+
 print("="*100)
 print("PHASE 1: FULL DATA LOADING (N1-N10)")
 print("="*100)
-print(f"Using {NUM_WORKERS} parallel workers")
+print(f"Using {NUM_WORKERS} parallel workers ({LOADER} loader)")
+print(f"Source scheduler: {SCHEDULER}" + (f" (memory budget {MEMORY_BUDGET / 1024**3:.1f} GB)" if SCHEDULER == 'concurrent' else ""))
 print(f"Loading months: {MONTHS_FILTER}")
+if MAX_MEMORY:
+    print(f"Memory cap: {MAX_MEMORY / 1024**3:.1f} GB (partial aggregates spill to {SPILL_DIR} above "
+          f"{AGG_MEMORY_LIMIT / 1024**3:.2f} GB per source)")
+if STREAMING:
+    print(f"Streaming mode: chunks of {CHUNK_SIZE:,} rows (N4/N5/N2/N3)")
+print(f"Staging cache: {STAGING_DIR if USE_STAGING else 'disabled'}")
+print(f"Aggregate cache: {AGGREGATE_CACHE_DIR if USE_AGG_CACHE else 'disabled'}")
 if any(FILE_SELECTION.values()):
     print("\n📂 File selection from webapp:")
     for folder, files in FILE_SELECTION.items():
         if files:
             print(f"  {folder}: {len(files)} files")
+
+# Checkpoints after each source and after the merge (utils/run_checkpoints.py)
+RUN_ID = args.resume or args.run_id or new_run_id()
+CHECKPOINTS = RunCheckpoints('phase1', RUN_ID, resume=bool(args.resume))
+print(f"\nRun id: {RUN_ID}" + (f" (resuming: {len(CHECKPOINTS.steps())} completed steps)" if args.resume else ""))
+if CHECKPOINTS.finished:
+    print(f"✅ Phase 1 of run {RUN_ID} already completed at {CHECKPOINTS.manifest['finished_at']}")
+    sys.exit(0)
 print()
 
 start_time = datetime.now()
@@ -75,22 +187,25 @@ def extract_month_from_filename(filepath):
     return match.group(1) if match else None
 
 
-def load_csv_with_month(file_path):
-    """Load a single CSV file with month tagging"""
+def load_csv_with_month(file_path, schema=None):
+    """Load a single CSV file with month tagging (through the staging cache if enabled)"""
     try:
         month = extract_month_from_filename(file_path)
-        df = pd.read_csv(file_path, low_memory=False)
+        parse_start = datetime.now()
+        if USE_STAGING:
+            df, cache_hit = read_csv_staged(file_path, STAGING_DIR, schema)
+        else:
+            df, cache_hit = read_csv_projected(file_path, schema), False
         df['data_month'] = month
-        return df, Path(file_path).name, len(df)
+        seconds = (datetime.now() - parse_start).total_seconds()
+        return df, Path(file_path).name, len(df), cache_hit, seconds
     except Exception as e:
         print(f"  ⚠ Error loading {Path(file_path).name}: {e}")
-        return pd.DataFrame(), Path(file_path).name, 0
-
+        return pd.DataFrame(), Path(file_path).name, 0, False, 0.0
 
-def parallel_load_csvs(folder_name, data_source_name, months_filter=None):
-    """Load all CSVs from a folder in parallel"""
-    print(f"\n[Loading {data_source_name}...]")
 
+def list_source_files(folder_name, months_filter=None):
+    """Resolve the files to load for a folder (webapp selection or glob + month filter)"""
     # Check if specific files were selected via command line
     selected_files = FILE_SELECTION.get(folder_name)
 
@@ -99,293 +214,792 @@ def parallel_load_csvs(folder_name, data_source_name, months_filter=None):
         files = selected_files
         print(f"  Using {len(files)} selected files from webapp")
     else:
-        # Use default glob pattern
-        files = sorted(glob.glob(str(DATA_DIR / folder_name / f'{folder_name}_*.csv')))
+        # Use default glob pattern (.csv, .csv.gz, .csv.zst)
+        files = glob_source_files(DATA_DIR / folder_name, folder_name)
 
         # Filter by months if specified
         if months_filter:
             files = [f for f in files if any(month in f for month in months_filter)]
 
+    if selected_files and months_filter:
+        # Only the months being built (incremental runs, aggregate-cache misses)
+        files = [f for f in files if extract_month_from_filename(f) in months_filter]
+
+    return files
+
+
+def source_month_entries(folder_name, months):
+    """Input file entries (path, size, mtime, schema) of one source, per month"""
+    entries = {month: [] for month in months}
+    signature = schema_signature(get_schema(folder_name))
+    for file_path in list_source_files(folder_name, months):
+        month = extract_month_from_filename(file_path)
+        if month not in entries:
+            continue
+        st = Path(file_path).stat()
+        entries[month].append(f"{folder_name}|{Path(file_path).resolve()}|{st.st_size}|{st.st_mtime_ns}|{signature}")
+    return entries
+
+
+def month_input_fingerprints(months):
+    """Fingerprint of every input file (path, size, mtime, schema) feeding each month"""
+    entries = {month: [] for month in months}
+    for folder_name in SOURCE_FOLDERS:
+        for month, items in source_month_entries(folder_name, months).items():
+            entries[month].extend(items)
+    return {
+        month: hashlib.sha1("\n".join(sorted(items)).encode()).hexdigest()
+        for month, items in entries.items()
+    }
+
+
+def format_throughput(file_path, record_count, seconds, cache_hit):
+    """Per-file throughput line for the Phase 1 log"""
+    size_mb = Path(file_path).stat().st_size / (1024 * 1024)
+    rate = record_count / seconds if seconds > 0 else float('inf')
+    mb_rate = size_mb / seconds if seconds > 0 else float('inf')
+    source = ", staged parquet" if cache_hit else ""
+    # Compressed drops: MB/s is measured on the compressed file
+    compression = f" {csv_compression(file_path)}" if csv_compression(file_path) and not cache_hit else ""
+    return f"{record_count:,} records ({seconds:.1f}s, {rate:,.0f} rows/s, {mb_rate:.1f} MB/s{compression}{source})"
+
+
+def _load_files_threaded(files, schema):
+    """Thread-pool engine (GIL-bound, kept as a fallback)"""
+    with ThreadPoolExecutor(max_workers=FILE_WORKERS) as executor:
+        futures = {executor.submit(load_csv_with_month, f, schema): f for f in files}
+
+        for future in as_completed(futures):
+            df, filename, record_count, cache_hit, seconds = future.result()
+            yield futures[future], df, record_count, cache_hit, seconds
+
+
+def _load_files_multiprocess(files, schema):
+    """Process-pool engine: workers parse, parent maps the Arrow IPC handoff"""
+    staging_dir = STAGING_DIR if USE_STAGING else None
+    with ProcessPoolExecutor(max_workers=min(FILE_WORKERS, len(files))) as executor:
+        futures = {executor.submit(parse_csv_to_ipc, f, schema, staging_dir): f for f in files}
+
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                ipc_path, record_count, seconds, cache_hit = future.result()
+                df = read_ipc_handoff(ipc_path)
+                df['data_month'] = extract_month_from_filename(file_path)
+            except Exception as e:
+                print(f"  ⚠ Error loading {Path(file_path).name}: {e}")
+                df, record_count, cache_hit, seconds = pd.DataFrame(), 0, False, 0.0
+            yield file_path, df, record_count, cache_hit, seconds
+
+
+def parallel_load_csvs(folder_name, data_source_name, months_filter=None, row_filter=None):
+    """Load all CSVs from a folder in parallel (row_filter is applied to each file as it arrives)"""
+    print(f"\n[Loading {data_source_name}...]")
+
+    files = list_source_files(folder_name, months_filter)
+
     if not files:
         print(f"  ⚠ No {folder_name} files found")
         return pd.DataFrame()
 
-    dfs = []
-    with ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
-        futures = {executor.submit(load_csv_with_month, f): f for f in files}
+    schema = get_schema(folder_name)
+    if schema is not None:
+        print(f"  Projected columns: {schema['columns']}")
 
-        for future in as_completed(futures):
-            df, filename, record_count = future.result()
-            if not df.empty:
-                dfs.append(df)
-                print(f"  ✓ {filename}: {record_count:,} records")
+    load_start = datetime.now()
+    engine = _load_files_multiprocess if LOADER == 'process' else _load_files_threaded
+
+    dfs = []
+    for file_path, df, record_count, cache_hit, seconds in engine(files, schema):
+        if not df.empty:
+            if row_filter is not None:
+                df = row_filter(df)
+            dfs.append(df)
+            print(f"  ✓ {Path(file_path).name}: {format_throughput(file_path, record_count, seconds, cache_hit)}")
 
     if dfs:
         combined_df = pd.concat(dfs, ignore_index=True)
-        print(f"  📊 Total {data_source_name}: {len(combined_df):,} records")
+        wall = (datetime.now() - load_start).total_seconds()
+        print(f"  📊 Total {data_source_name}: {len(combined_df):,} records in {wall:.1f}s")
         return combined_df
     else:
         return pd.DataFrame()
 
 
-# ==================== LOAD N10 (SUBSCRIBER INFO) ====================
-print("\n" + "="*100)
-print("STEP 1: LOAD N10 (SUBSCRIBER INFO)")
-print("="*100)
+def encode_isdn(df, isdn_dict):
+    """
+    Replace the raw isdn column with its dense integer id from an ISDN dictionary.
+    Rows of subscribers that are not in the dictionary can never match the N10
+    base, so they are dropped here.
+    """
+    ids = isdn_dict.encode(df['isdn'])
+    df = df.drop(columns='isdn')
+    df.insert(0, 'isdn_id', ids)
+    if (ids < 0).any():
+        df = df[ids >= 0]
+    return df
 
-df_n10 = parallel_load_csvs('N10', 'N10 - Subscriber Info', MONTHS_FILTER)
 
-# Parse dates
-if not df_n10.empty:
-    df_n10['activation_date'] = pd.to_datetime(df_n10['activation_date'], format='%d/%m/%Y', errors='coerce')
-    df_n10['expire_date'] = pd.to_datetime(df_n10['expire_date'], format='%d/%m/%Y', errors='coerce')
-    print(f"  ✓ Unique subscribers: {df_n10['isdn'].nunique():,}")
+def new_aggregator(spec):
+    """Partial aggregator for streamed sources; spills to disk under --max-memory"""
+    if AGG_MEMORY_LIMIT:
+        return SpillingAggregator(spec, AGG_MEMORY_LIMIT, SPILL_DIR, SPILL_PARTITIONS)
+    return PartialAggregator(spec)
 
 
-# ==================== LOAD N4 (ADVANCE DATA) ====================
-print("\n" + "="*100)
-print("STEP 2: LOAD N4 (ADVANCE DATA)")
-print("="*100)
+def stream_csv_partials(file_path, spec, prepare=None, schema=None, row_filter=None):
+    """Fold a single CSV into a PartialAggregator chunk by chunk"""
+    aggregator = new_aggregator(spec)
+    raw_rows = 0
+    try:
+        month = extract_month_from_filename(file_path)
+        staged = lookup_staged(file_path, STAGING_DIR, schema) if USE_STAGING else None
+        if staged is not None:
+            chunks = iter_staged_chunks(staged, CHUNK_SIZE)
+        else:
+            chunks = read_csv_projected(file_path, schema, chunksize=CHUNK_SIZE)
+        for chunk in chunks:
+            raw_rows += len(chunk)
+            chunk['data_month'] = month
+            if row_filter is not None:
+                chunk = row_filter(chunk)
+                if chunk.empty:
+                    continue
+            if prepare is not None:
+                chunk = prepare(chunk)
+            aggregator.add(chunk)
+        return aggregator, Path(file_path).name, raw_rows
+    except Exception as e:
+        print(f"  ⚠ Error loading {Path(file_path).name}: {e}")
+        if isinstance(aggregator, SpillingAggregator):
+            aggregator.cleanup()
+        return None, Path(file_path).name, 0
+
+
+def stream_aggregate_csvs(folder_name, data_source_name, spec, prepare=None, months_filter=None, row_filter=None):
+    """
+    Streaming counterpart of parallel_load_csvs + groupby:
+    every file is read in CHUNK_SIZE chunks and folded into partial aggregates,
+    which are merged at the end. Raw rows are never concatenated.
+    """
+    print(f"\n[Streaming {data_source_name}...]")
+
+    files = list_source_files(folder_name, months_filter)
 
-df_n4 = parallel_load_csvs('N4', 'N4 - Advance', MONTHS_FILTER)
+    if not files:
+        print(f"  ⚠ No {folder_name} files found")
+        return pd.DataFrame()
 
-df_n4_agg = pd.DataFrame()
-if not df_n4.empty:
-    print("\n  Processing N4 by (isdn, month)...")
+    schema = get_schema(folder_name)
+    combined = new_aggregator(spec)
+    total_records = 0
+    for file_path in files:
+        aggregator, filename, record_count = stream_csv_partials(file_path, spec, prepare, schema, row_filter)
+        if aggregator is not None:
+            combined.merge(aggregator)
+            total_records += record_count
+            print(f"  ✓ {filename}: {record_count:,} records")
+
+    if combined.rows_seen == 0:
+        return pd.DataFrame()
 
+    print(f"  📊 Total {data_source_name}: {total_records:,} records (streamed)")
+    if isinstance(combined, SpillingAggregator) and combined.spill_count:
+        print(f"  💾 Spilled {combined.spilled_bytes / 1024**2:,.1f} MB of partial aggregates "
+              f"({combined.spill_count} spills, merged over {combined.n_partitions} partitions)")
+    return combined.finalize()
+
+
+# ==================== INCREMENTAL PLANNING ====================
+MONTH_FINGERPRINTS = month_input_fingerprints(MONTHS_FILTER)
+
+if INCREMENTAL:
+    print("\n" + "="*100)
+    print("STEP 0: INCREMENTAL PLANNING")
+    print("="*100)
+
+    manifest = load_manifest(MASTER_DATASET_DIR)
+    existing_months = set(list_months(MASTER_DATASET_DIR))
+    stale_months = [
+        month for month in MONTHS_FILTER
+        if month not in existing_months
+        or manifest.get(month, {}).get('fingerprint') != MONTH_FINGERPRINTS[month]
+    ]
+    for month in MONTHS_FILTER:
+        state = "rebuild" if month in stale_months else "up to date"
+        print(f"  {month}: {state}")
+
+    if not stale_months:
+        print("\n✅ Master dataset already up to date - nothing to ingest")
+        sys.exit(0)
+
+    MONTHS_FILTER = stale_months
+    print(f"\n  Ingesting only: {MONTHS_FILTER}")
+
+
+# ==================== PER-SOURCE TASKS ====================
+# Each source is loaded and aggregated by one task; with --scheduler concurrent
+# every task runs in its own worker process (see source_scheduler.py).
+
+def step_banner(title):
+    print("\n" + "="*100)
+    print(title)
+    print("="*100)
+
+
+# ---------- N10 (SUBSCRIBER INFO) ----------
+def load_n10_source(clock, row_filter, months):
+    step_banner("STEP 1: LOAD N10 (SUBSCRIBER INFO)")
+
+    # Dates (activation_date, expire_date) are parsed by the N10 schema in source_schemas.py
+    # N10 keeps the raw isdn: the parent builds the global ISDN dictionary from it
+    df_n10 = parallel_load_csvs('N10', 'N10 - Subscriber Info', months)
+    clock.mark_loaded()
+    if not df_n10.empty:
+        # One row per (isdn, data_month): precedence rule documented in n10_dedup.py
+        rows_before = len(df_n10)
+        df_n10, n_dropped = dedupe_n10(df_n10)
+        print(f"  ✓ Duplicate (isdn, month) rows resolved: {n_dropped:,} of {rows_before:,}")
+        print(f"  ✓ Unique subscribers: {df_n10['isdn'].nunique():,}")
+    return df_n10, {}
+
+
+# ---------- N4 (ADVANCE DATA) ----------
+# Services whose raw amounts are recorded x10 (part of the aggregate cache fingerprint)
+N4_SCALED_SERVICES = ['EasyCredit', 'ungdata247']
+N4_AMOUNT_DIVISOR = 10
+
+def prepare_n4(df):
+    """Row-level N4 transforms shared by the in-memory and streaming paths"""
     # Convert amount to numeric
-    df_n4['amount'] = pd.to_numeric(df_n4['amount'], errors='coerce').fillna(0)
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
 
     # NEW LOGIC: Split by source type (ut = ứng tiền, hu = hoàn ứng/hoàn tiền)
-    print("  Separating advance (ut) and repayment (hu) transactions...")
-
     # Create advance_amount and repayment_amount based on source
-    df_n4['advance_amount'] = np.where(df_n4['source'] == 'ut', df_n4['amount'], 0)
-    df_n4['repayment_amount'] = np.where(df_n4['source'] == 'hu', df_n4['amount'], 0)
+    df['advance_amount'] = np.where(df['source'] == 'ut', df['amount'], 0)
+    df['repayment_amount'] = np.where(df['source'] == 'hu', df['amount'], 0)
+    df['is_ut_record'] = (df['source'] == 'ut').astype(int)
+    df['is_hu_record'] = (df['source'] == 'hu').astype(int)
 
     # CRITICAL LOGIC: Apply service-type-specific transformation
     # Based on investigation: EasyCredit and ungdata247 values need to be divided by 10
-    print("  Applying service-type-specific corrections...")
-    df_n4['advance_amount_corrected'] = np.where(
-        df_n4['advance_service_type'].isin(['EasyCredit', 'ungdata247']),
-        df_n4['advance_amount'] / 10,  # Divide by 10 for these services
-        df_n4['advance_amount']  # Keep original for others (MBFG, UT_SPLUS, etc.)
+    df['advance_amount_corrected'] = np.where(
+        df['advance_service_type'].isin(N4_SCALED_SERVICES),
+        df['advance_amount'] / N4_AMOUNT_DIVISOR,  # Divide by 10 for these services
+        df['advance_amount']  # Keep original for others (MBFG, UT_SPLUS, etc.)
     )
 
-    df_n4['repayment_amount_corrected'] = np.where(
-        df_n4['advance_service_type'].isin(['EasyCredit', 'ungdata247']),
-        df_n4['repayment_amount'] / 10,
-        df_n4['repayment_amount']
+    df['repayment_amount_corrected'] = np.where(
+        df['advance_service_type'].isin(N4_SCALED_SERVICES),
+        df['repayment_amount'] / N4_AMOUNT_DIVISOR,
+        df['repayment_amount']
     )
+    return df
 
-    # Aggregate by subscriber-month
-    df_n4_agg = df_n4.groupby(['isdn', 'data_month'], as_index=False).agg({
-        'advance_amount_corrected': ['count', 'sum', 'mean', 'max'],
-        'repayment_amount_corrected': 'sum',
-        'advance_service_type': lambda x: x.mode()[0] if len(x.mode()) > 0 else 'Unknown'
-    })
-
-    # Flatten column names
-    df_n4_agg.columns = ['isdn', 'data_month', 'advance_count', 'total_advance_amount',
-                         'avg_advance_amount', 'max_advance_amount', 'total_repayment_amount',
-                         'most_used_advance_service']
 
+def finalize_n4_agg(df_agg):
+    """Derived per subscriber-month columns computed after aggregation"""
     # Calculate avg_repayment_rate and outstanding_debt
-    df_n4_agg['avg_repayment_rate'] = np.where(
-        df_n4_agg['total_advance_amount'] > 0,
-        df_n4_agg['total_repayment_amount'] / df_n4_agg['total_advance_amount'],
+    df_agg['avg_repayment_rate'] = np.where(
+        df_agg['total_advance_amount'] > 0,
+        df_agg['total_repayment_amount'] / df_agg['total_advance_amount'],
         0
     )
-    df_n4_agg['outstanding_debt'] = (df_n4_agg['total_advance_amount'] - df_n4_agg['total_repayment_amount']).clip(lower=0)
+    df_agg['outstanding_debt'] = (df_agg['total_advance_amount'] - df_agg['total_repayment_amount']).clip(lower=0)
 
     # Add has_advance_in_month flag
-    df_n4_agg['has_advance_in_month'] = (df_n4_agg['advance_count'] > 0)
-
-    print(f"  ✓ Aggregated: {len(df_n4_agg):,} subscriber-months")
-    print(f"  ✓ Subscribers with advance: {df_n4_agg['isdn'].nunique():,}")
-    print(f"  ✓ Total advance records (ut): {(df_n4['source'] == 'ut').sum():,}")
-    print(f"  ✓ Total repayment records (hu): {(df_n4['source'] == 'hu').sum():,}")
-
-
-# ==================== LOAD N5 (TOPUP DATA) ====================
-print("\n" + "="*100)
-print("STEP 3: LOAD N5 (TOPUP DATA)")
-print("="*100)
+    df_agg['has_advance_in_month'] = (df_agg['advance_count'] > 0)
+    return df_agg
+
+
+N4_AGG_SPEC = [
+    ('advance_count', 'advance_amount_corrected', 'count'),
+    ('total_advance_amount', 'advance_amount_corrected', 'sum'),
+    ('avg_advance_amount', 'advance_amount_corrected', 'mean'),
+    ('max_advance_amount', 'advance_amount_corrected', 'max'),
+    ('total_repayment_amount', 'repayment_amount_corrected', 'sum'),
+    ('most_used_advance_service', 'advance_service_type', 'mode'),
+    ('ut_records', 'is_ut_record', 'sum'),
+    ('hu_records', 'is_hu_record', 'sum'),
+]
 
-df_n5 = parallel_load_csvs('N5', 'N5 - Topup', MONTHS_FILTER)
 
-df_n5_agg = pd.DataFrame()
-if not df_n5.empty:
-    print("\n  Aggregating N5 by (isdn, month)...")
+def aggregate_n4_source(clock, row_filter, months):
+    step_banner("STEP 2: LOAD N4 (ADVANCE DATA)")
 
+    df_n4_agg = pd.DataFrame()
+    ut_records = hu_records = 0
+    if SOURCE_STREAMING['N4']:
+        df_n4_agg = stream_aggregate_csvs('N4', 'N4 - Advance', N4_AGG_SPEC, prepare_n4, months, row_filter)
+        if not df_n4_agg.empty:
+            ut_records = int(df_n4_agg.pop('ut_records').sum())
+            hu_records = int(df_n4_agg.pop('hu_records').sum())
+    else:
+        df_n4 = parallel_load_csvs('N4', 'N4 - Advance', months, row_filter)
+        clock.mark_loaded()
+
+        if not df_n4.empty:
+            print("\n  Processing N4 by (isdn_id, month)...")
+            print("  Separating advance (ut) and repayment (hu) transactions...")
+            print("  Applying service-type-specific corrections...")
+            df_n4 = prepare_n4(df_n4)
+
+            # Aggregate by subscriber-month
+            df_n4_agg = df_n4.groupby(['isdn_id', 'data_month']).agg({
+                'advance_amount_corrected': ['count', 'sum', 'mean', 'max'],
+                'repayment_amount_corrected': 'sum'
+            })
+
+            # Flatten column names
+            df_n4_agg.columns = ['advance_count', 'total_advance_amount',
+                                 'avg_advance_amount', 'max_advance_amount', 'total_repayment_amount']
+
+            # Most used service: vectorized grouped mode (ties -> smallest value)
+            df_n4_agg['most_used_advance_service'] = grouped_mode(df_n4, ['isdn_id', 'data_month'], 'advance_service_type')
+            df_n4_agg = df_n4_agg.reset_index()
+
+            ut_records = int(df_n4['is_ut_record'].sum())
+            hu_records = int(df_n4['is_hu_record'].sum())
+            del df_n4
+
+    if not df_n4_agg.empty:
+        df_n4_agg = finalize_n4_agg(df_n4_agg)
+
+        print(f"  ✓ Aggregated: {len(df_n4_agg):,} subscriber-months")
+        print(f"  ✓ Subscribers with advance: {df_n4_agg['isdn_id'].nunique():,}")
+        print(f"  ✓ Total advance records (ut): {ut_records:,}")
+        print(f"  ✓ Total repayment records (hu): {hu_records:,}")
+    return df_n4_agg, {'ut_records': ut_records, 'hu_records': hu_records}
+
+
+# ---------- N5 (TOPUP DATA) ----------
+def prepare_n5(df):
+    """Row-level N5 transforms"""
     # Convert to numeric
-    df_n5['topup_amount'] = pd.to_numeric(df_n5['topup_amount'], errors='coerce').fillna(0)
-
-    # Aggregate by subscriber-month
-    df_n5_agg = df_n5.groupby(['isdn', 'data_month'], as_index=False).agg({
-        'topup_amount': ['count', 'sum', 'mean', 'std', 'max'],
-        'topup_channel': lambda x: x.mode()[0] if len(x.mode()) > 0 else 'Unknown'
-    })
-
-    # Flatten column names
-    df_n5_agg.columns = ['isdn', 'data_month', 'topup_count', 'total_topup_amount',
-                         'avg_topup_amount', 'std_topup_amount', 'max_topup_amount',
-                         'most_used_topup_channel']
-
-    # Fill NaN std with 0
-    df_n5_agg['std_topup_amount'] = df_n5_agg['std_topup_amount'].fillna(0)
+    df['topup_amount'] = pd.to_numeric(df['topup_amount'], errors='coerce').fillna(0)
+    return df
 
-    print(f"  ✓ Aggregated: {len(df_n5_agg):,} subscriber-months")
-    print(f"  ✓ Subscribers with topup: {df_n5_agg['isdn'].nunique():,}")
 
+N5_AGG_SPEC = [
+    ('topup_count', 'topup_amount', 'count'),
+    ('total_topup_amount', 'topup_amount', 'sum'),
+    ('avg_topup_amount', 'topup_amount', 'mean'),
+    ('std_topup_amount', 'topup_amount', 'std'),
+    ('max_topup_amount', 'topup_amount', 'max'),
+    ('most_used_topup_channel', 'topup_channel', 'mode'),
+]
 
-# ==================== LOAD N2 (PACKAGE DATA) ====================
-print("\n" + "="*100)
-print("STEP 4: LOAD N2 (PACKAGE DATA)")
-print("="*100)
-
-df_n2 = parallel_load_csvs('N2', 'N2 - Package', MONTHS_FILTER)
-
-df_n2_agg = pd.DataFrame()
-if not df_n2.empty:
-    print("\n  Aggregating N2 by (isdn, month)...")
-
-    # Convert price to numeric
-    df_n2['package_price'] = pd.to_numeric(df_n2['package_price'], errors='coerce').fillna(0)
-    df_n2['package_cycle'] = pd.to_numeric(df_n2['package_cycle'], errors='coerce').fillna(0)
 
-    # Count active and renewed packages
-    df_n2['is_active'] = 1
-    df_n2['is_renewed'] = df_n2['package_renewal_datetime'].notna().astype(int)
+def aggregate_n5_source(clock, row_filter, months):
+    step_banner("STEP 3: LOAD N5 (TOPUP DATA)")
 
-    # Aggregate
-    df_n2_agg = df_n2.groupby(['isdn', 'data_month'], as_index=False).agg({
-        'package_code': 'count',  # num_packages
-        'package_price': ['sum', 'mean', 'max'],
-        'package_cycle': 'mean',
-        'is_active': 'sum',
-        'is_renewed': 'sum'
-    })
+    df_n5_agg = pd.DataFrame()
+    if SOURCE_STREAMING['N5']:
+        df_n5_agg = stream_aggregate_csvs('N5', 'N5 - Topup', N5_AGG_SPEC, prepare_n5, months, row_filter)
+    else:
+        df_n5 = parallel_load_csvs('N5', 'N5 - Topup', months, row_filter)
+        clock.mark_loaded()
 
-    # Flatten column names
-    df_n2_agg.columns = ['isdn', 'data_month', 'num_packages', 'total_package_value',
-                         'avg_package_price', 'max_package_price', 'avg_package_cycle',
-                         'num_active_packages', 'num_renewed_packages']
+        if not df_n5.empty:
+            print("\n  Aggregating N5 by (isdn_id, month)...")
+            df_n5 = prepare_n5(df_n5)
 
-    print(f"  ✓ Aggregated: {len(df_n2_agg):,} subscriber-months")
-    print(f"  ✓ Subscribers with packages: {df_n2_agg['isdn'].nunique():,}")
+            # Aggregate by subscriber-month
+            df_n5_agg = df_n5.groupby(['isdn_id', 'data_month']).agg({
+                'topup_amount': ['count', 'sum', 'mean', 'std', 'max']
+            })
 
+            # Flatten column names
+            df_n5_agg.columns = ['topup_count', 'total_topup_amount',
+                                 'avg_topup_amount', 'std_topup_amount', 'max_topup_amount']
 
-# ==================== LOAD N1 (ARPU DATA) ====================
-print("\n" + "="*100)
-print("STEP 5: LOAD N1 (ARPU DATA)")
-print("="*100)
+            # Most used channel: vectorized grouped mode (ties -> smallest value)
+            df_n5_agg['most_used_topup_channel'] = grouped_mode(df_n5, ['isdn_id', 'data_month'], 'topup_channel')
+            df_n5_agg = df_n5_agg.reset_index()
+            del df_n5
 
-df_n1 = parallel_load_csvs('N1', 'N1 - ARPU', MONTHS_FILTER)
+    if not df_n5_agg.empty:
+        # Fill NaN std with 0
+        df_n5_agg['std_topup_amount'] = df_n5_agg['std_topup_amount'].fillna(0)
 
-df_n1_agg = pd.DataFrame()
-if not df_n1.empty:
-    print("\n  Processing N1 ARPU data...")
+        print(f"  ✓ Aggregated: {len(df_n5_agg):,} subscriber-months")
+        print(f"  ✓ Subscribers with topup: {df_n5_agg['isdn_id'].nunique():,}")
+    return df_n5_agg, {}
 
-    # Convert ARPU columns to numeric
-    arpu_cols = ['arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total']
-    for col in arpu_cols:
-        if col in df_n1.columns:
-            df_n1[col] = pd.to_numeric(df_n1[col], errors='coerce').fillna(0)
 
-    # Group by isdn and month (already have data_month from load)
-    df_n1_agg = df_n1[['isdn', 'data_month', 'arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total']].copy()
+# ---------- N2 (PACKAGE DATA) ----------
+def prepare_n2(df):
+    """Row-level N2 transforms"""
+    # Convert price to numeric
+    df['package_price'] = pd.to_numeric(df['package_price'], errors='coerce').fillna(0)
+    df['package_cycle'] = pd.to_numeric(df['package_cycle'], errors='coerce').fillna(0)
 
-    print(f"  ✓ ARPU data: {len(df_n1_agg):,} subscriber-months")
-    print(f"  ✓ Subscribers with ARPU: {df_n1_agg['isdn'].nunique():,}")
+    # Count active and renewed packages
+    df['is_active'] = 1
+    df['is_renewed'] = df['package_renewal_datetime'].notna().astype(int)
+    return df
+
+
+N2_AGG_SPEC = [
+    ('num_packages', 'package_code', 'count'),
+    ('total_package_value', 'package_price', 'sum'),
+    ('avg_package_price', 'package_price', 'mean'),
+    ('max_package_price', 'package_price', 'max'),
+    ('avg_package_cycle', 'package_cycle', 'mean'),
+    ('num_active_packages', 'is_active', 'sum'),
+    ('num_renewed_packages', 'is_renewed', 'sum'),
+]
 
 
-# ==================== LOAD N3 (USAGE DATA) ====================
-print("\n" + "="*100)
-print("STEP 6: LOAD N3 (USAGE DATA)")
-print("="*100)
+def aggregate_n2_source(clock, row_filter, months):
+    step_banner("STEP 4: LOAD N2 (PACKAGE DATA)")
 
-df_n3 = parallel_load_csvs('N3', 'N3 - Usage', MONTHS_FILTER)
+    df_n2_agg = pd.DataFrame()
+    if SOURCE_STREAMING['N2']:
+        df_n2_agg = stream_aggregate_csvs('N2', 'N2 - Package', N2_AGG_SPEC, prepare_n2, months, row_filter)
+    else:
+        df_n2 = parallel_load_csvs('N2', 'N2 - Package', months, row_filter)
+        clock.mark_loaded()
+
+        if not df_n2.empty:
+            print("\n  Aggregating N2 by (isdn_id, month)...")
+            df_n2 = prepare_n2(df_n2)
+
+            # Aggregate
+            df_n2_agg = df_n2.groupby(['isdn_id', 'data_month'], as_index=False).agg({
+                'package_code': 'count',  # num_packages
+                'package_price': ['sum', 'mean', 'max'],
+                'package_cycle': 'mean',
+                'is_active': 'sum',
+                'is_renewed': 'sum'
+            })
+
+            # Flatten column names
+            df_n2_agg.columns = ['isdn_id', 'data_month', 'num_packages', 'total_package_value',
+                                 'avg_package_price', 'max_package_price', 'avg_package_cycle',
+                                 'num_active_packages', 'num_renewed_packages']
+            del df_n2
+
+    if not df_n2_agg.empty:
+        print(f"  ✓ Aggregated: {len(df_n2_agg):,} subscriber-months")
+        print(f"  ✓ Subscribers with packages: {df_n2_agg['isdn_id'].nunique():,}")
+    return df_n2_agg, {}
+
+
+# ---------- N1 (ARPU DATA) ----------
+def aggregate_n1_source(clock, row_filter, months):
+    step_banner("STEP 5: LOAD N1 (ARPU DATA)")
+
+    df_n1 = parallel_load_csvs('N1', 'N1 - ARPU', months, row_filter)
+    clock.mark_loaded()
+
+    df_n1_agg = pd.DataFrame()
+    if not df_n1.empty:
+        print("\n  Processing N1 ARPU data...")
+
+        # Convert ARPU columns to numeric
+        arpu_cols = ['arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total']
+        for col in arpu_cols:
+            if col in df_n1.columns:
+                df_n1[col] = pd.to_numeric(df_n1[col], errors='coerce').fillna(0)
+
+        # Group by isdn and month (already have data_month from load)
+        df_n1_agg = df_n1[['isdn_id', 'data_month', 'arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total']].copy()
+
+        print(f"  ✓ ARPU data: {len(df_n1_agg):,} subscriber-months")
+        print(f"  ✓ Subscribers with ARPU: {df_n1_agg['isdn_id'].nunique():,}")
+    return df_n1_agg, {}
+
+
+# ---------- N3 (USAGE DATA) ----------
+N3_AGG_SPEC = [
+    ('n3_record_count', 'isdn_id', 'size'),
+]
 
-df_n3_agg = pd.DataFrame()
-if not df_n3.empty:
-    print("\n  Aggregating N3 by (isdn, month)...")
 
-    # Just count number of usage records per subscriber-month
-    df_n3_agg = df_n3.groupby(['isdn', 'data_month'], as_index=False).size()
-    df_n3_agg.columns = ['isdn', 'data_month', 'n3_record_count']
+def aggregate_n3_source(clock, row_filter, months):
+    step_banner("STEP 6: LOAD N3 (USAGE DATA)")
 
-    print(f"  ✓ Aggregated: {len(df_n3_agg):,} subscriber-months")
-    print(f"  ✓ Subscribers with usage: {df_n3_agg['isdn'].nunique():,}")
+    df_n3_agg = pd.DataFrame()
+    if SOURCE_STREAMING['N3']:
+        df_n3_agg = stream_aggregate_csvs('N3', 'N3 - Usage', N3_AGG_SPEC, None, months, row_filter)
+    else:
+        df_n3 = parallel_load_csvs('N3', 'N3 - Usage', months, row_filter)
+        clock.mark_loaded()
+
+        if not df_n3.empty:
+            print("\n  Aggregating N3 by (isdn_id, month)...")
+
+            # Just count number of usage records per subscriber-month
+            df_n3_agg = df_n3.groupby(['isdn_id', 'data_month'], as_index=False).size()
+            df_n3_agg.columns = ['isdn_id', 'data_month', 'n3_record_count']
+            del df_n3
+
+    if not df_n3_agg.empty:
+        print(f"  ✓ Aggregated: {len(df_n3_agg):,} subscriber-months")
+        print(f"  ✓ Subscribers with usage: {df_n3_agg['isdn_id'].nunique():,}")
+    return df_n3_agg, {}
+
+
+SOURCE_TASKS = {
+    'N10': load_n10_source,
+    'N4': aggregate_n4_source,
+    'N5': aggregate_n5_source,
+    'N2': aggregate_n2_source,
+    'N1': aggregate_n1_source,
+    'N3': aggregate_n3_source,
+}
 
+# Sources folded chunk by chunk in streaming mode (bounded by one file at a time)
+STREAMED_SOURCES = {'N4', 'N5', 'N2', 'N3'}
 
-# ==================== MERGE ALL DATA ====================
-print("\n" + "="*100)
-print("STEP 7: MERGING ALL DATA SOURCES")
-print("="*100)
+# Whether each scheduled source is streamed in this run (decided by schedule_sources)
+SOURCE_STREAMING = {}
 
-# Start with N10 as base
-master = df_n10.copy()
-print(f"  [Base] N10: {len(master):,} records")
-
-# Merge N1 (ARPU) - FIRST to ensure ARPU data is available
-if not df_n1_agg.empty:
-    master = master.merge(df_n1_agg, on=['isdn', 'data_month'], how='left')
-    print(f"  [+N1] After merge: {len(master):,} records")
-
-# Merge N4 (Advance)
-if not df_n4_agg.empty:
-    master = master.merge(df_n4_agg, on=['isdn', 'data_month'], how='left')
-    print(f"  [+N4] After merge: {len(master):,} records")
-
-# Merge N5 (Topup)
-if not df_n5_agg.empty:
-    master = master.merge(df_n5_agg, on=['isdn', 'data_month'], how='left')
-    print(f"  [+N5] After merge: {len(master):,} records")
-
-# Merge N2 (Package)
-if not df_n2_agg.empty:
-    master = master.merge(df_n2_agg, on=['isdn', 'data_month'], how='left')
-    print(f"  [+N2] After merge: {len(master):,} records")
-
-# Merge N3 (Usage)
-if not df_n3_agg.empty:
-    master = master.merge(df_n3_agg, on=['isdn', 'data_month'], how='left')
-    print(f"  [+N3] After merge: {len(master):,} records")
-
-# Fill NaN values
-print("\n  Filling missing values...")
-
-# Numeric columns - fill with 0
-numeric_cols = [
-    'arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total',
-    'advance_count', 'total_advance_amount', 'avg_advance_amount', 'max_advance_amount',
-    'total_repayment_amount', 'avg_repayment_rate', 'outstanding_debt',
-    'topup_count', 'total_topup_amount', 'avg_topup_amount', 'std_topup_amount', 'max_topup_amount',
-    'num_packages', 'total_package_value', 'avg_package_price', 'max_package_price',
-    'avg_package_cycle', 'num_active_packages', 'num_renewed_packages',
-    'n3_record_count'
-]
 
-for col in numeric_cols:
-    if col in master.columns:
-        master[col] = master[col].fillna(0)
+def source_streams(name, file_sizes):
+    """Streamed with --streaming, or under --max-memory when an in-memory load would not fit"""
+    if name not in STREAMED_SOURCES:
+        return False
+    if STREAMING:
+        return True
+    return MAX_MEMORY is not None and estimate_source_memory(file_sizes) > MAX_MEMORY // SOURCE_SLOTS
 
-# Boolean columns
-if 'has_advance_in_month' in master.columns:
-    master['has_advance_in_month'] = master['has_advance_in_month'].fillna(False)
 
-# String columns - fill with 'Unknown'
-if 'most_used_advance_service' in master.columns:
-    master['most_used_advance_service'] = master['most_used_advance_service'].fillna('Unknown')
-if 'most_used_topup_channel' in master.columns:
-    master['most_used_topup_channel'] = master['most_used_topup_channel'].fillna('Unknown')
+# Transformation parameters of each source; part of its aggregate cache fingerprint
+SOURCE_PARAMS = {
+    'N10': params_signature(dedupe_n10, load_n10_source),
+    'N4': params_signature(N4_SCALED_SERVICES, N4_AMOUNT_DIVISOR, N4_AGG_SPEC,
+                           prepare_n4, finalize_n4_agg, aggregate_n4_source, PartialAggregator),
+    'N5': params_signature(N5_AGG_SPEC, prepare_n5, aggregate_n5_source, PartialAggregator),
+    'N2': params_signature(N2_AGG_SPEC, prepare_n2, aggregate_n2_source, PartialAggregator),
+    'N1': params_signature(aggregate_n1_source),
+    'N3': params_signature(N3_AGG_SPEC, aggregate_n3_source, PartialAggregator),
+}
 
-print(f"  ✓ Final master dataset:")
-print(f"    Records: {len(master):,}")
-print(f"    Columns: {len(master.columns)}")
-print(f"    Unique subscribers: {master['isdn'].nunique():,}")
-print(f"    Months: {sorted(master['data_month'].unique())}")
+# Months each source task has to (re)compute in this run (cache misses)
+SOURCE_MONTHS = {}
+
+
+def run_source_task(name):
+    """Load + aggregate one source; in a worker the result goes back through an Arrow IPC file"""
+    clock = TaskClock()
+    # Event sources are semi-joined against N10 as each file / chunk is parsed
+    row_filter = SemiJoinFilter(ISDN_DICT, N10_KEYS) if name != 'N10' else None
+    df_out, stats = SOURCE_TASKS[name](clock, row_filter, SOURCE_MONTHS[name])
+    if row_filter is not None:
+        stats.update(row_filter.stats())
+        print(f"  🔎 Semi-join vs N10: dropped {stats['rows_dropped']:,} of {stats['rows_read']:,} rows "
+              f"({stats['dropped_share']:.1%})")
+        for month, share in stats['unknown_isdn_months'].items():
+            print(f"  ⚠️  {name} {month}: {share:.1%} of rows have an isdn that is not in the ISDN dictionary "
+                  f"- check the file's isdn column")
+    clock.mark_finished()
+    if os.getpid() != MAIN_PID:
+        df_out = write_ipc_handoff(df_out, f"{name}_agg")
+    return (df_out, stats), clock.as_dict()
+
+
+def source_fingerprints(name, upstream=None):
+    """Per-month fingerprint: input files + transformation parameters (+ upstream state)"""
+    entries = source_month_entries(name, MONTHS_FILTER)
+    return {
+        month: fingerprint(name, SOURCE_PARAMS[name], *sorted(entries[month]), *(upstream or {}).get(month, ()))
+        for month in MONTHS_FILTER
+    }
+
+
+def source_checkpoint_key(month_fingerprints):
+    return fingerprint(*sorted(month_fingerprints.items()))
+
+
+def plan_from_cache(names, fingerprints, results):
+    """
+    Sources already completed in this run are restored from their checkpoint
+    into `results`; for the others, reuse cached (source, month) results whose
+    fingerprint still matches
+    """
+    cached = {}
+    for name in names:
+        if CHECKPOINTS.done(f'source-{name}', source_checkpoint_key(fingerprints[name])):
+            frames, stats = CHECKPOINTS.load(f'source-{name}')
+            results[name] = (frames['df'], stats)
+            SOURCE_MONTHS[name] = []
+            print(f"  ⏩ {name:<4} restored from run {RUN_ID} checkpoint")
+            continue
+        cached[name] = {}
+        stale = []
+        for month in MONTHS_FILTER:
+            df = load_cached(name, month, fingerprints[name][month]) if USE_AGG_CACHE else None
+            if df is None:
+                stale.append(month)
+            else:
+                cached[name][month] = df
+        SOURCE_MONTHS[name] = stale
+        state = "all months cached" if not stale else f"recompute {stale}"
+        print(f"  📦 {name:<4} {len(cached[name])}/{len(MONTHS_FILTER)} months cached - {state}")
+    return cached
+
+
+def schedule_sources(names):
+    names = [name for name in names if SOURCE_MONTHS[name]]
+    estimates = {}
+    for name in names:
+        sizes = [Path(f).stat().st_size for f in list_source_files(name, SOURCE_MONTHS[name])]
+        SOURCE_STREAMING[name] = source_streams(name, sizes)
+        if SOURCE_STREAMING[name] and not STREAMING:
+            print(f"  💾 {name}: ~{estimate_source_memory(sizes) / 1024**3:.1f} GB in memory exceeds its "
+                  f"share of --max-memory - streaming with spill to disk")
+        estimates[name] = estimate_source_memory(sizes, streaming=SOURCE_STREAMING[name])
+    if SCHEDULER == 'concurrent' and len(names) > 1:
+        return run_sources(names, run_source_task, estimates, MEMORY_BUDGET)
+    return run_sources_sequential(names, run_source_task, estimates)
+
+
+def complete_source(name, df_new, stats, cached_months, fingerprints, results):
+    """Add the cached months back and checkpoint the finished source"""
+    results[name] = (combine(list(cached_months.values()) + [df_new]), stats)
+    CHECKPOINTS.save(f'source-{name}', {'df': results[name][0]}, stats,
+                     key=source_checkpoint_key(fingerprints[name]))
+
+
+def collect_source_runs(source_runs, cached, fingerprints, results, timings):
+    """Receive recomputed sources, persist them per month and checkpoint each as it completes"""
+    for name, (df_out, stats), log_text, timing in source_runs:
+        if isinstance(df_out, str):
+            df_out = read_ipc_handoff(df_out)
+        print(log_text, end='')
+        for month, df_month in split_months(df_out, SOURCE_MONTHS[name]).items():
+            save_cached(name, month, df_month, fingerprints[name][month])
+        complete_source(name, df_out, stats, cached[name], fingerprints, results)
+        timings[name] = timing
+
+    # Sources served entirely from the aggregate cache
+    for name, months in cached.items():
+        if name not in results:
+            complete_source(name, pd.DataFrame(), {}, months, fingerprints, results)
+
+
+# ==================== LOAD + AGGREGATE SOURCES ====================
+# Persistent isdn -> isdn_id dictionary; every later step joins and groups on isdn_id
+ISDN_DICT = IsdnDictionary.load(ISDN_DICTIONARY_FILE)
+
+# Event aggregates depend on the N10 keys they were filtered against and on the
+# ISDN dictionary their isdn_id values come from
+N10_FINGERPRINTS = {'N10': source_fingerprints('N10')}
+EVENT_SOURCES = [name for name in SOURCE_FOLDERS if name != 'N10']
+upstream = {month: (N10_FINGERPRINTS['N10'][month], ISDN_DICT.uid) for month in MONTHS_FILTER}
+EVENT_FINGERPRINTS = {name: source_fingerprints(name, upstream) for name in EVENT_SOURCES}
+
+# The merged master depends on every source fingerprint
+MERGE_KEY = fingerprint(*(
+    f"{name}|{month}|{value}"
+    for fingerprints in (N10_FINGERPRINTS, EVENT_FINGERPRINTS)
+    for name, months in fingerprints.items()
+    for month, value in sorted(months.items())
+))
+
+master = None
+if CHECKPOINTS.done('merge', MERGE_KEY):
+    master = CHECKPOINTS.load('merge')[0]['master']
+    print(f"\n⏩ Run {RUN_ID}: sources already loaded and merged ({len(master):,} records) - resuming at STEP 8")
+
+if master is None:
+    source_results = {}
+    source_timings = {}
+
+    # N10 first: it defines the ISDN dictionary and the (isdn_id, month) keys the
+    # event sources are filtered against
+    print("\n📦 Aggregate cache:")
+    cached = plan_from_cache(['N10'], N10_FINGERPRINTS, source_results)
+    collect_source_runs(schedule_sources(['N10']), cached, N10_FINGERPRINTS, source_results, source_timings)
+
+    df_n10 = source_results.pop('N10')[0]
+    if not df_n10.empty:
+        new_ids = ISDN_DICT.extend(df_n10['isdn'])
+        df_n10 = encode_isdn(df_n10, ISDN_DICT)
+        print(f"\n  ✓ ISDN dictionary: {len(ISDN_DICT):,} ids ({new_ids:,} new)")
+    # Saved right away (append-only): cached and checkpointed event aggregates
+    # refer to these ids, also when this run fails later
+    ISDN_DICT.save(ISDN_DICTIONARY_FILE)
+
+    # Membership of N10 (isdn_id, data_month) keys; inherited by the event-source workers
+    N10_KEYS = SubscriberMonthBitmap(df_n10['isdn_id'].to_numpy(), df_n10['data_month'].to_numpy(), len(ISDN_DICT))
+    print(f"  ✓ N10 key bitmap: {len(N10_KEYS.bits)} months, {N10_KEYS.nbytes / 1024**2:.1f} MB")
+
+    print()
+    cached = plan_from_cache(EVENT_SOURCES, EVENT_FINGERPRINTS, source_results)
+
+    # Event sources, concurrently under the memory budget
+    if SCHEDULER == 'concurrent':
+        FILE_WORKERS = max(1, NUM_WORKERS // len(EVENT_SOURCES))
+    collect_source_runs(schedule_sources(EVENT_SOURCES), cached, EVENT_FINGERPRINTS, source_results, source_timings)
+
+    if source_timings:
+        print("\n⏱ Source timeline (load / aggregate per source):")
+        print(format_timeline(source_timings))
+
+    print("\n🔎 Rows dropped by the N10 semi-join (no matching subscriber-month, recomputed months):")
+    for name in EVENT_SOURCES:
+        stats = source_results[name][1]
+        print(f"  {name:<4} {stats.get('rows_dropped', 0):>14,} of {stats.get('rows_read', 0):>14,} "
+              f"({stats.get('dropped_share', 0.0):.1%})")
+
+    df_n4_agg, df_n5_agg, df_n2_agg, df_n1_agg, df_n3_agg = [
+        source_results[name][0] for name in ['N4', 'N5', 'N2', 'N1', 'N3']
+    ]
+    del source_results
+
+
+    # ==================== MERGE ALL DATA ====================
+    print("\n" + "="*100)
+    print("STEP 7: MERGING ALL DATA SOURCES")
+    print("="*100)
+
+    # Defaults for subscriber-months without a record in a source
+    # Numeric columns - fill with 0
+    numeric_cols = [
+        'arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total',
+        'advance_count', 'total_advance_amount', 'avg_advance_amount', 'max_advance_amount',
+        'total_repayment_amount', 'avg_repayment_rate', 'outstanding_debt',
+        'topup_count', 'total_topup_amount', 'avg_topup_amount', 'std_topup_amount', 'max_topup_amount',
+        'num_packages', 'total_package_value', 'avg_package_price', 'max_package_price',
+        'avg_package_cycle', 'num_active_packages', 'num_renewed_packages',
+        'n3_record_count'
+    ]
+    fill_defaults = {col: 0 for col in numeric_cols}
+    # Boolean columns
+    fill_defaults['has_advance_in_month'] = False
+    # String columns - fill with 'Unknown'
+    fill_defaults['most_used_advance_service'] = 'Unknown'
+    fill_defaults['most_used_topup_channel'] = 'Unknown'
+
+    # Start with N10 as base; N1 (ARPU) FIRST to ensure ARPU data is available.
+    # All sources are aligned to the base in one keyed pass, filling defaults as they go
+    print(f"  [Base] N10: {len(df_n10):,} records")
+    master = multiway_left_join(df_n10, [
+        ('N1', df_n1_agg),
+        ('N4', df_n4_agg),
+        ('N5', df_n5_agg),
+        ('N2', df_n2_agg),
+        ('N3', df_n3_agg),
+    ], fill_defaults)
+    del df_n10
+
+    # Output contract: rows sorted by (isdn_id, data_month) so Phase 2 can skip its
+    # sort and readers can prune row groups by isdn_id range
+    master = sort_master(master)
+    # One row per (isdn_id, data_month); checked again by every parquet write
+    assert_unique_keys(master)
+
+    print(f"  ✓ Final master dataset:")
+    print(f"    Records: {len(master):,}")
+    print(f"    Columns: {len(master.columns)}")
+    print(f"    Unique subscribers: {master['isdn_id'].nunique():,}")
+    print(f"    Months: {sorted(master['data_month'].unique())}")
+
+    # Checkpoint: a failure while writing resumes here without reloading any source
+    CHECKPOINTS.save('merge', {'master': master}, key=MERGE_KEY)
 
 
 # ==================== SAVE ====================
@@ -393,29 +1007,47 @@ print("\n" + "="*100)
 print("STEP 8: SAVING MASTER FILE")
 print("="*100)
 
-# Generate output filename - fixed name for Phase 2 input
-output_file = OUTPUT_DIR / 'master_full_202503-202508.parquet'
-
-master.to_parquet(output_file, compression='snappy', index=False)
+# The dictionary was saved right after N10: the partitions reference its ids
+print(f"\n💾 ISDN dictionary: {ISDN_DICTIONARY_FILE} ({len(ISDN_DICT):,} ids)")
 
-file_size_mb = output_file.stat().st_size / (1024 * 1024)
+# Month-partitioned master dataset (read by Phase 2); only the months built in
+# this run are replaced, other partitions are left untouched
+written = write_master_partitions(master, MASTER_DATASET_DIR, MONTH_FINGERPRINTS, args.row_group_size)
 
-print(f"\n💾 Saved:")
-print(f"  File: {output_file.name}")
-print(f"  Path: {output_file}")
-print(f"  Size: {file_size_mb:.1f} MB")
+print(f"\n💾 Saved partitions:")
+print(f"  Dataset: {MASTER_DATASET_DIR}")
+for month, part in written.items():
+    part_size_mb = part.stat().st_size / (1024 * 1024)
+    print(f"  data_month={month}: {part_size_mb:.1f} MB")
 print(f"  Records: {len(master):,}")
 print(f"  Columns: {len(master.columns)}")
+print(f"  Sorted by (isdn_id, data_month), row groups of {args.row_group_size:,} rows")
+
+# Single-file copy for legacy readers; an incremental run only holds the
+# rebuilt months, so the combined file is not rewritten then
+output_file = OUTPUT_DIR / 'master_full_202503-202508.parquet'
+if not INCREMENTAL:
+    write_sorted_parquet(master, output_file, args.row_group_size)
+
+    file_size_mb = output_file.stat().st_size / (1024 * 1024)
+
+    print(f"\n💾 Saved:")
+    print(f"  File: {output_file.name}")
+    print(f"  Path: {output_file}")
+    print(f"  Size: {file_size_mb:.1f} MB")
 
 # Show column list
 print(f"\n📊 Columns in master file ({len(master.columns)}):")
 for i, col in enumerate(master.columns, 1):
     print(f"  {i:2d}. {col}")
 
+# Outputs are in place: the run's checkpoint frames are no longer needed
+CHECKPOINTS.finish()
+
 elapsed = datetime.now() - start_time
 print(f"\n⏱ Total time: {elapsed}")
 print("="*100)
 print("✅ PHASE 1 COMPLETED")
 print("="*100)
-print(f"\nOutput file: {output_file}")
-print("\nNext step: Run Phase 2 to create features from this master file")
+print(f"\nOutput dataset: {MASTER_DATASET_DIR}")
+print("\nNext step: Run Phase 2 to create features from this master dataset")
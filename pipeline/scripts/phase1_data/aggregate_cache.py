@@ -0,0 +1,97 @@
+"""
+PHASE 1 HELPER: PER-SOURCE AGGREGATE CACHE
+Every source's per-month result (the N10 base frame, df_n4_agg, df_n5_agg, ...)
+is persisted as its own artifact:
+
+    /data/ut360/staging/aggregates/
+        N4/data_month=202505.parquet
+        N5/data_month=202505.parquet
+        ...
+
+Each artifact stores a fingerprint of everything it was computed from: the
+source's input files for that month (path, size, mtime, schema), the
+transformation parameters (aggregation spec, correction rules, code of the
+prepare step) and, for event sources, the N10 inputs and ISDN dictionary they
+were semi-joined against. On rerun only (source, month) pairs whose
+fingerprint changed are recomputed.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+AGGREGATE_CACHE_DIR = Path('/data/ut360/staging/aggregates')
+FINGERPRINT_KEY = b'ut360.aggregate_fingerprint'
+
+
+def params_signature(*parts):
+    """
+    Stable text for transformation parameters. Functions contribute their
+    source code, so editing a prepare/finalize step invalidates the cache.
+    """
+    rendered = []
+    for part in parts:
+        if callable(part):
+            rendered.append(inspect.getsource(part))
+        else:
+            rendered.append(json.dumps(part, sort_keys=True, default=str))
+    return hashlib.sha1("\n".join(rendered).encode()).hexdigest()
+
+
+def fingerprint(*parts):
+    return hashlib.sha1("\n".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def cache_path(source, month, cache_dir=AGGREGATE_CACHE_DIR):
+    return Path(cache_dir) / source / f'data_month={month}.parquet'
+
+
+def load_cached(source, month, expected, cache_dir=AGGREGATE_CACHE_DIR):
+    """Cached frame for (source, month) if its fingerprint matches, else None"""
+    path = cache_path(source, month, cache_dir)
+    if not path.exists():
+        return None
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(FINGERPRINT_KEY, b'').decode() != expected:
+            return None
+        return pd.read_parquet(path)
+    except Exception:
+        return None
+
+
+def save_cached(source, month, df, value, cache_dir=AGGREGATE_CACHE_DIR):
+    """Atomically write one (source, month) artifact tagged with its fingerprint"""
+    path = cache_path(source, month, cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + f'.tmp{os.getpid()}')
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[FINGERPRINT_KEY] = value.encode()
+    pq.write_table(table.replace_schema_metadata(metadata), tmp, compression='snappy')
+    os.replace(tmp, path)
+    return path
+
+
+def split_months(df, months):
+    """One frame per month (empty frames for months without rows)"""
+    if df.empty or 'data_month' not in df.columns:
+        return {month: df.iloc[0:0] for month in months}
+    return {month: df[df['data_month'] == month] for month in months}
+
+
+def combine(frames):
+    """Concatenate per-month frames, skipping empty ones"""
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,106 @@
+"""
+PHASE 1 HELPER: VECTORIZED GROUPED MODE
+"Most frequent X per group" without a Python lambda per group:
+values are turned into categorical codes, occurrences are counted per
+(group, code) with numpy, and the winning code is the argmax per group.
+
+Ties go to the smallest value (same as Series.mode()[0]), so results are
+deterministic regardless of row order or how the input was chunked.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Above this many (group x category) cells, counts are kept sparse instead of
+# in a dense n_groups x n_categories table
+DENSE_CELL_LIMIT = 20_000_000
+
+
+def sorted_codes(values):
+    """
+    Codes such that code order == sorted value order; -1 marks missing values.
+    Categorical input reuses its codes (remapped to lexical category order).
+    Returns (codes, uniques).
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories.to_numpy()
+        order = np.argsort(categories, kind='stable')
+        remap = np.empty(len(categories), dtype=np.int64)
+        remap[order] = np.arange(len(categories))
+        raw = values.cat.codes.to_numpy().astype(np.int64)
+        codes = np.where(raw >= 0, remap[raw.clip(min=0)], -1)
+        return codes, categories[order]
+
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), np.asarray(uniques, dtype=object)
+
+
+def argmax_code_per_group(group_ids, codes, n_groups, n_codes, weights=None):
+    """
+    Winning code per group (highest total weight, smallest code on ties).
+    Groups without any valid value get -1.
+    """
+    valid = (group_ids >= 0) & (codes >= 0)
+    g = group_ids[valid].astype(np.int64)
+    c = codes[valid].astype(np.int64)
+    w = weights[valid] if weights is not None else None
+
+    winners = np.full(n_groups, -1, dtype=np.int64)
+    if n_groups == 0 or n_codes == 0 or len(g) == 0:
+        return winners
+
+    cells = g * n_codes + c
+    if n_groups * n_codes <= DENSE_CELL_LIMIT:
+        table = np.bincount(cells, weights=w, minlength=n_groups * n_codes).reshape(n_groups, n_codes)
+        best = table.argmax(axis=1)  # argmax returns the first (= smallest) code on ties
+        has_value = table.max(axis=1) > 0
+        winners[has_value] = best[has_value]
+        return winners
+
+    uniq_cells, inverse = np.unique(cells, return_inverse=True)
+    totals = np.bincount(inverse, weights=w)
+    cell_groups = uniq_cells // n_codes
+    cell_codes = uniq_cells % n_codes
+    order = np.lexsort((cell_codes, -totals, cell_groups))
+    cell_groups = cell_groups[order]
+    cell_codes = cell_codes[order]
+    first = np.r_[True, cell_groups[1:] != cell_groups[:-1]]
+    winners[cell_groups[first]] = cell_codes[first]
+    return winners
+
+
+def _decode(winners, uniques, default):
+    result = np.full(len(winners), default, dtype=object)
+    found = winners >= 0
+    result[found] = uniques[winners[found]]
+    return result
+
+
+def grouped_mode(df, keys, col, default='Unknown'):
+    """
+    Most frequent value of `col` per `keys` group.
+    Returns an object Series indexed like df.groupby(keys).agg(...) (sorted keys),
+    so it can be assigned straight onto an aggregate built with the same keys.
+    """
+    grouped = df.groupby(keys, sort=True)
+    group_ids = grouped.ngroup().to_numpy()
+    index = grouped.size().index
+
+    codes, uniques = sorted_codes(df[col])
+    winners = argmax_code_per_group(group_ids, codes, len(index), len(uniques))
+    return pd.Series(_decode(winners, uniques, default), index=index, name=col)
+
+
+def mode_from_counts(counts, keys, col, count_col, default='Unknown'):
+    """
+    Same as grouped_mode, but from pre-counted (keys, value, count) rows such as
+    the merged category counts of a streaming aggregation.
+    """
+    grouped = counts.groupby(keys, sort=True)
+    group_ids = grouped.ngroup().to_numpy()
+    index = grouped.size().index
+
+    codes, uniques = sorted_codes(counts[col])
+    winners = argmax_code_per_group(group_ids, codes, len(index), len(uniques),
+                                    weights=counts[count_col].to_numpy(dtype=np.float64))
+    return pd.Series(_decode(winners, uniques, default), index=index, name=col)
@@ -0,0 +1,113 @@
+"""
+PHASE 1 HELPER: MULTI-WAY KEYED LEFT JOIN
+Align every per-source aggregate to the N10 base in one pass instead of a
+chain of DataFrame.merge calls (each of which copies the growing master).
+
+(isdn_id, data_month) is encoded once into a dense int64 key over the base rows.
+Each source is mapped onto that key space, sorted, and looked up with
+np.searchsorted; matched values are gathered with the column default as the
+fill value, so missing-value filling happens in the same pass.
+Peak memory is about one copy of the output plus one int64 array per source.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+
+KEYS = ['isdn_id', 'data_month']
+
+
+def encode_base_keys(base):
+    """
+    Dense int64 key per base row plus the encoders needed to map other frames
+    onto the same key space.
+    """
+    isdn_codes, isdn_uniques = pd.factorize(base['isdn_id'])
+    month_codes, month_uniques = pd.factorize(base['data_month'])
+    n_months = max(len(month_uniques), 1)
+    keys = isdn_codes.astype(np.int64) * n_months + month_codes.astype(np.int64)
+    encoder = (pd.Index(isdn_uniques), pd.Index(month_uniques), n_months)
+    return keys, encoder
+
+
+def encode_keys(frame, encoder):
+    """Key of each row of `frame` in the base key space; -1 if (isdn_id, month) is not in the base"""
+    isdn_index, month_index, n_months = encoder
+    isdn_codes = isdn_index.get_indexer(frame['isdn_id']).astype(np.int64)
+    month_codes = month_index.get_indexer(frame['data_month']).astype(np.int64)
+    keys = isdn_codes * n_months + month_codes
+    keys[(isdn_codes < 0) | (month_codes < 0)] = -1
+    return keys
+
+
+def lookup_positions(base_keys, source_keys):
+    """Row position in the source for each base key (-1 when absent). Source keys must be unique."""
+    if len(source_keys) == 0:
+        return np.full(len(base_keys), -1, dtype=np.int64)
+    order = np.argsort(source_keys, kind='stable')
+    sorted_keys = source_keys[order]
+    pos = np.searchsorted(sorted_keys, base_keys).clip(max=len(sorted_keys) - 1)
+    return np.where(sorted_keys[pos] == base_keys, order[pos], -1)
+
+
+def gather_column(values, positions, default):
+    """Take values at positions, filling -1 with the default (or NA when default is None)"""
+    if isinstance(values.dtype, np.dtype):
+        values = values.to_numpy()
+        if default is None:
+            return take(values, positions, allow_fill=True)
+        return take(values, positions, allow_fill=True, fill_value=default)
+    gathered = values.array.take(positions, allow_fill=True)
+    return gathered if default is None else gathered.fillna(default)
+
+
+def has_unique_keys(frame):
+    return not frame.duplicated(subset=KEYS).any()
+
+
+def _join_unique_sources(base, sources, defaults):
+    base_keys, encoder = encode_base_keys(base)
+    columns = {col: base[col].array for col in base.columns}
+    for name, frame in sources:
+        positions = lookup_positions(base_keys, encode_keys(frame, encoder))
+        matched = int((positions >= 0).sum())
+        for col in frame.columns:
+            if col in KEYS:
+                continue
+            columns[col] = gather_column(frame[col], positions, defaults.get(col))
+        print(f"  [+{name}] matched {matched:,} / {len(base):,} base records")
+    return pd.DataFrame(columns, index=base.index)
+
+
+def multiway_left_join(base, sources, defaults):
+    """
+    Left-join every (name, frame) in `sources` onto `base` on (isdn_id, data_month),
+    filling unmatched rows from `defaults` (column -> value).
+
+    Sources whose keys are unique (all per-source aggregates) are joined together
+    in one pass. A source with duplicate keys would fan out base rows, so it is
+    joined with DataFrame.merge at its position in the order, keeping the
+    result identical to the successive left merges.
+    """
+    master = base
+    pending = []
+    for name, frame in sources:
+        if frame.empty:
+            continue
+        if has_unique_keys(frame):
+            pending.append((name, frame))
+            continue
+
+        if pending:
+            master = _join_unique_sources(master, pending, defaults)
+            pending = []
+        print(f"  ⚠ {name} has duplicate (isdn_id, data_month) keys - using merge")
+        master = master.merge(frame, on=KEYS, how='left')
+        for col in frame.columns:
+            if col not in KEYS and defaults.get(col) is not None:
+                master[col] = master[col].fillna(defaults[col])
+        print(f"  [+{name}] After merge: {len(master):,} records")
+
+    if pending:
+        master = _join_unique_sources(master, pending, defaults)
+    return master
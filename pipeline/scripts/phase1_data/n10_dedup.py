@@ -0,0 +1,66 @@
+"""
+PHASE 1 HELPER: ONE N10 ROW PER (isdn, data_month)
+N10 snapshots can list a subscriber more than once in a month (status changes,
+re-activations, exact repeats). The master is one row per subscriber-month,
+so duplicates are resolved here, before the merge, with a fixed precedence:
+
+  1. subscriber_status: ACTIF > SUSP > any other / missing status
+     (a subscriber active at any point of the month counts as active)
+  2. latest activation_date  (the most recent subscription record)
+  3. latest expire_date
+  4. subscriber_type: POS > PRE > other
+     (a subscriber with any postpaid record is not treated as prepaid)
+  5. status_detail, ascending  (final tie-break, makes the result order-free)
+
+Rows that are complete duplicates collapse to one. The result does not depend
+on file or row order, so chunked / cached loads pick the same row.
+"""
+
+import numpy as np
+import pandas as pd
+
+STATUS_PRIORITY = {'ACTIF': 0, 'SUSP': 1}
+TYPE_PRIORITY = {'POS': 0, 'PRE': 1}
+
+
+def _rank(values, priority):
+    """Map values to their priority (unlisted and missing values rank last)"""
+    return pd.Series(values, copy=False).astype(object).map(priority).fillna(len(priority)).to_numpy()
+
+
+def _desc_date(values):
+    """Sort key for 'latest first' (missing dates last)"""
+    ts = pd.to_datetime(values, errors='coerce')
+    key = -ts.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+    key[pd.isna(ts)] = np.inf
+    return key
+
+
+def dedupe_n10(df, keys=('isdn', 'data_month')):
+    """
+    Keep one row per key using the documented precedence.
+    Returns (deduplicated frame, number of rows dropped).
+    Only rows whose key is duplicated are ranked.
+    """
+    keys = list(keys)
+    dup_mask = df.duplicated(subset=keys, keep=False).to_numpy()
+    if not dup_mask.any():
+        return df, 0
+
+    dups = df[dup_mask]
+    order_frame = pd.DataFrame({
+        **{k: dups[k].to_numpy() for k in keys},
+        '__status': _rank(dups['subscriber_status'], STATUS_PRIORITY) if 'subscriber_status' in dups else 0,
+        '__activation': _desc_date(dups['activation_date']) if 'activation_date' in dups else 0,
+        '__expire': _desc_date(dups['expire_date']) if 'expire_date' in dups else 0,
+        '__type': _rank(dups['subscriber_type'], TYPE_PRIORITY) if 'subscriber_type' in dups else 0,
+        '__detail': dups['status_detail'].astype(str).to_numpy() if 'status_detail' in dups else '',
+    }, index=dups.index)
+    order_frame = order_frame.sort_values(
+        keys + ['__status', '__activation', '__expire', '__type', '__detail'], kind='stable'
+    )
+    winners = order_frame.index[~order_frame.duplicated(subset=keys, keep='first').to_numpy()]
+
+    keep = ~dup_mask
+    keep[df.index.get_indexer(winners)] = True
+    return df[keep], int(len(df) - keep.sum())
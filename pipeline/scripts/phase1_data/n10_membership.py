@@ -0,0 +1,94 @@
+"""
+PHASE 1 HELPER: SEMI-JOIN PREFILTER AGAINST THE N10 BASE
+The master is a left join onto N10, so event rows (N4, N5, N2, N1, N3) whose
+(isdn, data_month) is not in N10 can never reach the output. They are dropped
+right after each file / chunk is parsed, before any aggregation work.
+
+Membership is one packed bitset per month over the dense isdn_id space
+(1 bit per subscriber per month, ~12 MB per month for 100M ids), so a
+lookup is a couple of vectorized array operations with no hashing.
+
+Rows whose isdn is not in the ISDN dictionary at all are counted per month;
+a month where most rows are unknown points at a malformed isdn column rather
+than at subscribers missing from N10, and is reported as a warning.
+"""
+
+import numpy as np
+
+UNKNOWN_ISDN_WARN_SHARE = 0.5
+
+
+class SubscriberMonthBitmap:
+    """Set of (isdn_id, data_month) keys present in N10"""
+
+    def __init__(self, isdn_ids, months, n_ids):
+        self.n_ids = int(n_ids)
+        self.bits = {}
+        isdn_ids = np.asarray(isdn_ids, dtype=np.int64)
+        months = np.asarray(months)
+        for month in np.unique(months):
+            present = np.zeros(self.n_ids, dtype=bool)
+            present[isdn_ids[months == month]] = True
+            self.bits[str(month)] = np.packbits(present)
+
+    @property
+    def nbytes(self):
+        return sum(bits.nbytes for bits in self.bits.values())
+
+    def contains(self, isdn_ids, months):
+        """Boolean mask: is each (isdn_id, month) pair in the base?"""
+        isdn_ids = np.asarray(isdn_ids, dtype=np.int64)
+        months = np.asarray(months)
+        result = np.zeros(len(isdn_ids), dtype=bool)
+        valid = (isdn_ids >= 0) & (isdn_ids < self.n_ids)
+        for month in np.unique(months):
+            bits = self.bits.get(str(month))
+            if bits is None:
+                continue
+            rows = np.flatnonzero(valid & (months == month))
+            ids = isdn_ids[rows]
+            result[rows] = ((bits[ids >> 3] >> (7 - (ids & 7))) & 1).astype(bool)
+        return result
+
+
+class SemiJoinFilter:
+    """
+    Applied to every parsed file / chunk of an event source: maps isdn to the
+    global isdn_id and keeps only rows whose (isdn_id, data_month) is in N10.
+    Counts what it reads and drops for the Phase 1 report.
+    """
+
+    def __init__(self, isdn_dict, bitmap):
+        self.isdn_dict = isdn_dict
+        self.bitmap = bitmap
+        self.rows_read = 0
+        self.rows_dropped = 0
+        self.month_rows = {}     # data_month -> rows read
+        self.month_unknown = {}  # data_month -> rows whose isdn is not in the dictionary
+
+    def __call__(self, df):
+        ids = self.isdn_dict.encode(df['isdn'])
+        months = df['data_month'].to_numpy()
+        keep = self.bitmap.contains(ids, months)
+        self.rows_read += len(df)
+        self.rows_dropped += int(len(df) - keep.sum())
+        unknown = ids < 0
+        for month in np.unique(months):
+            in_month = months == month
+            month = str(month)
+            self.month_rows[month] = self.month_rows.get(month, 0) + int(in_month.sum())
+            self.month_unknown[month] = self.month_unknown.get(month, 0) + int((unknown & in_month).sum())
+
+        df = df.drop(columns='isdn')
+        df.insert(0, 'isdn_id', ids)
+        return df[keep] if not keep.all() else df
+
+    def unknown_months(self):
+        """{data_month: share of rows with an unknown isdn} for months above UNKNOWN_ISDN_WARN_SHARE"""
+        return {month: self.month_unknown[month] / rows for month, rows in sorted(self.month_rows.items())
+                if rows and self.month_unknown[month] / rows > UNKNOWN_ISDN_WARN_SHARE}
+
+    def stats(self):
+        share = self.rows_dropped / self.rows_read if self.rows_read else 0.0
+        return {'rows_read': self.rows_read, 'rows_dropped': self.rows_dropped, 'dropped_share': share,
+                'unknown_isdn_months': self.unknown_months()}
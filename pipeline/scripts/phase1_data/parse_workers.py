@@ -0,0 +1,58 @@
+"""
+PHASE 1 HELPER: PROCESS-POOL CSV PARSING
+pd.read_csv holds the GIL for most of its Python-side work, so a thread pool
+keeps only one or two cores busy. Files are parsed in worker processes instead
+and handed back as uncompressed Arrow IPC files on /dev/shm, which the parent
+memory-maps rather than unpickling a DataFrame.
+"""
+
+import os
+import time
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+
+from source_schemas import read_csv_projected
+from staging_cache import read_csv_staged, stringify_object_columns
+
+HANDOFF_DIR = Path('/dev/shm') if Path('/dev/shm').is_dir() else Path('/tmp')
+
+
+def parse_csv_to_ipc(file_path, schema=None, staging_dir=None, handoff_dir=HANDOFF_DIR):
+    """
+    Worker: parse one CSV with its source schema (through the staging cache
+    when staging_dir is set) and write it as an Arrow IPC file.
+    Returns (ipc_path, record_count, parse_seconds, cache_hit).
+    """
+    start = time.perf_counter()
+    if staging_dir is not None:
+        df, cache_hit = read_csv_staged(file_path, staging_dir, schema)
+    else:
+        df, cache_hit = read_csv_projected(file_path, schema), False
+
+    ipc_path = write_ipc_handoff(df, Path(file_path).name, handoff_dir)
+    return ipc_path, len(df), time.perf_counter() - start, cache_hit
+
+
+def write_ipc_handoff(df, tag, handoff_dir=HANDOFF_DIR):
+    """Worker: write a DataFrame as an uncompressed Arrow IPC file; returns its path"""
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        table = pa.Table.from_pandas(stringify_object_columns(df), preserve_index=False)
+
+    ipc_path = Path(handoff_dir) / f"ut360_{tag}.{os.getpid()}.{uuid.uuid4().hex[:8]}.arrow"
+    with pa.OSFile(str(ipc_path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return str(ipc_path)
+
+
+def read_ipc_handoff(ipc_path):
+    """Parent: map a worker's Arrow IPC file into a DataFrame and remove the file"""
+    try:
+        with pa.memory_map(ipc_path, 'r') as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    finally:
+        os.unlink(ipc_path)
@@ -0,0 +1,200 @@
+"""
+PHASE 1 HELPER: CHUNKED PARTIAL AGGREGATION
+Fold CSV chunks into mergeable per-(isdn_id, data_month) partial aggregates
+(count, sum, max, mean + M2, counts per category) so peak memory depends
+on the number of distinct keys, not on the raw row count.
+
+std keeps (count, mean, M2 = sum of squared deviations from the mean) per
+partial, merged with Chan et al.'s parallel formula, instead of a running
+sum of squares: sumsq - sum^2/n cancels catastrophically for large values
+with a small spread.
+"""
+
+import numpy as np
+import pandas as pd
+
+from grouped_mode import mode_from_counts
+
+KEYS = ['isdn_id', 'data_month']
+
+# Mergeable state columns needed by each statistic
+STATES_FOR_OP = {
+    'size': [],
+    'count': ['count'],
+    'sum': ['sum'],
+    'mean': ['count', 'sum'],
+    'max': ['max'],
+    'std': ['count', 'avg', 'm2'],
+}
+
+# How two partial states of the same key are combined
+MERGE_RULES = {
+    'count': 'sum',
+    'sum': 'sum',
+    'max': 'max',
+    # avg / m2 are first brought to the merged mean (merge_moments), then:
+    'avg': 'first',
+    'm2': 'sum',
+}
+
+SIZE_STATE = '__size'
+
+
+def merge_moments(combined, col):
+    """
+    Prepare the (count, avg, m2) partials of `col` in `combined` (several rows
+    per key) for a plain groupby merge: avg becomes the key's merged mean and
+    each m2 absorbs its partial's spread around it (Chan et al.):
+        M2 = sum(M2_i) + sum(n_i * (mean_i - mean)^2)
+    """
+    keys = combined.index.names
+    n = combined[f'{col}__count'].astype('float64')
+    avg = combined[f'{col}__avg']
+    total = n.groupby(level=keys, sort=False).transform('sum')
+    weighted = (n * avg).where(n > 0, 0.0).groupby(level=keys, sort=False).transform('sum')
+    mean = weighted / total.where(total > 0)
+    spread = (n * (avg - mean) ** 2).where(n > 0, 0.0)
+    combined[f'{col}__m2'] = combined[f'{col}__m2'] + spread
+    combined[f'{col}__avg'] = mean
+
+
+class PartialAggregator:
+    """
+    Accumulate per-(isdn_id, data_month) partial aggregates chunk by chunk.
+
+    spec: list of (output_col, input_col, op), op in
+          size / count / sum / mean / max / std / mode.
+    Partials are re-reduced whenever more than `compact_rows` partial rows are
+    buffered, so memory stays proportional to the number of distinct keys.
+    """
+
+    def __init__(self, spec, compact_rows=2_000_000):
+        self.spec = spec
+        self.compact_rows = compact_rows
+        self.rows_seen = 0
+
+        self.states = {}
+        self.mode_cols = []
+        for _, col, op in spec:
+            if op == 'mode':
+                if col not in self.mode_cols:
+                    self.mode_cols.append(col)
+            elif op not in STATES_FOR_OP:
+                raise ValueError(f"Unsupported aggregation op: {op}")
+            else:
+                col_states = self.states.setdefault(col, [])
+                for state in STATES_FOR_OP[op]:
+                    if state not in col_states:
+                        col_states.append(state)
+
+        self._partials = []
+        self._partial_rows = 0
+        self._mode_partials = {col: [] for col in self.mode_cols}
+        self._mode_rows = {col: 0 for col in self.mode_cols}
+
+    # ---------- folding ----------
+    def add(self, chunk):
+        """Fold one raw chunk (already tagged with data_month) into the state"""
+        if chunk.empty:
+            return
+        self.rows_seen += len(chunk)
+
+        work = chunk
+        named = {SIZE_STATE: (KEYS[0], 'size')}
+        for col, col_states in self.states.items():
+            for state in col_states:
+                if state == 'avg':
+                    named[f'{col}__avg'] = (col, 'mean')
+                elif state == 'm2':
+                    if work is chunk:
+                        work = chunk.copy()
+                    values = work[col].astype('float64')
+                    deviation = values - values.groupby([work[key] for key in KEYS], sort=False).transform('mean')
+                    work[f'{col}__dev2'] = deviation ** 2
+                    named[f'{col}__m2'] = (f'{col}__dev2', 'sum')
+                else:
+                    named[f'{col}__{state}'] = (col, state)
+
+        partial = work.groupby(KEYS, sort=False).agg(**named)
+        self._push_partial(partial)
+
+        for col in self.mode_cols:
+            counts = chunk.groupby(KEYS + [col], sort=False, observed=True).size()
+            self._push_mode_partial(col, counts)
+
+    def merge(self, other):
+        """Merge another aggregator built with the same spec (e.g. one per file)"""
+        self.rows_seen += other.rows_seen
+        if other._partials:
+            self._push_partial(other._reduce_partials())
+        for col in self.mode_cols:
+            if other._mode_partials[col]:
+                self._push_mode_partial(col, other._reduce_mode(col))
+
+    def _push_partial(self, partial):
+        self._partials.append(partial)
+        self._partial_rows += len(partial)
+        if self._partial_rows > self.compact_rows and len(self._partials) > 1:
+            reduced = self._reduce_partials()
+            self._partials = [reduced]
+            self._partial_rows = len(reduced)
+
+    def _push_mode_partial(self, col, counts):
+        self._mode_partials[col].append(counts)
+        self._mode_rows[col] += len(counts)
+        if self._mode_rows[col] > self.compact_rows and len(self._mode_partials[col]) > 1:
+            reduced = self._reduce_mode(col)
+            self._mode_partials[col] = [reduced]
+            self._mode_rows[col] = len(reduced)
+
+    def _reduce_partials(self):
+        if len(self._partials) == 1:
+            return self._partials[0]
+        combined = pd.concat(self._partials)
+        for col, col_states in self.states.items():
+            if 'm2' in col_states:
+                merge_moments(combined, col)
+        rules = {SIZE_STATE: 'sum'}
+        for col in combined.columns:
+            if col != SIZE_STATE:
+                rules[col] = MERGE_RULES[col.rsplit('__', 1)[1]]
+        return combined.groupby(level=KEYS, sort=False).agg(rules)
+
+    def _reduce_mode(self, col):
+        parts = self._mode_partials[col]
+        if len(parts) == 1:
+            return parts[0]
+        return pd.concat(parts).groupby(level=list(range(len(KEYS) + 1)), sort=False).sum()
+
+    # ---------- finalize ----------
+    def finalize(self):
+        """Turn the merged partial state into the final aggregate frame"""
+        if not self._partials:
+            return pd.DataFrame(columns=KEYS + [out for out, _, _ in self.spec])
+
+        state = self._reduce_partials()
+        result = pd.DataFrame(index=state.index)
+
+        for out_col, col, op in self.spec:
+            if op == 'size':
+                result[out_col] = state[SIZE_STATE]
+            elif op in ('count', 'sum', 'max'):
+                result[out_col] = state[f'{col}__{op}']
+            elif op == 'mean':
+                n = state[f'{col}__count']
+                result[out_col] = state[f'{col}__sum'] / n.where(n > 0)
+            elif op == 'std':
+                # Sample std (ddof=1) to match pandas .std()
+                n = state[f'{col}__count'].astype('float64')
+                result[out_col] = np.sqrt(state[f'{col}__m2'] / (n - 1).where(n > 1))
+            elif op == 'mode':
+                result[out_col] = self._finalize_mode(col).reindex(result.index).fillna('Unknown')
+
+        return result.reset_index()
+
+    def _finalize_mode(self, col):
+        """Most frequent value per key from the merged category counts"""
+        if not self._mode_partials[col]:
+            return pd.Series(dtype=object)
+        counts = self._reduce_mode(col).rename('__n').reset_index()
+        return mode_from_counts(counts, KEYS, col, '__n')
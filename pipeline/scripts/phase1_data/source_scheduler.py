@@ -0,0 +1,162 @@
+"""
+PHASE 1 HELPER: CONCURRENT PER-SOURCE SCHEDULER
+The event sources (N4, N5, N2, N1, N3) are independent of each other until the
+merge, so each one is loaded and aggregated in its own worker process. While
+one source is still reading files (I/O bound) another is already aggregating
+(CPU bound). Workers are forked, so they inherit the parent's state (the ISDN
+dictionary and the N10 key bitmap) without pickling it.
+
+Sources are admitted under a memory budget: a source starts only while the
+estimated footprint of all running sources fits the budget. A source that is
+larger than the whole budget still runs, but alone.
+The scheduler records when each source was queued, started, finished loading
+and finished aggregating, and renders that as a timeline for the run log.
+"""
+
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# In-memory pandas frames are several times larger than the CSV bytes
+IN_MEMORY_EXPANSION = 4.0
+
+
+def available_memory_bytes():
+    """MemAvailable from /proc/meminfo (falls back to total physical memory)"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def parse_memory_size(text):
+    """'64G', '512M', '1.5T' or plain bytes -> bytes"""
+    text = str(text).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+def estimate_source_memory(file_sizes, streaming=False):
+    """
+    Rough peak memory of loading + aggregating one source.
+    Streaming sources only hold one file's chunks at a time.
+    """
+    if not file_sizes:
+        return 0
+    raw = max(file_sizes) if streaming else sum(file_sizes)
+    return int(raw * IN_MEMORY_EXPANSION)
+
+
+class TaskClock:
+    """Wall-clock marks of one source task (epoch seconds, comparable across processes)"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.loaded = None
+        self.finished = None
+
+    def mark_loaded(self):
+        self.loaded = time.time()
+
+    def mark_finished(self):
+        self.finished = time.time()
+        if self.loaded is None:
+            self.loaded = self.started
+
+    def as_dict(self):
+        return {'started': self.started, 'loaded': self.loaded, 'finished': self.finished}
+
+
+def _run_captured(fn, name):
+    """Worker: run one source task, capturing its log so sources do not interleave"""
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        result = fn(name)
+    return result, buffer.getvalue()
+
+
+def run_sources(names, fn, estimates, budget_bytes, max_parallel=None):
+    """
+    Run fn(name) for every source in worker processes under a memory budget.
+    fn must return (payload, clock_dict). Yields
+    (name, payload, log_text, timing) in completion order; timing holds the
+    queued/started/loaded/finished marks and the memory estimate.
+    """
+    max_parallel = max_parallel or len(names)
+    pending = list(names)
+    running = {}
+    reserved = 0
+    queued_at = time.time()
+
+    # fork: the worker inherits the already configured script state
+    context = mp.get_context('fork')
+    with ProcessPoolExecutor(max_workers=max_parallel, mp_context=context) as executor:
+        while pending or running:
+            while pending and len(running) < max_parallel:
+                name = pending[0]
+                need = estimates.get(name, 0)
+                if running and reserved + need > budget_bytes:
+                    break
+                pending.pop(0)
+                reserved += need
+                running[executor.submit(_run_captured, fn, name)] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                reserved -= estimates.get(name, 0)
+                (payload, clock), log_text = future.result()
+                timing = dict(clock, queued=queued_at, estimate=estimates.get(name, 0))
+                yield name, payload, log_text, timing
+
+
+def run_sources_sequential(names, fn, estimates):
+    """Same contract as run_sources, in-process and one source at a time"""
+    queued_at = time.time()
+    for name in names:
+        payload, clock = fn(name)
+        timing = dict(clock, queued=queued_at, estimate=estimates.get(name, 0))
+        yield name, payload, '', timing
+
+
+def format_timeline(timings, width=50):
+    """
+    Timeline table + bar per source, relative to the first queue time.
+    Bars: '.' waiting for budget, '=' loading, '#' aggregating.
+    """
+    if not timings:
+        return ""
+    origin = min(t['queued'] for t in timings.values())
+    horizon = max(t['finished'] for t in timings.values()) - origin
+    scale = width / horizon if horizon > 0 else 0
+
+    lines = [f"  {'source':<6} {'wait':>7} {'load':>7} {'agg':>7} {'done@':>7} {'est.mem':>9}  timeline"]
+    for name, t in sorted(timings.items(), key=lambda item: item[1]['started']):
+        start = t['started'] - origin
+        loaded = t['loaded'] - origin
+        finished = t['finished'] - origin
+        queued = t['queued'] - origin
+
+        bar = [' '] * width
+        for pos in range(int(queued * scale), min(int(start * scale), width)):
+            bar[pos] = '.'
+        for pos in range(int(start * scale), min(int(loaded * scale), width)):
+            bar[pos] = '='
+        for pos in range(int(loaded * scale), min(max(int(finished * scale), int(loaded * scale) + 1), width)):
+            bar[pos] = '#'
+
+        lines.append(
+            f"  {name:<6} {start - queued:>6.1f}s {loaded - start:>6.1f}s {finished - loaded:>6.1f}s "
+            f"{finished:>6.1f}s {t['estimate'] / 1024**3:>7.2f}GB  |{''.join(bar)}|"
+        )
+    lines.append(f"  wall time: {horizon:.1f}s   ('.' wait  '=' load  '#' aggregate)")
+    return "\n".join(lines)
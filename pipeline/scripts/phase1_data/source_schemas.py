@@ -0,0 +1,160 @@
+"""
+PHASE 1 HELPER: SOURCE SCHEMA REGISTRY
+Declarative schema per data source: which columns Phase 1 actually uses,
+which of them must be present, their dtypes (categoricals for low-cardinality
+strings) and date formats. Loaders read only the projected columns.
+
+Numeric columns are left to inference on purpose: every aggregation step
+already coerces them with pd.to_numeric(errors='coerce'), and a forced float
+dtype would make a single malformed value fail the whole file.
+N6/N7/N8 are accepted on the command line but not loaded by Phase 1, so they
+have no schema.
+
+Raw drops may arrive compressed (N4_202503.csv.gz, N4_202503.csv.zst). pandas
+decompresses them as a stream while parsing, so a compressed file is never
+expanded on disk and several files decompress in parallel in the parsing
+workers. .csv.zst needs the optional `zstandard` package.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import pandas as pd
+
+# Accepted raw file suffixes -> read_csv compression (plain CSV first: preferred
+# when the same drop exists both plain and compressed)
+CSV_SUFFIXES = {
+    '.csv': None,
+    '.csv.gz': 'gzip',
+    '.csv.zst': 'zstd',
+}
+
+SOURCE_SCHEMAS = {
+    'N10': {
+        'columns': ['isdn', 'subscriber_type', 'subscriber_status', 'status_detail',
+                    'activation_date', 'expire_date'],
+        'required': ['isdn'],
+        'dtypes': {'subscriber_type': 'category', 'subscriber_status': 'category'},
+        'dates': {'activation_date': '%d/%m/%Y', 'expire_date': '%d/%m/%Y'},
+    },
+    'N1': {
+        'columns': ['isdn', 'arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total'],
+        'required': ['isdn'],
+        'dtypes': {},
+        'dates': {},
+    },
+    'N2': {
+        'columns': ['isdn', 'package_code', 'package_price', 'package_cycle',
+                    'package_renewal_datetime'],
+        'required': ['isdn', 'package_code', 'package_price', 'package_cycle',
+                     'package_renewal_datetime'],
+        'dtypes': {'package_code': 'category'},
+        'dates': {},
+    },
+    # Only the key is needed: n3_record_count is a row count per (isdn, month)
+    'N3': {
+        'columns': ['isdn'],
+        'required': ['isdn'],
+        'dtypes': {},
+        'dates': {},
+    },
+    'N4': {
+        'columns': ['isdn', 'amount', 'source', 'advance_service_type'],
+        'required': ['isdn', 'amount', 'source', 'advance_service_type'],
+        'dtypes': {'source': 'category', 'advance_service_type': 'category'},
+        'dates': {},
+    },
+    'N5': {
+        'columns': ['isdn', 'topup_amount', 'topup_channel'],
+        'required': ['isdn', 'topup_amount', 'topup_channel'],
+        'dtypes': {'topup_channel': 'category'},
+        'dates': {},
+    },
+}
+
+
+def get_schema(folder_name):
+    """Schema for a source folder, or None to load every column with inference"""
+    return SOURCE_SCHEMAS.get(folder_name)
+
+
+def schema_signature(schema):
+    """Stable short hash of a schema, used to key cached copies of projected files"""
+    if schema is None:
+        return 'full'
+    return hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:8]
+
+
+def csv_compression(file_path):
+    """read_csv compression for a raw file name (None for plain CSV)"""
+    name = Path(file_path).name.lower()
+    for suffix, compression in CSV_SUFFIXES.items():
+        if compression is not None and name.endswith(suffix):
+            return compression
+    return None
+
+
+def csv_base_name(file_path):
+    """File name without its CSV / compression suffix (N4_202503.csv.gz -> N4_202503)"""
+    name = Path(file_path).name
+    for suffix in sorted(CSV_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def glob_source_files(folder_path, folder_name):
+    """
+    Raw files of one source folder ({folder}_*.csv / .csv.gz / .csv.zst), sorted.
+    A drop present in several forms is loaded once, from the first suffix in CSV_SUFFIXES.
+    """
+    chosen = {}
+    for suffix in CSV_SUFFIXES:
+        for path in sorted(Path(folder_path).glob(f'{folder_name}_*{suffix}')):
+            chosen.setdefault(csv_base_name(path), str(path))
+    return sorted(chosen.values())
+
+
+def csv_read_options(schema):
+    """read_csv keyword arguments implementing the projection and dtypes"""
+    if schema is None:
+        return {'low_memory': False}
+    wanted = set(schema['columns'])
+    return {
+        'usecols': lambda col: col in wanted,
+        'dtype': dict(schema['dtypes']),
+        'low_memory': False,
+    }
+
+
+def apply_schema(df, schema, source_name=''):
+    """Validate required columns, order projected columns and parse dates"""
+    if schema is None:
+        return df
+
+    missing = [col for col in schema['required'] if col not in df.columns]
+    if missing:
+        raise ValueError(f"{source_name} missing required columns: {missing}")
+
+    ordered = [col for col in schema['columns'] if col in df.columns]
+    if list(df.columns) != ordered:
+        df = df[ordered]
+    for col, fmt in schema['dates'].items():
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], format=fmt, errors='coerce')
+    for col, dtype in schema['dtypes'].items():
+        if col in df.columns and str(df[col].dtype) != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def read_csv_projected(file_path, schema, **read_csv_kwargs):
+    """Read only the schema's columns with its dtypes and date formats applied"""
+    options = csv_read_options(schema)
+    options['compression'] = csv_compression(file_path)
+    options.update(read_csv_kwargs)
+    if 'chunksize' in options:
+        return (apply_schema(chunk, schema, str(file_path))
+                for chunk in pd.read_csv(file_path, **options))
+    return apply_schema(pd.read_csv(file_path, **options), schema, str(file_path))
@@ -0,0 +1,154 @@
+"""
+PHASE 1 HELPER: MEMORY-BOUNDED PARTIAL AGGREGATION WITH SPILL TO DISK
+A PartialAggregator keeps one partial row per distinct (isdn_id, data_month),
+so a month with an unusually large N3 / N5 drop can still outgrow RAM.
+SpillingAggregator watches the size of its buffered partial state; once it
+exceeds `memory_limit`, the state is hash-partitioned by isdn_id and written
+to local disk:
+
+    <spill_dir>/agg-XXXX/
+        state.p000.000000.parquet     # partial states, partition 0
+        mode-col.p000.000001.parquet  # category counts, partition 0
+        ...
+
+A key always lands in the same partition, so finalize() merges and finalizes
+one partition at a time: peak memory is about 1/n_partitions of the full
+state. Results are identical to the in-memory path; only row order differs
+(the master is sorted afterwards anyway).
+"""
+
+import itertools
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from partial_aggregation import KEYS, PartialAggregator
+
+MODE_COUNT = '__n'
+
+
+class SpillingAggregator(PartialAggregator):
+    """PartialAggregator that spills hash partitions of its state above memory_limit bytes"""
+
+    def __init__(self, spec, memory_limit, spill_dir, n_partitions=32, compact_rows=2_000_000):
+        super().__init__(spec, compact_rows)
+        self.memory_limit = int(memory_limit)
+        self.spill_root = Path(spill_dir)
+        self.n_partitions = int(n_partitions)
+        self.spill_count = 0
+        self.spilled_bytes = 0
+        self._spill_dir = None
+        self._spilled = [[] for _ in range(self.n_partitions)]  # (kind, path) per partition
+        self._file_seq = itertools.count()
+
+    # ---------- memory accounting ----------
+    def state_bytes(self):
+        """Bytes held by the buffered partial states and category counts"""
+        total = sum(int(p.memory_usage(index=True).sum()) for p in self._partials)
+        for parts in self._mode_partials.values():
+            total += sum(int(s.memory_usage(index=True)) for s in parts)
+        return total
+
+    def _push_partial(self, partial):
+        super()._push_partial(partial)
+        self._maybe_spill()
+
+    def _push_mode_partial(self, col, counts):
+        super()._push_mode_partial(col, counts)
+        self._maybe_spill()
+
+    def _maybe_spill(self):
+        if self.state_bytes() > self.memory_limit:
+            self.spill()
+
+    # ---------- spilling ----------
+    def _ensure_dir(self):
+        if self._spill_dir is None:
+            self.spill_root.mkdir(parents=True, exist_ok=True)
+            self._spill_dir = Path(tempfile.mkdtemp(prefix='agg-', dir=self.spill_root))
+        return self._spill_dir
+
+    def _file_path(self, kind, partition):
+        return self._ensure_dir() / f'{kind}.p{partition:03d}.{next(self._file_seq):06d}.parquet'
+
+    def _write_partitions(self, frame, kind):
+        """Split a flat state frame by isdn_id hash and append each piece to its partition"""
+        partition = frame['isdn_id'].to_numpy() % self.n_partitions
+        order = np.argsort(partition, kind='stable')
+        bounds = np.searchsorted(partition[order], np.arange(self.n_partitions + 1))
+        for p in range(self.n_partitions):
+            rows = order[bounds[p]:bounds[p + 1]]
+            if len(rows) == 0:
+                continue
+            path = self._file_path(kind, p)
+            frame.iloc[rows].to_parquet(path, index=False)
+            self.spilled_bytes += path.stat().st_size
+            self._spilled[p].append((kind, path))
+
+    def spill(self):
+        """Write the whole in-memory state to the partition files and release it"""
+        if self._partials:
+            self._write_partitions(self._reduce_partials().reset_index(), 'state')
+            self._partials = []
+            self._partial_rows = 0
+        for col in self.mode_cols:
+            if self._mode_partials[col]:
+                counts = self._reduce_mode(col).rename(MODE_COUNT).reset_index()
+                self._write_partitions(counts, f'mode-{col}')
+                self._mode_partials[col] = []
+                self._mode_rows[col] = 0
+        self.spill_count += 1
+
+    def merge(self, other):
+        """Merge another aggregator; its spilled partitions are moved over as files"""
+        if isinstance(other, SpillingAggregator) and other.spill_count:
+            if other.n_partitions != self.n_partitions:
+                raise ValueError("Cannot merge spilled aggregators with different partition counts")
+            for p, entries in enumerate(other._spilled):
+                for kind, path in entries:
+                    target = self._file_path(kind, p)
+                    shutil.move(path, target)
+                    self._spilled[p].append((kind, target))
+            self.spill_count += other.spill_count
+            self.spilled_bytes += other.spilled_bytes
+            other._spilled = [[] for _ in range(other.n_partitions)]
+            other.cleanup()
+        super().merge(other)
+
+    def cleanup(self):
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    # ---------- finalize ----------
+    def finalize(self):
+        """In-memory finalize if nothing was spilled, else merge + finalize partition by partition"""
+        if not self.spill_count:
+            return super().finalize()
+
+        self.spill()
+        results = []
+        try:
+            for p in range(self.n_partitions):
+                part = PartialAggregator(self.spec, self.compact_rows)
+                for kind, path in self._spilled[p]:
+                    frame = pd.read_parquet(path)
+                    if kind == 'state':
+                        part._push_partial(frame.set_index(KEYS))
+                    else:
+                        col = kind[len('mode-'):]
+                        part._push_mode_partial(col, frame.set_index(KEYS + [col])[MODE_COUNT])
+                    path.unlink()
+                df_part = part.finalize()
+                if not df_part.empty:
+                    results.append(df_part)
+        finally:
+            self._spilled = [[] for _ in range(self.n_partitions)]
+            self.cleanup()
+
+        if not results:
+            return super().finalize()
+        return pd.concat(results, ignore_index=True)
@@ -0,0 +1,91 @@
+"""
+PHASE 1 HELPER: PARQUET STAGING CACHE
+Each raw N*_YYYYMM.csv is parsed once and kept as a typed, compressed Parquet
+copy keyed by (path, size, mtime, source schema). Later runs read the columnar
+copy instead of re-parsing the CSV; a changed or replaced CSV, or a changed
+schema projection, gets a new key automatically.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from source_schemas import read_csv_projected, schema_signature
+
+STAGING_DIR = Path('/data/ut360/staging')
+
+
+def _path_digest(file_path):
+    return hashlib.sha1(str(Path(file_path).resolve()).encode()).hexdigest()[:8]
+
+
+def staging_key(file_path, schema=None):
+    """Cache key derived from the absolute path, size and mtime of the raw file and its schema"""
+    p = Path(file_path).resolve()
+    st = p.stat()
+    raw = f"{p}|{st.st_size}|{st.st_mtime_ns}|{schema_signature(schema)}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def staged_path(file_path, staging_dir=STAGING_DIR, schema=None):
+    """Location of the Parquet copy for the current version of file_path"""
+    name = Path(file_path).name
+    return Path(staging_dir) / f"{name}.{_path_digest(file_path)}.{staging_key(file_path, schema)}.parquet"
+
+
+def lookup_staged(file_path, staging_dir=STAGING_DIR, schema=None):
+    """Return the Parquet copy of file_path if it is up to date, else None"""
+    target = staged_path(file_path, staging_dir, schema)
+    return target if target.exists() else None
+
+
+def stringify_object_columns(df):
+    """Mixed-type object columns cannot be typed by Arrow; keep them as strings"""
+    fixed = df.copy()
+    for col in fixed.select_dtypes(include='object').columns:
+        fixed[col] = fixed[col].where(fixed[col].isna(), fixed[col].astype(str))
+    return fixed
+
+
+def _write_staged(df, target):
+    """Write atomically and drop copies staged from older versions of the same file"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + f".tmp{os.getpid()}")
+
+    try:
+        df.to_parquet(tmp, compression='snappy', index=False)
+    except (TypeError, ValueError):
+        stringify_object_columns(df).to_parquet(tmp, compression='snappy', index=False)
+    os.replace(tmp, target)
+
+    prefix = target.name.rsplit('.', 2)[0]
+    for stale in target.parent.glob(f"{prefix}.*.parquet"):
+        if stale != target:
+            stale.unlink(missing_ok=True)
+
+
+def read_csv_staged(file_path, staging_dir=STAGING_DIR, schema=None):
+    """
+    Read a raw CSV (projected and typed by its schema) through the staging cache.
+    Returns (df, cache_hit).
+    """
+    cached = lookup_staged(file_path, staging_dir, schema)
+    if cached is not None:
+        return pd.read_parquet(cached), True
+
+    df = read_csv_projected(file_path, schema)
+    try:
+        _write_staged(df, staged_path(file_path, staging_dir, schema))
+    except Exception as e:
+        print(f"  ⚠ Could not stage {Path(file_path).name}: {e}")
+    return df, False
+
+
+def iter_staged_chunks(staged_file, chunk_size):
+    """Yield DataFrame chunks of a staged Parquet copy (bounded memory)"""
+    parquet_file = pq.ParquetFile(staged_file)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
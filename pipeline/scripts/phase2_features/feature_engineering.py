@@ -4,236 +4,443 @@ NO LOOPS - Pure vectorized operations for 50M records
 """
 
 import pandas as pd
-import numpy as np
 from pathlib import Path
 from datetime import datetime
+import argparse
+import hashlib
+import json
+import shutil
+import sys
+from multiprocessing import cpu_count
 import warnings
 warnings.filterwarnings('ignore')
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.master_dataset import (MASTER_DATASET_DIR, MASTER_SORT_ORDER, list_months, load_manifest,
+                                  parquet_sort_order, publish_partitions, read_master, resolve_months,
+                                  write_master_partitions, write_partition_part)
+from utils.isdn_dictionary import ISDN_DICTIONARY_FILE, IsdnDictionary
+from utils.run_checkpoints import RunCheckpoints, new_run_id
+from utils import kernels
+from utils.feature_store import (FEATURES_FILE, FLAG_BITSET_COLUMN, SNAPSHOT_ADVANCE_COLUMN, SNAPSHOT_FILE,
+                                 compact_features, ipc_path, load_features, write_feature_file, write_feature_ipc,
+                                 write_snapshot)
+from feature_state import (FEATURE_STATE_FILE, FEATURES_DATASET_DIR, WINDOW_SERIES, build_state, load_state,
+                           save_state)
+from feature_registry import WINDOW as WINDOW_INPUT, FeatureContext, downstream_requests
+from feature_tiers import (REGISTRY, SKETCH_FILE, THRESHOLD_COLS, THRESHOLDS_FILE, build_month_sketches,
+                           load_month_sketches, quiet, save_month_sketches, save_thresholds, thresholds_from_sketches,
+                           window_columns)
+from partition_runner import partition_rows, run_partitions
+
+parser = argparse.ArgumentParser(description='Phase 2: Feature engineering')
+parser.add_argument('--window-months', type=int, default=6,
+                    help='Number of latest master partitions to build features from')
+parser.add_argument('--months', nargs='*', help='Explicit months (YYYYMM) instead of the latest window')
+parser.add_argument('--run-id', default=None,
+                    help='Id of this run; checkpoints are kept under it (default: timestamp)')
+parser.add_argument('--resume', metavar='RUN_ID', default=None,
+                    help='Continue run RUN_ID after its last completed feature tier or partition')
+parser.add_argument('--incremental', action='store_true',
+                    help='Only compute the months after the saved feature state (full recompute if it is stale); '
+                         'earlier months keep the window features and threshold flags they were built with')
+parser.add_argument('--workers', type=int, default=None,
+                    help='Worker processes for the partitioned run (default: cpu_count; 1 = single process)')
+parser.add_argument('--partitions', type=int, default=16,
+                    help='isdn hash partitions computed independently (one output file per month each)')
+parser.add_argument('--features', nargs='*', default=None, metavar='NAME',
+                    help='Only compute these feature columns (and the features they depend on); '
+                         'written under feature_subsets/, not over the published features')
+parser.add_argument('--for-downstream', action='store_true',
+                    help='Only compute the columns the Phase 3 scripts declare as inputs '
+                         '(written under feature_subsets/ like --features)')
+parser.add_argument('--pack-flags', action='store_true',
+                    help=f'Store all 0/1 feature flags in one bitset column ({FLAG_BITSET_COLUMN}); '
+                         f'read with utils.feature_store.load_features')
+parser.add_argument('--no-ipc', action='store_true',
+                    help='Do not publish the memory-mappable Arrow IPC copy of the feature file')
+parser.add_argument('--kernels', choices=kernels.BACKENDS, default=None,
+                    help=f'Window kernel backend (default: ${kernels.BACKEND_ENV} or auto = numba if installed)')
+args = parser.parse_args()
+if args.kernels:
+    kernels.set_backend(args.kernels)
+
 print("="*100)
 print("PHASE 2: FEATURE ENGINEERING - OPTIMIZED (NO LOOPS)")
 print("="*100)
 
 # Config
-DATA_FILE = Path('/data/ut360/output/datasets/master_full_202503-202508.parquet')
+DATA_FILE = Path('/data/ut360/output/datasets/master_full_202503-202508.parquet')  # Legacy single-file master
 OUTPUT_DIR = Path('/data/ut360/output/datasets')
 
-start_time = datetime.now()
+WORKERS = args.workers or cpu_count()
+N_PARTITIONS = args.partitions
 
-# Load data
-print("\n[1/5] Loading data...")
-df = pd.read_parquet(DATA_FILE)
-print(f"  Records: {len(df):,}")
+start_time = datetime.now()
 
-# Sort for rolling operations
-df['month_int'] = df['data_month'].astype(int)
-df = df.sort_values(['isdn', 'month_int'])
-
-# ==================== TIER 1: ADVANCE HISTORY (11 features) ====================
-print("\n[2/5] TIER 1A: ADVANCE HISTORY...")
-
-# Rolling advance features (vectorized)
-for window in [1, 2, 3]:
-    df[f'advance_count_last_{window}m'] = (
-        df.groupby('isdn')['advance_count']
-        .rolling(window=window, min_periods=1)
-        .sum()
-        .shift(1)
-        .reset_index(0, drop=True)
-        .fillna(0)
-    )
-    print(f"  ✓ advance_count_last_{window}m")
-
-# Cumsum for history flag
-df['has_advance_history'] = (
-    df.groupby('isdn')['advance_count']
-    .cumsum()
-    .shift(1, fill_value=0) > 0
-).astype(int)
-print(f"  ✓ has_advance_history")
-
-# Months since last advance (simplified)
-# Mark months with advance
-df['had_advance'] = (df['advance_count'] > 0).astype(int)
-# Forward fill last advance month per subscriber
-df['last_advance_month'] = df[df['had_advance'] == 1].groupby('isdn')['month_int'].ffill()
-df['last_advance_month'] = df.groupby('isdn')['last_advance_month'].ffill()
-# Calculate difference
-df['months_since_last_advance'] = (df['month_int'] - df['last_advance_month']).fillna(99).astype(int)
-df = df.drop(columns=['had_advance', 'last_advance_month'])
-print(f"  ✓ months_since_last_advance")
-
-# Repayment indicators
-df['is_good_payer'] = (df['avg_repayment_rate'] >= 0.95).astype(int)
-df['has_outstanding_debt'] = (df['outstanding_debt'] > 0).astype(int)
-df['is_repeat_advancer'] = (df['advance_count'] > 1).astype(int)
-print(f"  ✓ is_good_payer, has_outstanding_debt, is_repeat_advancer")
-
-print(f"✅ Created 11 advance history features")
-
-# ==================== TIER 1B: TOPUP INTENSITY (15 features) ====================
-print("\n[3/5] TIER 1B: TOPUP INTENSITY...")
-
-# Frequency categories
-df['topup_freq_none'] = (df['topup_count'] == 0).astype(int)
-df['topup_freq_low'] = ((df['topup_count'] > 0) & (df['topup_count'] <= 2)).astype(int)
-df['topup_freq_medium'] = ((df['topup_count'] > 2) & (df['topup_count'] <= 5)).astype(int)
-df['topup_freq_high'] = (df['topup_count'] > 5).astype(int)
-print(f"  ✓ topup_freq categories")
-
-# Heavy user indicators
-topup_75 = df['topup_count'].quantile(0.75)
-df['is_heavy_topup_user'] = (df['topup_count'] > topup_75).astype(int)
-
-topup_amt_75 = df['total_topup_amount'].quantile(0.75)
-df['topup_amount_high'] = (df['total_topup_amount'] > topup_amt_75).astype(int)
-
-avg_topup_75 = df['avg_topup_amount'].quantile(0.75)
-df['avg_topup_high'] = (df['avg_topup_amount'] > avg_topup_75).astype(int)
-print(f"  ✓ is_heavy_topup_user, topup_amount_high, avg_topup_high")
-
-# Volatility
-df['topup_cv'] = np.where(
-    df['avg_topup_amount'] > 0,
-    df['std_topup_amount'] / df['avg_topup_amount'],
-    0
-)
-df['topup_is_stable'] = (df['topup_cv'] < 0.5).astype(int)
-print(f"  ✓ topup_cv, topup_is_stable")
-
-# Rolling topup (vectorized)
-for window in [1, 2, 3]:
-    df[f'topup_count_last_{window}m'] = (
-        df.groupby('isdn')['topup_count']
-        .rolling(window=window, min_periods=1)
-        .sum()
-        .shift(1)
-        .reset_index(0, drop=True)
-        .fillna(0)
-    )
-    df[f'topup_amount_last_{window}m'] = (
-        df.groupby('isdn')['total_topup_amount']
-        .rolling(window=window, min_periods=1)
-        .sum()
-        .shift(1)
-        .reset_index(0, drop=True)
-        .fillna(0)
-    )
-    print(f"  ✓ topup features last_{window}m")
-
-print(f"✅ Created 15 topup intensity features")
-
-# ==================== TIER 1C + 2: FINANCIAL & BEHAVIORAL (20 features) ====================
-print("\n[4/5] TIER 1C & 2: FINANCIAL + BEHAVIORAL...")
-
-# Financial indicators
-df['estimated_balance'] = df['total_topup_amount'] - df['total_package_value']
-df['balance_is_negative'] = (df['estimated_balance'] < 0).astype(int)
-df['balance_is_low'] = (df['estimated_balance'] < 50000).astype(int)
-print(f"  ✓ estimated_balance, balance_is_negative, balance_is_low")
-
-# Burn rate
-df['burn_rate'] = np.where(
-    df['total_topup_amount'] > 0,
-    df['total_package_value'] / df['total_topup_amount'],
-    999
-)
-df['burn_rate_capped'] = df['burn_rate'].clip(upper=5)
-df['burn_rate_high'] = (df['burn_rate'] > 1.0).astype(int)
-df['burn_rate_very_high'] = (df['burn_rate'] > 1.5).astype(int)
-print(f"  ✓ burn_rate features")
-
-# Financial stress composite
-df['financial_stress_score'] = (
-    df['balance_is_negative'].astype(int) +
-    df['burn_rate_high'].astype(int) +
-    df['has_outstanding_debt'].astype(int) +
-    (df['topup_count'] == 0).astype(int) +
-    (df['total_package_value'] > df['total_package_value'].quantile(0.9)).astype(int)
-)
-print(f"  ✓ financial_stress_score")
-
-# Activity
-df['is_active_user'] = (df['n3_record_count'] > 0).astype(int)
-df['usage_intensity'] = df['n3_record_count']
-print(f"  ✓ is_active_user, usage_intensity")
-
-# Package behavior
-df['has_multiple_packages'] = (df['num_packages'] > 1).astype(int)
-pkg_75 = df['total_package_value'].quantile(0.75)
-df['has_high_value_package'] = (df['total_package_value'] > pkg_75).astype(int)
-df['package_per_topup_ratio'] = np.where(
-    df['topup_count'] > 0,
-    df['num_packages'] / df['topup_count'],
-    0
-)
-print(f"  ✓ package features")
-
-# Profile
-df['is_prepaid'] = (df['subscriber_type'] == 'PRE').astype(int)
-df['is_active_status'] = (df['subscriber_status'] == 'ACTIF').astype(int)
-print(f"  ✓ is_prepaid, is_active_status")
-
-# Tenure (if available)
-if 'activation_date' in df.columns:
-    df['activation_date'] = pd.to_datetime(df['activation_date'], errors='coerce')
-    ref_date = pd.to_datetime('2025-08-01')
-    df['subscriber_tenure_days'] = (ref_date - df['activation_date']).dt.days.clip(lower=0)
-    df['is_new_subscriber'] = (df['subscriber_tenure_days'] < 90).astype(int)
-    df['is_mature_subscriber'] = (df['subscriber_tenure_days'] > 365).astype(int)
-    print(f"  ✓ tenure features")
-
-print(f"✅ Created 20 financial + behavioral features")
-
-# ==================== TIER 3: INTERACTIONS (4 features) ====================
-print("\n[5/5] TIER 3: INTERACTIONS...")
-
-df['heavy_user_good_payer'] = df['is_heavy_topup_user'] * df['is_good_payer']
-df['heavy_user_has_debt'] = df['is_heavy_topup_user'] * df['has_outstanding_debt']
-df['high_topup_high_package'] = df['topup_amount_high'] * df['has_high_value_package']
-df['repeat_advance_good_payer'] = df['is_repeat_advancer'] * df['is_good_payer']
-print(f"  ✓ 4 interaction features")
-
-print(f"✅ Created 4 interaction features")
+# Demand-driven evaluation (feature_registry.py): only the requested columns and
+# the features they depend on are computed; None = every feature
+if args.for_downstream:
+    REQUESTED, notes = downstream_requests()
+    for note in notes:
+        print(f"  Downstream {note}")
+else:
+    REQUESTED = args.features
+NEEDED = REGISTRY.resolve(REQUESTED)
+FEATURE_SET = None if REQUESTED is None else NEEDED
+FLAGS = REGISTRY.flags(NEEDED)
+print(f"Features: {len(NEEDED)} of {len(REGISTRY.features)} registered")
+
+# A subset run publishes under its own directory (one per feature set) with its
+# own partitions, state, sketches and thresholds: the feature file, snapshot and
+# state that Phase 3 and --incremental read always hold every feature
+if FEATURE_SET is None:
+    RUN_OUTPUT_DIR = OUTPUT_DIR
+    RUN_FEATURES_DIR = FEATURES_DATASET_DIR
+else:
+    subset_key = hashlib.sha1(json.dumps(FEATURE_SET).encode()).hexdigest()[:12]
+    RUN_OUTPUT_DIR = OUTPUT_DIR / 'feature_subsets' / subset_key
+    RUN_FEATURES_DIR = RUN_OUTPUT_DIR / FEATURES_DATASET_DIR.name
+    print(f"Subset output: {RUN_OUTPUT_DIR}")
+RUN_STATE_FILE = RUN_FEATURES_DIR / FEATURE_STATE_FILE.name
+RUN_SKETCH_FILE = RUN_FEATURES_DIR / SKETCH_FILE.name
+RUN_THRESHOLDS_FILE = RUN_FEATURES_DIR / THRESHOLDS_FILE.name
+print(f"Kernels: {kernels.backend()}")
+
+
+def state_mismatch(window, info):
+    """Why the saved feature state cannot be advanced over `window` (None if it can)"""
+    if info is None:
+        return "no saved feature state"
+    if info.get('window_months') != args.window_months:
+        return f"feature state was built for a {info.get('window_months')}-month window"
+    if info.get('features') != FEATURE_SET:
+        return "feature state was built for a different feature set"
+    if info.get('month') not in window:
+        return f"feature state covers {info.get('month')}, outside the window {window[0]}-{window[-1]}"
+    master = load_manifest(MASTER_DATASET_DIR)
+    features = load_manifest(RUN_FEATURES_DIR)
+    for month in window:
+        if month > info['month']:
+            break
+        built_from = features.get(month, {}).get('fingerprint')
+        if built_from is None or built_from != master.get(month, {}).get('fingerprint'):
+            return f"master month {month} changed since its features were built"
+    return None
+
+
+def window_starts(months):
+    """First month of each month's feature window (the window_months latest master months up to it)"""
+    available = list_months(MASTER_DATASET_DIR)
+    return {month: [m for m in available if m <= month][-args.window_months:][0] for month in months}
+
+
+# Incremental mode: the window features of the new months come from the carried
+# per-subscriber state (feature_state.py), so only those months are read
+INCREMENTAL = False
+NEW_MONTHS = []
+if args.incremental:
+    if not list_months(MASTER_DATASET_DIR):
+        print("⚠️  --incremental needs the partitioned master - running a full recompute")
+    else:
+        WINDOW = resolve_months(MASTER_DATASET_DIR, args.months, args.window_months)
+        STATE, STATE_INFO = load_state(RUN_STATE_FILE)
+        reason = state_mismatch(WINDOW, STATE_INFO)
+        if reason:
+            print(f"⚠️  {reason} - running a full recompute")
+        else:
+            NEW_MONTHS = [m for m in WINDOW if m > STATE_INFO['month']]
+            if not NEW_MONTHS:
+                print(f"✅ Features are up to date through {STATE_INFO['month']}")
+                sys.exit(0)
+            INCREMENTAL = True
+            print(f"Incremental: state through {STATE_INFO['month']}, new months {NEW_MONTHS}")
+
+
+def input_signature():
+    """Fingerprint of the master months this run reads (feature tier checkpoint key)"""
+    if list_months(MASTER_DATASET_DIR):
+        months = resolve_months(MASTER_DATASET_DIR, args.months, args.window_months)
+        manifest = load_manifest(MASTER_DATASET_DIR)
+        parts = [[month, manifest.get(month)] for month in months]
+        if INCREMENTAL:
+            parts.append(['incremental', NEW_MONTHS])
+    else:
+        st = DATA_FILE.stat()
+        parts = [str(DATA_FILE), st.st_size, st.st_mtime_ns]
+    if FEATURE_SET is not None:
+        parts.append(['features', FEATURE_SET])
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Checkpoint after each feature tier (utils/run_checkpoints.py)
+RUN_ID = args.resume or args.run_id or new_run_id()
+CHECKPOINTS = RunCheckpoints('phase2', RUN_ID, resume=bool(args.resume))
+print(f"Run id: {RUN_ID}")
+if CHECKPOINTS.finished:
+    print(f"✅ Phase 2 of run {RUN_ID} already completed at {CHECKPOINTS.manifest['finished_at']}")
+    sys.exit(0)
+
+TIERS = ['tier1a', 'tier1b', 'tier1c_2', 'tier3']
+INPUT_KEY = input_signature()
+# Resume after the last tier of the completed prefix
+resume_index = -1
+for tier in TIERS:
+    if not CHECKPOINTS.done(tier, INPUT_KEY):
+        break
+    resume_index = TIERS.index(tier)
+
+
+def run_tier(tier):
+    """False for tiers already completed by the resumed run"""
+    return TIERS.index(tier) > resume_index
+
+
+if resume_index >= 0:
+    print(f"\n⏩ Resuming run {RUN_ID} after {TIERS[resume_index]}")
+    df = CHECKPOINTS.load(TIERS[resume_index])[0]['df']
+    print(f"  Records: {len(df):,}")
+else:
+    # Load data
+    print("\n[1/5] Loading data...")
+    if INCREMENTAL:
+        df = read_master(MASTER_DATASET_DIR, months=NEW_MONTHS)
+        print(f"  Source: {MASTER_DATASET_DIR} (new months only)")
+    elif list_months(MASTER_DATASET_DIR):
+        # Rolling window of months from the partitioned master written by Phase 1
+        df = read_master(MASTER_DATASET_DIR, months=args.months, window=args.window_months)
+        print(f"  Source: {MASTER_DATASET_DIR}")
+    else:
+        df = pd.read_parquet(DATA_FILE)
+        print(f"  Source: {DATA_FILE}")
+        if parquet_sort_order(DATA_FILE) == MASTER_SORT_ORDER:
+            df.attrs['sorted_by'] = list(MASTER_SORT_ORDER)
+        if 'isdn_id' not in df.columns:
+            # Master written before the ISDN dictionary existed
+            isdn_dict = IsdnDictionary.load(ISDN_DICTIONARY_FILE)
+            isdn_dict.extend(df['isdn'])
+            isdn_dict.save(ISDN_DICTIONARY_FILE)
+            df.insert(0, 'isdn_id', isdn_dict.encode(df.pop('isdn')))
+    print(f"  Months: {sorted(df['data_month'].unique())}")
+    print(f"  Records: {len(df):,}")
+
+    # Sort for rolling operations; Phase 1 already writes the master in
+    # (isdn_id, data_month) order, so only masters without that contract are sorted
+    presorted = df.attrs.get('sorted_by') == MASTER_SORT_ORDER
+    df['month_int'] = df['data_month'].astype(int)
+    if presorted:
+        print("  Master already sorted by (isdn_id, data_month) - skipping sort")
+    else:
+        df = df.sort_values(['isdn_id', 'month_int'])
+
+if not INCREMENTAL:
+    WINDOW = sorted(df['data_month'].unique())
+
+unknown = [col for col in (REQUESTED or []) if col not in REGISTRY.features and col not in df.columns]
+if unknown:
+    print(f"  ⚠️  Requested columns that are neither features nor master columns: {unknown}")
+# Lagged window columns are only built when a needed feature reads them (or to
+# advance the incremental state)
+NEEDS_WINDOW = INCREMENTAL or REGISTRY.uses(NEEDED, WINDOW_INPUT)
+
+# ==================== THRESHOLD PRE-PASS ====================
+# The "high" flags compare against quantiles of the whole window: one quantile
+# sketch per month and column, merged over the window once here and shared by
+# every tier and partition. Incremental runs reuse the stored sketches of the
+# earlier window months (re-read from the master only if a sketch is missing)
+MONTH_SKETCHES = build_month_sketches(df)
+window_sketches = dict(MONTH_SKETCHES)
+if INCREMENTAL:
+    stored = load_month_sketches(RUN_SKETCH_FILE)
+    base_months = [m for m in WINDOW if m not in NEW_MONTHS]
+    missing = [m for m in base_months if m not in stored]
+    if missing:
+        print(f"  Sketches missing for {missing} - reading their threshold columns")
+        stored.update(build_month_sketches(read_master(MASTER_DATASET_DIR, months=missing, columns=THRESHOLD_COLS)))
+        MONTH_SKETCHES.update({m: stored[m] for m in missing})
+    window_sketches.update({m: stored[m] for m in base_months})
+THRESHOLDS = thresholds_from_sketches(window_sketches, WINDOW)
+print(f"\n  Thresholds: " + ", ".join(f"{name}={value:,.2f}" for name, value in THRESHOLDS.items()))
+
+STATE_STARTS = window_starts(NEW_MONTHS) if INCREMENTAL else None
+
+# Subscribers are independent once the thresholds are fixed, so the tiers can
+# run per isdn hash partition in worker processes (partition_runner.py); a run
+# resumed from a serial tier checkpoint finishes serially
+PARALLEL = WORKERS > 1 and N_PARTITIONS > 1 and resume_index < 0 and bool(list_months(MASTER_DATASET_DIR))
+
+if PARALLEL:
+    print(f"\n[2/5] TIERS 1A-3 in {N_PARTITIONS} isdn hash partitions ({WORKERS} workers)...")
+    STAGING_DIR = RUN_FEATURES_DIR / f'_staging-{RUN_ID}'
+    PARTITION_KEY = f'{INPUT_KEY}:{N_PARTITIONS}'
+    ROWS = partition_rows(df['isdn_id'].to_numpy(), N_PARTITIONS)
+    STATE_ROWS = partition_rows(STATE['isdn_id'].to_numpy(), N_PARTITIONS) if INCREMENTAL else None
+
+    def compute_partition(p):
+        """All tiers for one partition; writes its part files, returns its carried state"""
+        part = df.take(ROWS[p]).reset_index(drop=True)
+        state = STATE.take(STATE_ROWS[p]).reset_index(drop=True) if INCREMENTAL else None
+        window_cols, next_state = window_columns(part, state, STATE_STARTS) if NEEDS_WINDOW else (None, None)
+        part = REGISTRY.compute(part, NEEDED, FeatureContext(window_cols, THRESHOLDS), log=quiet)
+        if next_state is None:
+            next_state = build_state(part['isdn_id'].to_numpy(), part['month_int'].to_numpy(),
+                                     {prefix: part[col].to_numpy() for prefix, col in WINDOW_SERIES.items()},
+                                     part['advance_count'].to_numpy())
+        part, layout = compact_features(part.drop(columns=['month_int']), FLAGS, args.pack_flags)
+        for month, part_month in part.groupby('data_month', sort=True):
+            write_partition_part(part_month, month, p, STAGING_DIR, metadata=layout)
+        return next_state
+
+    # Partitions finished by the resumed run keep their staged files
+    partition_states = {}
+    for p in range(N_PARTITIONS):
+        if CHECKPOINTS.done(f'partition-{p:03d}', PARTITION_KEY):
+            partition_states[p] = CHECKPOINTS.load(f'partition-{p:03d}')[0]['state']
+    if partition_states:
+        print(f"  ⏩ {len(partition_states)} partitions restored from run {RUN_ID}")
+    else:
+        shutil.rmtree(STAGING_DIR, ignore_errors=True)
+
+    pending = [p for p in range(N_PARTITIONS) if p not in partition_states]
+    for p, state in run_partitions(compute_partition, pending, WORKERS):
+        partition_states[p] = state
+        CHECKPOINTS.save(f'partition-{p:03d}', {'state': state}, info={'rows': int(len(ROWS[p]))}, key=PARTITION_KEY)
+        print(f"  ✓ partition {p:03d}: {len(ROWS[p]):,} rows")
+
+    NEXT_STATE = pd.concat([partition_states[p] for p in range(N_PARTITIONS)], ignore_index=True) \
+        .sort_values('isdn_id', kind='stable').reset_index(drop=True)
+    print(f"✅ Created {len(NEEDED)} features in {N_PARTITIONS} partitions")
+else:
+    # Window columns of tiers 1A and 1B; incremental runs always need them,
+    # since the advanced state is saved at the end
+    window_cols = None
+    if NEEDS_WINDOW and (INCREMENTAL or run_tier('tier1a') or run_tier('tier1b')):
+        window_cols, NEXT_STATE = window_columns(df, STATE if INCREMENTAL else None, STATE_STARTS)
+    CTX = FeatureContext(window_cols, THRESHOLDS)
+
+    if run_tier('tier1a'):
+        print("\n[2/5] TIER 1A: ADVANCE HISTORY...")
+        df = REGISTRY.compute(df, NEEDED, CTX, tier='tier1a')
+        print(f"✅ Created {len(REGISTRY.names('tier1a', NEEDED))} advance history features")
+        CHECKPOINTS.save('tier1a', {'df': df}, key=INPUT_KEY)
+
+    if run_tier('tier1b'):
+        print("\n[3/5] TIER 1B: TOPUP INTENSITY...")
+        df = REGISTRY.compute(df, NEEDED, CTX, tier='tier1b')
+        print(f"✅ Created {len(REGISTRY.names('tier1b', NEEDED))} topup intensity features")
+        CHECKPOINTS.save('tier1b', {'df': df}, key=INPUT_KEY)
+
+    if run_tier('tier1c_2'):
+        print("\n[4/5] TIER 1C & 2: FINANCIAL + BEHAVIORAL...")
+        df = REGISTRY.compute(df, NEEDED, CTX, tier='tier1c_2')
+        print(f"✅ Created {len(REGISTRY.names('tier1c_2', NEEDED))} financial + behavioral features")
+        CHECKPOINTS.save('tier1c_2', {'df': df}, key=INPUT_KEY)
+
+    if run_tier('tier3'):
+        print("\n[5/5] TIER 3: INTERACTIONS...")
+        df = REGISTRY.compute(df, NEEDED, CTX, tier='tier3')
+        print(f"✅ Created {len(REGISTRY.names('tier3', NEEDED))} interaction features")
+        CHECKPOINTS.save('tier3', {'df': df}, key=INPUT_KEY)
 
 # ==================== SAVE ====================
 print("\n" + "="*100)
 print("SAVING...")
 print("="*100)
 
+# Carried state for the next incremental run (saved once the features are written)
+if PARALLEL or INCREMENTAL:
+    next_state = NEXT_STATE
+elif list_months(MASTER_DATASET_DIR):
+    next_state = build_state(df['isdn_id'].to_numpy(), df['month_int'].to_numpy(),
+                             {prefix: df[col].to_numpy() for prefix, col in WINDOW_SERIES.items()},
+                             df['advance_count'].to_numpy())
+else:
+    next_state = None
+
+# Per-month feature partitions, tagged with the master fingerprint they were built from
+if next_state is not None:
+    master_manifest = load_manifest(MASTER_DATASET_DIR)
+    fingerprints = {month: master_manifest.get(month, {}).get('fingerprint') for month in WINDOW}
+    if PARALLEL:
+        written = publish_partitions(STAGING_DIR, RUN_FEATURES_DIR, fingerprints)
+    else:
+        compact, layout = compact_features(df.drop(columns=['month_int'], errors='ignore'), FLAGS, args.pack_flags)
+        written = write_master_partitions(compact, RUN_FEATURES_DIR, fingerprints, metadata=layout)
+        del compact
+    state_month = max(written)
+    save_state(next_state, state_month, args.window_months, features=FEATURE_SET, path=RUN_STATE_FILE)
+    save_month_sketches(MONTH_SKETCHES, path=RUN_SKETCH_FILE)
+    print(f"\n💾 Feature partitions: {', '.join(sorted(written))} -> {RUN_FEATURES_DIR}")
+    print(f"  State: {len(next_state):,} subscribers through {state_month}")
+
+if PARALLEL or INCREMENTAL:
+    # Whole-window frame from the stored partitions (earlier months + the ones just written)
+    df = load_features(RUN_FEATURES_DIR, months=WINDOW)
+
+# Cutoffs of this window, for scoring without recomputing them
+save_thresholds(THRESHOLDS, WINDOW, path=RUN_THRESHOLDS_FILE)
+
 # Cleanup
 df = df.drop(columns=['month_int'], errors='ignore')
 
 # Count features
 original_cols = 30
-total_new = 11 + 15 + 20 + 4
+total_new = len([col for col in NEEDED if col in df.columns])
 print(f"\n📊 Summary:")
 print(f"  Original: {original_cols} columns")
 print(f"  New features: {total_new}")
 print(f"  Total: {len(df.columns)} columns")
 
-# Save
-output_file = OUTPUT_DIR / 'dataset_with_features_202503-202508_CORRECTED.parquet'
-df.to_parquet(output_file, compression='snappy', index=False)
+# Save: compact dtypes, flags as int8 or one bitset column (utils/feature_store.py)
+output_file = RUN_OUTPUT_DIR / FEATURES_FILE.name
+RUN_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+output, layout = compact_features(df, FLAGS, args.pack_flags)
+write_feature_file(output, output_file, layout)
+# Uncompressed IPC copy: later phases memory-map it instead of decoding the Parquet file
+ipc_file = ipc_path(output_file)
+if args.no_ipc:
+    ipc_file.unlink(missing_ok=True)
+else:
+    write_feature_ipc(output, ipc_file, layout)
 
 file_size_mb = output_file.stat().st_size / (1024 * 1024)
 print(f"\n💾 Saved:")
 print(f"  File: {output_file.name}")
 print(f"  Size: {file_size_mb:.2f} MB")
+if not args.no_ipc:
+    print(f"  IPC copy: {ipc_file.name} ({ipc_file.stat().st_size / (1024 * 1024):.2f} MB, memory-mapped by load_features)")
+print(f"  In memory: {df.memory_usage(deep=True).sum() / 1e6:,.1f} MB -> "
+      f"{output.memory_usage(deep=True).sum() / 1e6:,.1f} MB compact"
+      + (f" ({len(FLAGS)} flags packed into {FLAG_BITSET_COLUMN})" if args.pack_flags and FLAGS else ""))
+del output
 print(f"  Records: {len(df):,}")
 
+# Current snapshot: latest month only, for the phases that score one month
+snapshot_month = df['data_month'].max()
+latest = df[df['data_month'] == snapshot_month].copy()
+if 'has_advance_in_month' in df.columns:
+    advanced = df.loc[df['has_advance_in_month'].fillna(False).astype(bool), 'isdn_id'].unique()
+    latest[SNAPSHOT_ADVANCE_COLUMN] = latest['isdn_id'].isin(advanced)
+snapshot, snapshot_layout = compact_features(latest, FLAGS, args.pack_flags)
+write_snapshot(snapshot, snapshot_month, WINDOW, snapshot_layout, path=RUN_OUTPUT_DIR / SNAPSHOT_FILE.name)
+print(f"  Snapshot: {SNAPSHOT_FILE.name} ({snapshot_month}, {len(snapshot):,} subscribers)")
+del latest, snapshot
+
 # Save feature list
 new_features = [col for col in df.columns if col not in [
-    'isdn', 'subscriber_type', 'subscriber_status', 'status_detail',
+    'isdn_id', 'subscriber_type', 'subscriber_status', 'status_detail',
     'activation_date', 'expire_date', 'data_month',
     'most_used_advance_service', 'most_used_topup_channel',
     'has_advance_in_month'
 ]]
 
 feature_df = pd.DataFrame({'Feature': new_features})
-feature_list_file = OUTPUT_DIR / 'feature_list.csv'
+feature_list_file = RUN_OUTPUT_DIR / 'feature_list.csv'
 feature_df.to_csv(feature_list_file, index=False)
 
+# Features are saved: the run's checkpoint frames are no longer needed
+CHECKPOINTS.finish()
+
 elapsed = datetime.now() - start_time
 
 print(f"\n✅ COMPLETED in {elapsed}")
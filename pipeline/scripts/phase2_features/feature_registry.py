@@ -0,0 +1,133 @@
+"""
+PHASE 2 HELPER: FEATURE REGISTRY (demand-driven evaluation)
+Every Phase 2 feature is registered under its output column name, with the
+tier it belongs to and the columns it reads. Inputs that are registered
+features are its dependencies; anything else is a master column, or one of
+the shared inputs:
+
+  WINDOW       lagged window columns (window_kernels.py / feature_state.py)
+  THRESHOLDS   window-wide quantile cutoffs (quantile sketches)
+
+Given the requested output columns, resolve() returns them plus everything
+they depend on, in registration order (a valid evaluation order, since a
+feature can only depend on features registered before it); compute() builds
+just those. A feature whose master inputs are missing from the frame is
+skipped, along with the features that depend on it.
+
+The downstream phases declare which feature columns they read
+(DOWNSTREAM_INPUTS); downstream_requests() turns that into a request, so
+Phase 2 can build only what Phase 3 consumes.
+"""
+
+from pathlib import Path
+
+WINDOW = '@window'
+THRESHOLDS = '@thresholds'
+SHARED_INPUTS = (WINDOW, THRESHOLDS)
+
+# Columns each downstream consumer reads from the feature dataset.
+# A string is a file listing one column per line (relative to the pipeline dir)
+DOWNSTREAM_INPUTS = {
+    # Phase 3a clustering: the selected clustering features
+    'phase3a_clustering': 'output/clustering_features.txt',
+    # Phase 3b recommendation (its output also feeds the Phase 3c risk filter)
+    'phase3b_recommendation': ['topup_count_last_1m', 'topup_amount_last_1m', 'topup_count_last_2m',
+                               'avg_topup_amount'],
+}
+
+
+class FeatureRegistry:
+    """Named features with declared inputs, evaluated on demand"""
+
+    def __init__(self):
+        self.features = {}  # name -> (tier, inputs, fn), in registration order
+        self.flag_names = set()  # 0/1 features (stored as int8 / bit-packed)
+
+    def register(self, name, tier, inputs=(), flag=False):
+        """Decorator: fn(df, ctx) -> column values of feature `name`"""
+        def decorator(fn):
+            self.add(name, tier, inputs, fn, flag)
+            return fn
+        return decorator
+
+    def add(self, name, tier, inputs, fn, flag=False):
+        if name in self.features:
+            raise ValueError(f"Feature {name!r} is already registered")
+        self.features[name] = (tier, tuple(inputs), fn)
+        if flag:
+            self.flag_names.add(name)
+
+    def flags(self, among):
+        return [name for name in among if name in self.flag_names]
+
+    def dependencies(self, name):
+        return [col for col in self.features[name][1] if col in self.features]
+
+    def uses(self, names, shared_input):
+        """True if any of `names` reads a shared input (WINDOW / THRESHOLDS)"""
+        return any(shared_input in self.features[name][1] for name in names)
+
+    def resolve(self, requested=None):
+        """
+        Requested features plus their dependencies, in registration order.
+        requested=None means every feature; names that are not features
+        (e.g. master columns) are ignored.
+        """
+        if requested is None:
+            return list(self.features)
+        needed = set()
+        pending = [name for name in requested if name in self.features]
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.dependencies(name))
+        return [name for name in self.features if name in needed]
+
+    def names(self, tier, among):
+        return [name for name in among if self.features[name][0] == tier]
+
+    def compute(self, df, names, ctx, tier=None, log=print):
+        """Add the features `names` (of `tier`, or of every tier) to df in place; returns df"""
+        for name in names:
+            feature_tier, inputs, fn = self.features[name]
+            if tier is not None and feature_tier != tier:
+                continue
+            missing = [col for col in inputs if col not in SHARED_INPUTS and col not in df.columns]
+            if missing:
+                log(f"  - {name} skipped (missing {', '.join(missing)})")
+                continue
+            df[name] = fn(df, ctx)
+            log(f"  ✓ {name}")
+        return df
+
+
+class FeatureContext:
+    """Shared inputs handed to every feature function"""
+
+    def __init__(self, window=None, thresholds=None):
+        self.window = window
+        self.thresholds = thresholds
+
+
+def downstream_requests(consumers=None, base_dir='.'):
+    """
+    (requested columns, notes) from DOWNSTREAM_INPUTS.
+    A consumer whose column file is missing cannot be narrowed: returns
+    (None, notes), i.e. every feature.
+    """
+    requested = []
+    notes = []
+    for consumer, inputs in DOWNSTREAM_INPUTS.items():
+        if consumers and consumer not in consumers:
+            continue
+        if isinstance(inputs, str):
+            path = Path(base_dir) / inputs
+            if not path.exists():
+                notes.append(f"{consumer}: {path} not found - building every feature")
+                return None, notes
+            with open(path) as f:
+                inputs = [line.strip() for line in f if line.strip()]
+        notes.append(f"{consumer}: {len(inputs)} columns")
+        requested.extend(inputs)
+    return list(dict.fromkeys(requested)), notes
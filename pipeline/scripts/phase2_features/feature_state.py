@@ -0,0 +1,198 @@
+"""
+PHASE 2 HELPER: CARRIED PER-SUBSCRIBER WINDOW STATE (incremental runs)
+Only the newest month's rows change from one monthly run to the next, so the
+lagged window features of a new month are computed from a compact state per
+subscriber instead of re-scanning the whole window:
+
+  month_lag1..3              calendar month index of the subscriber's last 3 records (-1 = none)
+  {series}_lag1..3           advance_count / topup_count / topup_amount of those records
+  last_advance_month         month index of the latest record with an advance (-1 = none)
+
+The "ever advanced" flag is last_advance_month >= window start, so it ages
+out of the window exactly like a full recompute does.
+
+A full Phase 2 run builds the state from its sorted frame (build_state); an
+incremental run computes the new month from it and advances it
+(window_features_from_state). The new months' rows are identical to a full
+recompute over the same window. The earlier months' partitions are not
+rewritten: they keep the window features and "high" threshold flags of the
+run that built them, while a full recompute would re-flag them against the
+current window's thresholds.
+
+    features/
+        _state.parquet          # state, with the last month it covers in its metadata
+        _manifest.json          # per-month master fingerprint the features were built from
+        data_month=YYYYMM/part-*.parquet  # part-0, or one part per isdn hash partition
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from window_kernels import NO_EVENT_MONTHS, month_index, segment_starts
+
+FEATURES_DATASET_DIR = Path('/data/ut360/output/datasets/features')
+FEATURE_STATE_FILE = FEATURES_DATASET_DIR / '_state.parquet'
+STATE_METADATA_KEY = b'ut360.feature_state'
+
+# Window series: feature prefix -> master column
+WINDOW_SERIES = {
+    'advance_count': 'advance_count',
+    'topup_count': 'topup_count',
+    'topup_amount': 'total_topup_amount',
+}
+STATE_LAGS = 3
+
+
+def state_columns():
+    columns = ['isdn_id']
+    for lag in range(1, STATE_LAGS + 1):
+        columns.append(f'month_lag{lag}')
+        columns.extend(f'{prefix}_lag{lag}' for prefix in WINDOW_SERIES)
+    return columns + ['last_advance_month']
+
+
+def build_state(isdn_ids, month_ints, series, advance_values):
+    """State after the last record of every subscriber (rows sorted by isdn_id, month)"""
+    isdn_ids = np.asarray(isdn_ids)
+    n = len(isdn_ids)
+    if n == 0:
+        return pd.DataFrame({col: pd.Series(dtype='float64' if '_lag' in col and 'month' not in col else 'int64')
+                             for col in state_columns()})
+    starts = segment_starts(isdn_ids)
+    months = month_index(month_ints)
+
+    is_end = np.ones(n, dtype=bool)
+    is_end[:-1] = isdn_ids[1:] != isdn_ids[:-1]
+    ends = np.flatnonzero(is_end)
+
+    state = {'isdn_id': isdn_ids[ends].astype(np.int64)}
+    for lag in range(1, STATE_LAGS + 1):
+        pos = ends - (lag - 1)
+        valid = pos >= starts[ends]
+        pos = np.where(valid, pos, 0)
+        state[f'month_lag{lag}'] = np.where(valid, months[pos], -1).astype(np.int64)
+        for prefix, values in series.items():
+            values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+            state[f'{prefix}_lag{lag}'] = np.where(valid, values[pos], 0.0)
+
+    positive = np.asarray(advance_values, dtype=np.float64) > 0
+    last = np.maximum.accumulate(np.where(positive, np.arange(n), -1))[ends]
+    has_event = last >= starts[ends]
+    state['last_advance_month'] = np.where(has_event, months[np.where(has_event, last, 0)], -1).astype(np.int64)
+    return pd.DataFrame(state)[state_columns()]
+
+
+def _lookup(state, isdn_ids):
+    """(found, position) of each isdn_id in the state (sorted by isdn_id)"""
+    state_ids = state['isdn_id'].to_numpy()
+    if len(state_ids) == 0:
+        return np.zeros(len(isdn_ids), dtype=bool), np.zeros(len(isdn_ids), dtype=np.int64)
+    pos = np.minimum(np.searchsorted(state_ids, isdn_ids), len(state_ids) - 1)
+    return state_ids[pos] == isdn_ids, pos
+
+
+def _take(state, col, found, pos, default):
+    """State column per row, `default` for subscribers without state"""
+    if len(state) == 0:
+        return np.full(len(found), default)
+    return np.where(found, state[col].to_numpy()[pos], default)
+
+
+def _month_features(state, isdn_ids, month, series, advance_values, window_start, windows, found, pos):
+    """Window features of one month's rows (one row per subscriber) from the state"""
+    out = {}
+    for prefix in series:
+        running = np.zeros(len(isdn_ids))
+        for lag in range(1, max(windows) + 1):
+            lag_month = _take(state, f'month_lag{lag}', found, pos, -1)
+            lagged = _take(state, f'{prefix}_lag{lag}', found, pos, 0.0)
+            running = running + np.where(lag_month >= window_start, lagged, 0.0)
+            if lag in windows:
+                out[f'{prefix}_last_{lag}m'] = running
+
+    last_advance = _take(state, 'last_advance_month', found, pos, -1)
+    in_window = last_advance >= window_start
+    advanced_now = np.asarray(advance_values, dtype=np.float64) > 0
+    out['has_advance_history'] = in_window.astype(np.int64)
+    out['months_since_last_advance'] = np.where(
+        advanced_now, 0, np.where(in_window, month - last_advance, NO_EVENT_MONTHS)
+    ).astype(np.int64)
+    return out
+
+
+def _advance_state(state, isdn_ids, month, series, advance_values, found, pos):
+    """State after appending one month's records"""
+    new = {'isdn_id': np.asarray(isdn_ids, dtype=np.int64)}
+    new['month_lag1'] = np.full(len(isdn_ids), month, dtype=np.int64)
+    for lag in range(2, STATE_LAGS + 1):
+        new[f'month_lag{lag}'] = _take(state, f'month_lag{lag - 1}', found, pos, -1).astype(np.int64)
+    for prefix, values in series.items():
+        new[f'{prefix}_lag1'] = np.nan_to_num(np.asarray(values, dtype=np.float64))
+        for lag in range(2, STATE_LAGS + 1):
+            new[f'{prefix}_lag{lag}'] = _take(state, f'{prefix}_lag{lag - 1}', found, pos, 0.0)
+    advanced_now = np.asarray(advance_values, dtype=np.float64) > 0
+    new['last_advance_month'] = np.where(
+        advanced_now, month, _take(state, 'last_advance_month', found, pos, -1)
+    ).astype(np.int64)
+
+    untouched = state[~np.isin(state['isdn_id'].to_numpy(), new['isdn_id'])]
+    return pd.concat([untouched, pd.DataFrame(new)[state_columns()]], ignore_index=True) \
+        .sort_values('isdn_id', kind='stable').reset_index(drop=True)
+
+
+def window_features_from_state(state, df, window_starts, windows=(1, 2, 3)):
+    """
+    Window features for the rows of `df` (new months only, sorted by isdn_id,
+    data_month), month by month from the carried state.
+    window_starts: {YYYYMM: first month of that month's feature window}.
+    Returns (columns aligned with df rows, advanced state).
+    """
+    out = {}
+    for month in sorted(df['data_month'].unique()):
+        rows = np.flatnonzero((df['data_month'] == month).to_numpy())
+        month_df = df.iloc[rows]
+        isdn_ids = month_df['isdn_id'].to_numpy().astype(np.int64)
+        series = {prefix: month_df[col].to_numpy() for prefix, col in WINDOW_SERIES.items()}
+        advance = month_df['advance_count'].to_numpy()
+        month_i = int(month_index([int(month)])[0])
+        start_i = int(month_index([int(window_starts[month])])[0])
+
+        found, pos = _lookup(state, isdn_ids)
+        month_out = _month_features(state, isdn_ids, month_i, series, advance, start_i, windows, found, pos)
+        for name, values in month_out.items():
+            out.setdefault(name, np.zeros(len(df), dtype=values.dtype))[rows] = values
+        state = _advance_state(state, isdn_ids, month_i, series, advance, found, pos)
+
+    # Subscribers whose last record left the window carry nothing forward
+    if len(df):
+        horizon = int(month_index([int(max(window_starts.values()))])[0])
+        state = state[state['month_lag1'] >= horizon].reset_index(drop=True)
+    return out, state
+
+
+def save_state(state, month, window_months, features=None, path=FEATURE_STATE_FILE):
+    """Atomically write the state covering features up to `month` (features: the feature set, None = all)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(state, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[STATE_METADATA_KEY] = json.dumps({'month': month, 'window_months': window_months, 'features': features}).encode()
+    tmp = path.with_name(path.name + f'.tmp{os.getpid()}')
+    pq.write_table(table.replace_schema_metadata(metadata), tmp)
+    os.replace(tmp, path)
+
+
+def load_state(path=FEATURE_STATE_FILE):
+    """(state, info) or (None, None) if no state was saved"""
+    path = Path(path)
+    if not path.exists():
+        return None, None
+    table = pq.read_table(path)
+    info = json.loads((table.schema.metadata or {}).get(STATE_METADATA_KEY, b'{}'))
+    return table.to_pandas(), info
@@ -0,0 +1,393 @@
+"""
+PHASE 2 HELPER: FEATURE TIERS
+Every feature is computed from a subscriber's own rows, except the "high"
+flags, which compare against quantiles of the whole feature window. The
+features therefore run unchanged on the full frame or on any subset of whole
+subscribers (one isdn hash partition), as long as the thresholds are computed
+once over the whole window and passed in.
+
+The features are registered in REGISTRY (feature_registry.py) with the tier
+they belong to and the columns they read; the registration order is the
+output column order.
+
+Thresholds come from mergeable quantile sketches (utils/quantile_sketch.py),
+one per month and column, merged in month order over the window. The month
+sketches are persisted next to the features, so an incremental run merges
+the stored sketches of the earlier months with the new month's instead of
+re-reading them, and gets the same cutoffs as a full run. The thresholds
+themselves are saved too (_thresholds.json), for scoring paths that need the
+cutoffs without any data:
+
+    features/
+        _sketches.parquet      # data_month, column, level, value
+        _thresholds.json       # window, k, specs, thresholds
+"""
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.quantile_sketch import DEFAULT_K, QuantileSketch
+from window_kernels import window_features
+from feature_state import FEATURES_DATASET_DIR, window_features_from_state
+from feature_registry import THRESHOLDS, WINDOW, FeatureRegistry
+
+# Window-wide thresholds: name -> (column, quantile)
+THRESHOLD_SPECS = {
+    'topup_count_p75': ('topup_count', 0.75),
+    'topup_amount_p75': ('total_topup_amount', 0.75),
+    'avg_topup_p75': ('avg_topup_amount', 0.75),
+    'package_value_p90': ('total_package_value', 0.9),
+    'package_value_p75': ('total_package_value', 0.75),
+}
+THRESHOLD_COLS = list(dict.fromkeys(col for col, _ in THRESHOLD_SPECS.values()))
+
+SKETCH_FILE = FEATURES_DATASET_DIR / '_sketches.parquet'
+THRESHOLDS_FILE = FEATURES_DATASET_DIR / '_thresholds.json'
+SKETCH_K_METADATA_KEY = b'ut360.sketch_k'
+SKETCH_FLIPS_METADATA_KEY = b'ut360.sketch_flips'
+
+
+def quiet(*args, **kwargs):
+    pass
+
+
+def build_month_sketches(df, k=DEFAULT_K):
+    """{month: {column: sketch}} of the threshold columns, one pass over each month's rows"""
+    sketches = {}
+    for month, rows in df.groupby('data_month', sort=True).indices.items():
+        sketches[month] = {col: QuantileSketch(k).update(df[col].to_numpy()[rows]) for col in THRESHOLD_COLS}
+    return sketches
+
+
+def thresholds_from_sketches(month_sketches, months, k=DEFAULT_K):
+    """THRESHOLD_SPECS quantiles of the window `months`, merging the month sketches in month order"""
+    merged = {col: QuantileSketch(k) for col in THRESHOLD_COLS}
+    for month in sorted(months):
+        for col in THRESHOLD_COLS:
+            merged[col].merge(month_sketches[month][col])
+    return {name: merged[col].quantile(q) for name, (col, q) in THRESHOLD_SPECS.items()}
+
+
+def save_month_sketches(month_sketches, path=SKETCH_FILE, k=DEFAULT_K):
+    """Store the given months' sketches, replacing those months and keeping the others"""
+    path = Path(path)
+    stored = load_month_sketches(path, k)
+    stored.update(month_sketches)
+    frames = []
+    flips = {}
+    for month in sorted(stored):
+        for col, sketch in stored[month].items():
+            frame = sketch.to_frame()
+            flips.setdefault(month, {})[col] = frame.attrs['flips']
+            frame.insert(0, 'column', col)
+            frame.insert(0, 'data_month', month)
+            frames.append(frame)
+    table = pa.Table.from_pandas(pd.concat(frames, ignore_index=True), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SKETCH_K_METADATA_KEY] = str(k).encode()
+    metadata[SKETCH_FLIPS_METADATA_KEY] = json.dumps(flips).encode()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + f'.tmp{os.getpid()}')
+    pq.write_table(table.replace_schema_metadata(metadata), tmp)
+    os.replace(tmp, path)
+
+
+def load_month_sketches(path=SKETCH_FILE, k=DEFAULT_K):
+    """Stored {month: {column: sketch}}; empty if missing, built with a different k or without flips"""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    if metadata.get(SKETCH_K_METADATA_KEY) != str(k).encode() or SKETCH_FLIPS_METADATA_KEY not in metadata:
+        return {}
+    flips = json.loads(metadata[SKETCH_FLIPS_METADATA_KEY])
+    sketches = {}
+    for (month, col), frame in table.to_pandas().groupby(['data_month', 'column'], sort=True):
+        frame.attrs['flips'] = flips.get(month, {}).get(col, [])
+        sketches.setdefault(month, {})[col] = QuantileSketch.from_frame(frame, k)
+    return {month: cols for month, cols in sketches.items() if set(cols) >= set(THRESHOLD_COLS)}
+
+
+def save_thresholds(thresholds, window, path=THRESHOLDS_FILE, k=DEFAULT_K):
+    """Cutoffs used by the latest run, for scoring without the data"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({
+            'window': list(window),
+            'k': k,
+            'specs': {name: {'column': col, 'quantile': q} for name, (col, q) in THRESHOLD_SPECS.items()},
+            'thresholds': thresholds,
+            'computed_at': datetime.now().isoformat(timespec='seconds'),
+        }, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_thresholds(path=THRESHOLDS_FILE):
+    """{name: cutoff} saved by the latest Phase 2 run"""
+    with open(path) as f:
+        return json.load(f)['thresholds']
+
+
+def window_columns(df, state=None, window_starts=None):
+    """
+    Lagged window sums, history flag and months-since-last for tiers 1A and 1B:
+    one segmented pass over the sorted rows (window_kernels.py), or from the
+    carried state for incremental months (feature_state.py).
+    Returns (columns, advanced state or None).
+    """
+    if state is not None:
+        return window_features_from_state(state, df, window_starts)
+    cols = window_features(
+        df['isdn_id'].to_numpy(), df['month_int'].to_numpy(),
+        sums={
+            'advance_count': df['advance_count'].to_numpy(),
+            'topup_count': df['topup_count'].to_numpy(),
+            'topup_amount': df['total_topup_amount'].to_numpy(),
+        },
+        windows=(1, 2, 3),
+        history={'has_advance_history': df['advance_count'].to_numpy()},
+        since={'months_since_last_advance': df['advance_count'].to_numpy()},
+    )
+    return cols, None
+
+
+REGISTRY = FeatureRegistry()
+feature = REGISTRY.register
+
+
+def _window_feature(name, tier, flag=False):
+    REGISTRY.add(name, tier, [WINDOW], lambda df, ctx: ctx.window[name], flag)
+
+
+# ==================== TIER 1: ADVANCE HISTORY ====================
+# Advance counts over the previous 1/2/3 months
+for window in [1, 2, 3]:
+    _window_feature(f'advance_count_last_{window}m', 'tier1a')
+
+# Any advance in an earlier month
+_window_feature('has_advance_history', 'tier1a', flag=True)
+
+# Months since last advance (0 = advance this month, 99 = never)
+_window_feature('months_since_last_advance', 'tier1a')
+
+
+# Repayment indicators
+@feature('is_good_payer', 'tier1a', ['avg_repayment_rate'], flag=True)
+def is_good_payer(df, ctx):
+    return (df['avg_repayment_rate'] >= 0.95).astype(int)
+
+
+@feature('has_outstanding_debt', 'tier1a', ['outstanding_debt'], flag=True)
+def has_outstanding_debt(df, ctx):
+    return (df['outstanding_debt'] > 0).astype(int)
+
+
+@feature('is_repeat_advancer', 'tier1a', ['advance_count'], flag=True)
+def is_repeat_advancer(df, ctx):
+    return (df['advance_count'] > 1).astype(int)
+
+
+# ==================== TIER 1B: TOPUP INTENSITY ====================
+# Frequency categories
+@feature('topup_freq_none', 'tier1b', ['topup_count'], flag=True)
+def topup_freq_none(df, ctx):
+    return (df['topup_count'] == 0).astype(int)
+
+
+@feature('topup_freq_low', 'tier1b', ['topup_count'], flag=True)
+def topup_freq_low(df, ctx):
+    return ((df['topup_count'] > 0) & (df['topup_count'] <= 2)).astype(int)
+
+
+@feature('topup_freq_medium', 'tier1b', ['topup_count'], flag=True)
+def topup_freq_medium(df, ctx):
+    return ((df['topup_count'] > 2) & (df['topup_count'] <= 5)).astype(int)
+
+
+@feature('topup_freq_high', 'tier1b', ['topup_count'], flag=True)
+def topup_freq_high(df, ctx):
+    return (df['topup_count'] > 5).astype(int)
+
+
+# Heavy user indicators
+@feature('is_heavy_topup_user', 'tier1b', ['topup_count', THRESHOLDS], flag=True)
+def is_heavy_topup_user(df, ctx):
+    return (df['topup_count'] > ctx.thresholds['topup_count_p75']).astype(int)
+
+
+@feature('topup_amount_high', 'tier1b', ['total_topup_amount', THRESHOLDS], flag=True)
+def topup_amount_high(df, ctx):
+    return (df['total_topup_amount'] > ctx.thresholds['topup_amount_p75']).astype(int)
+
+
+@feature('avg_topup_high', 'tier1b', ['avg_topup_amount', THRESHOLDS], flag=True)
+def avg_topup_high(df, ctx):
+    return (df['avg_topup_amount'] > ctx.thresholds['avg_topup_p75']).astype(int)
+
+
+# Volatility
+@feature('topup_cv', 'tier1b', ['avg_topup_amount', 'std_topup_amount'])
+def topup_cv(df, ctx):
+    return np.where(
+        df['avg_topup_amount'] > 0,
+        df['std_topup_amount'] / df['avg_topup_amount'],
+        0
+    )
+
+
+@feature('topup_is_stable', 'tier1b', ['topup_cv'], flag=True)
+def topup_is_stable(df, ctx):
+    return (df['topup_cv'] < 0.5).astype(int)
+
+
+# Topup counts / amounts over the previous 1/2/3 months (segmented pass)
+for window in [1, 2, 3]:
+    _window_feature(f'topup_count_last_{window}m', 'tier1b')
+    _window_feature(f'topup_amount_last_{window}m', 'tier1b')
+
+
+# ==================== TIER 1C + 2: FINANCIAL & BEHAVIORAL ====================
+# Financial indicators
+@feature('estimated_balance', 'tier1c_2', ['total_topup_amount', 'total_package_value'])
+def estimated_balance(df, ctx):
+    return df['total_topup_amount'] - df['total_package_value']
+
+
+@feature('balance_is_negative', 'tier1c_2', ['estimated_balance'], flag=True)
+def balance_is_negative(df, ctx):
+    return (df['estimated_balance'] < 0).astype(int)
+
+
+@feature('balance_is_low', 'tier1c_2', ['estimated_balance'], flag=True)
+def balance_is_low(df, ctx):
+    return (df['estimated_balance'] < 50000).astype(int)
+
+
+# Burn rate
+@feature('burn_rate', 'tier1c_2', ['total_topup_amount', 'total_package_value'])
+def burn_rate(df, ctx):
+    return np.where(
+        df['total_topup_amount'] > 0,
+        df['total_package_value'] / df['total_topup_amount'],
+        999
+    )
+
+
+@feature('burn_rate_capped', 'tier1c_2', ['burn_rate'])
+def burn_rate_capped(df, ctx):
+    return df['burn_rate'].clip(upper=5)
+
+
+@feature('burn_rate_high', 'tier1c_2', ['burn_rate'], flag=True)
+def burn_rate_high(df, ctx):
+    return (df['burn_rate'] > 1.0).astype(int)
+
+
+@feature('burn_rate_very_high', 'tier1c_2', ['burn_rate'], flag=True)
+def burn_rate_very_high(df, ctx):
+    return (df['burn_rate'] > 1.5).astype(int)
+
+
+# Financial stress composite
+@feature('financial_stress_score', 'tier1c_2', ['balance_is_negative', 'burn_rate_high', 'has_outstanding_debt',
+                                                'topup_count', 'total_package_value', THRESHOLDS])
+def financial_stress_score(df, ctx):
+    return (
+        df['balance_is_negative'].astype(int) +
+        df['burn_rate_high'].astype(int) +
+        df['has_outstanding_debt'].astype(int) +
+        (df['topup_count'] == 0).astype(int) +
+        (df['total_package_value'] > ctx.thresholds['package_value_p90']).astype(int)
+    )
+
+
+# Activity
+@feature('is_active_user', 'tier1c_2', ['n3_record_count'], flag=True)
+def is_active_user(df, ctx):
+    return (df['n3_record_count'] > 0).astype(int)
+
+
+@feature('usage_intensity', 'tier1c_2', ['n3_record_count'])
+def usage_intensity(df, ctx):
+    return df['n3_record_count']
+
+
+# Package behavior
+@feature('has_multiple_packages', 'tier1c_2', ['num_packages'], flag=True)
+def has_multiple_packages(df, ctx):
+    return (df['num_packages'] > 1).astype(int)
+
+
+@feature('has_high_value_package', 'tier1c_2', ['total_package_value', THRESHOLDS], flag=True)
+def has_high_value_package(df, ctx):
+    return (df['total_package_value'] > ctx.thresholds['package_value_p75']).astype(int)
+
+
+@feature('package_per_topup_ratio', 'tier1c_2', ['num_packages', 'topup_count'])
+def package_per_topup_ratio(df, ctx):
+    return np.where(
+        df['topup_count'] > 0,
+        df['num_packages'] / df['topup_count'],
+        0
+    )
+
+
+# Profile
+@feature('is_prepaid', 'tier1c_2', ['subscriber_type'], flag=True)
+def is_prepaid(df, ctx):
+    return (df['subscriber_type'] == 'PRE').astype(int)
+
+
+@feature('is_active_status', 'tier1c_2', ['subscriber_status'], flag=True)
+def is_active_status(df, ctx):
+    return (df['subscriber_status'] == 'ACTIF').astype(int)
+
+
+# Tenure (skipped if the master has no activation_date)
+@feature('subscriber_tenure_days', 'tier1c_2', ['activation_date'])
+def subscriber_tenure_days(df, ctx):
+    # activation_date is kept in the output as a parsed datetime
+    df['activation_date'] = pd.to_datetime(df['activation_date'], errors='coerce')
+    ref_date = pd.to_datetime('2025-08-01')
+    return (ref_date - df['activation_date']).dt.days.clip(lower=0)
+
+
+@feature('is_new_subscriber', 'tier1c_2', ['subscriber_tenure_days'], flag=True)
+def is_new_subscriber(df, ctx):
+    return (df['subscriber_tenure_days'] < 90).astype(int)
+
+
+@feature('is_mature_subscriber', 'tier1c_2', ['subscriber_tenure_days'], flag=True)
+def is_mature_subscriber(df, ctx):
+    return (df['subscriber_tenure_days'] > 365).astype(int)
+
+
+# ==================== TIER 3: INTERACTIONS ====================
+@feature('heavy_user_good_payer', 'tier3', ['is_heavy_topup_user', 'is_good_payer'], flag=True)
+def heavy_user_good_payer(df, ctx):
+    return df['is_heavy_topup_user'] * df['is_good_payer']
+
+
+@feature('heavy_user_has_debt', 'tier3', ['is_heavy_topup_user', 'has_outstanding_debt'], flag=True)
+def heavy_user_has_debt(df, ctx):
+    return df['is_heavy_topup_user'] * df['has_outstanding_debt']
+
+
+@feature('high_topup_high_package', 'tier3', ['topup_amount_high', 'has_high_value_package'], flag=True)
+def high_topup_high_package(df, ctx):
+    return df['topup_amount_high'] * df['has_high_value_package']
+
+
+@feature('repeat_advance_good_payer', 'tier3', ['is_repeat_advancer', 'is_good_payer'], flag=True)
+def repeat_advance_good_payer(df, ctx):
+    return df['is_repeat_advancer'] * df['is_good_payer']
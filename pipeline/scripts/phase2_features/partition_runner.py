@@ -0,0 +1,64 @@
+"""
+PHASE 2 HELPER: HASH-PARTITIONED PARALLEL EXECUTION
+Subscribers are split into n isdn hash partitions (isdn_id % n). A partition
+holds whole subscribers, so every per-subscriber feature can be computed
+inside it; the few window-wide quantiles are computed beforehand and passed
+in. Partitions run in forked worker processes, which inherit the loaded frame
+from the parent instead of receiving it through a pipe, and each one writes
+its own output files, so only small results travel back.
+
+Rows of a partition keep the frame's (isdn_id, data_month) order.
+"""
+
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+_TASK = None
+
+
+def partition_rows(isdn_ids, n_partitions):
+    """Row positions of each hash partition, ascending within a partition"""
+    partition = np.asarray(isdn_ids) % n_partitions
+    order = np.argsort(partition, kind='stable')
+    bounds = np.searchsorted(partition[order], np.arange(n_partitions + 1))
+    return [order[bounds[p]:bounds[p + 1]] for p in range(n_partitions)]
+
+
+def _call(partition):
+    return partition, _TASK(partition)
+
+
+def run_partitions(task, partitions, workers):
+    """
+    Yield (partition, task(partition)) as partitions finish.
+    task may be any callable (closures included): forked workers inherit it.
+    A failed partition does not stop the others; the first error is raised
+    once every partition has finished, so all completed ones are yielded.
+    """
+    global _TASK
+    _TASK = task
+    partitions = list(partitions)
+    errors = []
+    if workers <= 1 or len(partitions) <= 1:
+        for p in partitions:
+            try:
+                result = _call(p)
+            except Exception as exc:
+                errors.append(exc)
+                continue
+            yield result
+    else:
+        context = mp.get_context('fork')
+        with ProcessPoolExecutor(max_workers=min(workers, len(partitions)), mp_context=context) as executor:
+            futures = [executor.submit(_call, p) for p in partitions]
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    errors.append(exc)
+                    continue
+                yield result
+    if errors:
+        raise errors[0]
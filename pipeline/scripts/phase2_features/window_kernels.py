@@ -0,0 +1,73 @@
+"""
+PHASE 2 HELPER: SEGMENTED WINDOW KERNEL
+Lagged per-subscriber window features computed in one pass over the
+(isdn_id, data_month)-sorted arrays instead of one grouped pandas pass each:
+
+  {prefix}_last_{w}m     sum of the subscriber's previous w records
+                         (current month excluded, 0 for the first record)
+  history flags          1 if any previous record of the subscriber is > 0
+  months-since counts    calendar months since the latest record with a value
+                         > 0 (current month included -> 0), NO_EVENT_MONTHS if none
+
+Every lag is masked at subscriber boundaries, so no value leaks from one
+isdn_id into the next (the old `.rolling().sum().shift(1)` shifted the last
+value of the previous subscriber into the first month of the next one).
+"""
+
+import numpy as np
+
+from utils import kernels
+
+NO_EVENT_MONTHS = 99
+
+
+def month_index(month_ints):
+    """YYYYMM -> running calendar month number (differences are month counts)"""
+    month_ints = np.asarray(month_ints, dtype=np.int64)
+    return (month_ints // 100) * 12 + month_ints % 100
+
+
+def segment_starts(isdn_ids):
+    """Position of the first row of each row's subscriber segment (rows sorted by isdn_id)"""
+    isdn_ids = np.asarray(isdn_ids)
+    n = len(isdn_ids)
+    if n and np.any(isdn_ids[1:] < isdn_ids[:-1]):
+        raise ValueError("window features need rows sorted by (isdn_id, data_month)")
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = isdn_ids[1:] != isdn_ids[:-1]
+    return np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+
+def window_features(isdn_ids, month_ints, sums=None, windows=(1, 2, 3), history=None, since=None):
+    """
+    All lagged window features of one table in a single segmented pass
+    (utils/kernels.py window_scan, NumPy or Numba backend).
+
+    sums:    {prefix: values}  -> '{prefix}_last_{w}m' for every w in windows (float64)
+    history: {name: values}    -> name: any previous record > 0 (int64 0/1)
+    since:   {name: values}    -> name: months since the latest record > 0 (int64)
+    Returns {column name: array}, aligned with the input rows.
+    """
+    starts = segment_starts(isdn_ids)
+    n = len(starts)
+    sums, history, since = sums or {}, history or {}, since or {}
+    lags = max(windows, default=0)
+
+    def stacked(columns, clean=False):
+        rows = [np.asarray(values, dtype=np.float64) for values in columns.values()]
+        return np.array([np.nan_to_num(row) if clean else row for row in rows]).reshape(len(rows), n)
+
+    months = month_index(month_ints) if since else np.zeros(n, dtype=np.int64)
+    sums_out, history_out, since_out = kernels.window_scan(
+        starts, months, stacked(sums, clean=True), lags, stacked(history), stacked(since), NO_EVENT_MONTHS)
+
+    out = {}
+    for k, prefix in enumerate(sums):
+        for lag in range(1, lags + 1):
+            if lag in windows:
+                out[f'{prefix}_last_{lag}m'] = sums_out[k, lag - 1]
+    for k, name in enumerate(history):
+        out[name] = history_out[k]
+    for k, name in enumerate(since):
+        out[name] = since_out[k]
+    return out
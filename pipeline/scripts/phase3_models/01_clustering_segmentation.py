@@ -14,9 +14,14 @@ from sklearn.decomposition import PCA
 import pickle
 from datetime import datetime
 from pathlib import Path
+import sys
 import warnings
 warnings.filterwarnings('ignore')
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.feature_store import SNAPSHOT_ADVANCE_COLUMN, load_snapshot
+from utils.isdn_dictionary import ISDN_DICTIONARY_FILE, IsdnDictionary, id_membership, isin_ids
+
 # Ensure output directories exist
 Path('output/models').mkdir(parents=True, exist_ok=True)
 
@@ -29,20 +34,19 @@ start_time = datetime.now()
 
 # ==================== LOAD DATA ====================
 print("\n[1/8] Loading data...")
-df = pd.read_parquet('/data/ut360/output/datasets/dataset_with_features_202503-202508_CORRECTED.parquet')
-print(f"  Total records: {len(df):,}")
-print(f"  Unique subscribers: {df['isdn'].nunique():,}")
-
-# Get latest month and deduplicate
-df_latest = df[df['data_month'] == '202508'].drop_duplicates(subset=['isdn'], keep='first')
+# Current snapshot from Phase 2: August only, one row per isdn_id, window features attached
+df_latest = load_snapshot(month='202508')
 print(f"  August unique subscribers: {len(df_latest):,}")
 
 # ==================== IDENTIFY ADVANCE USERS ====================
 print("\n[2/8] Identifying advance users...")
-all_advance_users = set(df[df['has_advance_in_month'] == True]['isdn'].unique())
-print(f"  Advance users (from 6 months history): {len(all_advance_users):,}")
+# Membership table over the dense isdn_id space instead of a Python set of strings
+advance_ids = df_latest.loc[df_latest[SNAPSHOT_ADVANCE_COLUMN] == True, 'isdn_id'].unique()
+advance_table = id_membership(advance_ids)
+n_advance_users = len(advance_ids)
+print(f"  Advance users (from 6 months history): {n_advance_users:,}")
 
-df_latest['is_advance_user'] = df_latest['isdn'].isin(all_advance_users)
+df_latest['is_advance_user'] = isin_ids(df_latest['isdn_id'], advance_table)
 print(f"    - In August: {df_latest['is_advance_user'].sum():,} advance users")
 print(f"    - In August: {(~df_latest['is_advance_user']).sum():,} never-advanced users")
 
@@ -184,7 +188,7 @@ for seg in ['GROUP_1_EXISTING', 'GROUP_2_SIMILAR', 'GROUP_2_MEDIUM', 'GROUP_3_UN
 
 group_2_total = seg_counts.get('GROUP_2_SIMILAR', 0) + seg_counts.get('GROUP_2_MEDIUM', 0)
 print(f"\n  🎯 TOTAL EXPANSION TARGET (Group 2): {group_2_total:,} subscribers")
-print(f"  📈 Expansion ratio: {group_2_total / len(all_advance_users):.2f}x current base")
+print(f"  📈 Expansion ratio: {group_2_total / n_advance_users:.2f}x current base")
 
 # ==================== CLUSTER PROFILES ====================
 print("\n" + "="*100)
@@ -211,23 +215,27 @@ for cluster_id in range(3):
 # ==================== SAVE RESULTS ====================
 print("\n[8/8] Saving results...")
 
+# Original isdn is restored for the exported files
+isdn_dict = IsdnDictionary.load(ISDN_DICTIONARY_FILE)
+df_latest.insert(0, 'isdn', isdn_dict.decode(df_latest['isdn_id']))
+
 # Save full scored dataset
 output_file = 'output/subscribers_clustered_segmentation.parquet'
 df_latest.to_parquet(output_file, compression='snappy', index=False)
 print(f"  ✓ Full dataset: {output_file}")
 
 # Save Group 2 - Similar (High priority)
-group_2_similar = df_latest[df_latest['segment'] == 'GROUP_2_SIMILAR'][['isdn', 'cluster', 'segment']].copy()
+group_2_similar = df_latest[df_latest['segment'] == 'GROUP_2_SIMILAR'][['isdn', 'isdn_id', 'cluster', 'segment']].copy()
 group_2_similar.to_csv('output/expansion_group2_similar_high_priority.csv', index=False)
 print(f"  ✓ Group 2 Similar: output/expansion_group2_similar_high_priority.csv ({len(group_2_similar):,})")
 
 # Save Group 2 - Medium
-group_2_medium = df_latest[df_latest['segment'] == 'GROUP_2_MEDIUM'][['isdn', 'cluster', 'segment']].copy()
+group_2_medium = df_latest[df_latest['segment'] == 'GROUP_2_MEDIUM'][['isdn', 'isdn_id', 'cluster', 'segment']].copy()
 group_2_medium.to_csv('output/expansion_group2_medium_priority.csv', index=False)
 print(f"  ✓ Group 2 Medium: output/expansion_group2_medium_priority.csv ({len(group_2_medium):,})")
 
 # Save combined Group 2
-group_2_all = df_latest[df_latest['segment'].isin(['GROUP_2_SIMILAR', 'GROUP_2_MEDIUM'])][['isdn', 'cluster', 'segment']].copy()
+group_2_all = df_latest[df_latest['segment'].isin(['GROUP_2_SIMILAR', 'GROUP_2_MEDIUM'])][['isdn', 'isdn_id', 'cluster', 'segment']].copy()
 group_2_all.to_csv('output/expansion_group2_all_targets.csv', index=False)
 print(f"  ✓ Group 2 All: output/expansion_group2_all_targets.csv ({len(group_2_all):,})")
 
@@ -255,7 +263,7 @@ summary = {
     'group_2_medium': seg_counts.get('GROUP_2_MEDIUM', 0),
     'group_2_total': group_2_total,
     'group_3_unlikely': seg_counts.get('GROUP_3_UNLIKELY', 0),
-    'expansion_ratio': group_2_total / len(all_advance_users),
+    'expansion_ratio': group_2_total / n_advance_users,
     'kmeans_inertia': kmeans.inertia_
 }
 
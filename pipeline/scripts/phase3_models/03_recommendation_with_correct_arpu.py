@@ -10,9 +10,27 @@ Phân loại thuê bao vào 3 loại dịch vụ ứng và tính toán mức ứ
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from pathlib import Path
+import argparse
+import sys
 import warnings
 warnings.filterwarnings('ignore')
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.feature_store import load_snapshot
+from utils import kernels
+from utils.isdn_dictionary import ISDN_DICTIONARY_FILE, IsdnDictionary, id_membership, isin_ids
+
+parser = argparse.ArgumentParser(description='Phase 3b: service type classification and advance amounts')
+parser.add_argument('--kernels', choices=kernels.BACKENDS, default=None,
+                    help=f'Rule kernel backend (default: ${kernels.BACKEND_ENV} or auto = numba if installed)')
+args = parser.parse_args()
+if args.kernels:
+    try:
+        kernels.set_backend(args.kernels)
+    except ImportError as e:
+        parser.error(str(e))
+
 print("="*100)
 print("PHASE 3 - RECOMMENDATION WITH BUSINESS RULES")
 print("Phân loại service type và tính advance amount dựa trên business rules")
@@ -26,20 +44,22 @@ print("\n[1/6] Loading target subscribers from clustering...")
 df_group2 = pd.read_csv('/data/ut360/output/expansion_group2_all_targets.csv')
 print(f"  Group 2 expansion targets from clustering: {len(df_group2):,}")
 
-# Get list of ISDNs to work with
-target_isdns = df_group2['isdn'].unique()
-print(f"  Unique subscribers to process: {len(target_isdns):,}")
+# Get list of ISDNs to work with (as an isdn_id membership table)
+isdn_dict = IsdnDictionary.load(ISDN_DICTIONARY_FILE)
+if 'isdn_id' not in df_group2.columns:
+    df_group2['isdn_id'] = isdn_dict.encode(df_group2['isdn'])
+target_ids = df_group2['isdn_id'].unique()
+target_table = id_membership(target_ids, size=len(isdn_dict))
+print(f"  Unique subscribers to process: {len(target_ids):,}")
 
 # Load feature data
 print("\n[2/6] Loading feature data...")
-df_features = pd.read_parquet('/data/ut360/output/datasets/dataset_with_features_202503-202508_CORRECTED.parquet')
-print(f"  Total feature records: {len(df_features):,}")
-
-# Filter for target ISDNs and latest month only
-df_latest = df_features[
-    (df_features['isdn'].isin(target_isdns)) &
-    (df_features['data_month'] == '202508')
-].drop_duplicates(subset=['isdn'], keep='first').copy()
+# Current snapshot from Phase 2: August only, one row per isdn_id
+df_features = load_snapshot(month='202508')
+print(f"  August feature records: {len(df_features):,}")
+
+# Filter for target ISDNs
+df_latest = df_features[isin_ids(df_features['isdn_id'], target_table)].copy()
 print(f"  Matched subscribers in August data: {len(df_latest):,}")
 
 # IMPORTANT: Filter for PRE (prepaid) subscribers only
@@ -54,15 +74,17 @@ else:
 # ==================== CALCULATE ARPU ====================
 print("\n[3/6] Loading ARPU data from master file...")
 df_master = pd.read_parquet('/data/ut360/output/master_with_arpu_correct_202503-202509.parquet')
+df_master = df_master[df_master['data_month'] == '202508']
+# External file keyed by isdn: map it onto isdn_id once, then filter/merge on integers
+df_master['isdn_id'] = isdn_dict.encode(df_master['isdn'])
 df_arpu = df_master[
-    (df_master['isdn'].isin(target_isdns)) &
-    (df_master['data_month'] == '202508')
-][['isdn', 'arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total']].copy()
-df_arpu = df_arpu.drop_duplicates(subset=['isdn'], keep='first')
+    isin_ids(df_master['isdn_id'], target_table)
+][['isdn_id', 'arpu_call', 'arpu_sms', 'arpu_data', 'arpu_total']].copy()
+df_arpu = df_arpu.drop_duplicates(subset=['isdn_id'], keep='first')
 print(f"  ARPU records matched: {len(df_arpu):,}")
 
 # Merge ARPU into main dataset
-df_latest = df_latest.merge(df_arpu, on='isdn', how='left', suffixes=('', '_y'))
+df_latest = df_latest.merge(df_arpu, on='isdn_id', how='left', suffixes=('', '_y'))
 # Drop duplicate columns if any
 df_latest = df_latest[[col for col in df_latest.columns if not col.endswith('_y')]]
 
@@ -87,28 +109,9 @@ print(f"  ✓ voice_sms_pct calculated")
 print(f"    Mean: {df_latest['voice_sms_pct'].mean():.2f}%")
 print(f"    Median: {df_latest['voice_sms_pct'].median():.2f}%")
 
-# ==================== USAGE TIME TABLE ====================
-def get_usage_time_hours(advance_amount):
-    """Bảng thời gian sử dụng (chỉ áp dụng cho MBFG)"""
-    if advance_amount <= 5000:
-        return 24
-    elif advance_amount <= 15000:
-        return 36
-    elif advance_amount <= 30000:
-        return 48
-    else:
-        return 60
-
 # ==================== SERVICE TYPE CLASSIFICATION ====================
 print("\n[5/6] Classifying service types based on business rules...")
 
-# Initialize columns
-df_latest['service_type'] = 'Unknown'
-df_latest['advance_amount'] = 0
-df_latest['usage_time_hours'] = 0
-df_latest['revenue_per_advance'] = 0
-df_latest['classification_reason'] = ''
-
 # Fill missing topup columns with 0
 for col in ['topup_count_last_1m', 'topup_amount_last_1m', 'topup_count_last_2m', 'avg_topup_amount']:
     if col not in df_latest.columns:
@@ -116,95 +119,27 @@ for col in ['topup_count_last_1m', 'topup_amount_last_1m', 'topup_count_last_2m'
     else:
         df_latest[col] = df_latest[col].fillna(0)
 
-# Rule 1: ungsanluong (Voice/SMS users)
-mask_ungsanluong = (df_latest['voice_sms_pct'] > 70)
-df_latest.loc[mask_ungsanluong, 'service_type'] = 'ungsanluong'
-df_latest.loc[mask_ungsanluong, 'classification_reason'] = 'voice_sms_pct > 70%'
-
-# For ungsanluong, calculate advance amount based on daily usage
-# Assume: daily_usage represents VND per day
-# Usage time for ungsanluong: Assume same as MBFG table for now (can be adjusted)
-df_latest.loc[mask_ungsanluong, 'advance_amount'] = np.minimum(
-    np.maximum(
-        df_latest.loc[mask_ungsanluong, 'arpu'] * 0.8,  # 80% of ARPU
-        10000  # Minimum 10k
-    ),
-    50000  # Maximum 50k
-).round(-3)  # Round to nearest 1000
-
-# Revenue for ungsanluong: Assume 20% markup on average
-df_latest.loc[mask_ungsanluong, 'revenue_per_advance'] = df_latest.loc[mask_ungsanluong, 'advance_amount'] * 0.20
-
-# Usage time for ungsanluong: Use same table as MBFG
-df_latest.loc[mask_ungsanluong, 'usage_time_hours'] = df_latest.loc[mask_ungsanluong, 'advance_amount'].apply(get_usage_time_hours)
-
-# Rule 2: EasyCredit (Có phí 30%)
-# Điều kiện:
-# - Nạp ít nhất 1 lần/tháng, mỗi lần >= 50k (hoặc trung bình >= 50k)
-# - Ổn định trong 2 tháng liên tiếp
-mask_easycredit = (
-    (~mask_ungsanluong) &  # Chưa được phân vào ungsanluong
-    (df_latest['topup_count_last_1m'] >= 1) &
-    (
-        (df_latest['topup_amount_last_1m'] >= 50000) |  # Tổng nạp >= 50k
-        (df_latest['avg_topup_amount'] >= 50000)  # Hoặc trung bình >= 50k
-    ) &
-    (df_latest['topup_count_last_2m'] >= 1)  # Có nạp trong 2 tháng
-)
-
-df_latest.loc[mask_easycredit, 'service_type'] = 'EasyCredit'
-df_latest.loc[mask_easycredit, 'classification_reason'] = 'topup >= 50k/month, consistent 2 months'
-
-# For EasyCredit: Calculate advance amount
-# Offer 25k for most, 50k for high ARPU (>100k)
-df_latest.loc[mask_easycredit, 'advance_amount'] = np.where(
-    df_latest.loc[mask_easycredit, 'arpu'] > 100000,
-    50000,  # VIP users
-    25000   # Default
-)
-
-# Revenue for EasyCredit: 30% fee
-df_latest.loc[mask_easycredit, 'revenue_per_advance'] = df_latest.loc[mask_easycredit, 'advance_amount'] * 0.30
-
-# Usage time for EasyCredit: UNLIMITED (until SIM locked)
-df_latest.loc[mask_easycredit, 'usage_time_hours'] = -1  # -1 = unlimited
-
-# Rule 3: MBFG (Không phí - profit from unused)
-# Điều kiện: Nạp >= 2 lần/tháng, mỗi lần ~20k (<50k)
-mask_mbfg = (
-    (~mask_ungsanluong) &  # Chưa được phân vào ungsanluong
-    (~mask_easycredit) &   # Chưa được phân vào EasyCredit
-    (df_latest['topup_count_last_1m'] >= 2)
-)
-
-df_latest.loc[mask_mbfg, 'service_type'] = 'MBFG'
-df_latest.loc[mask_mbfg, 'classification_reason'] = 'topup >= 2 times/month, amount < 50k'
-
-# For MBFG: Calculate advance amount based on ARPU
-# Offer ~1.2x ARPU to ensure they don't use all
-df_latest.loc[mask_mbfg, 'advance_amount'] = np.minimum(
-    np.maximum(
-        (df_latest.loc[mask_mbfg, 'arpu'] * 1.2).round(-3),  # Round to nearest 1000
-        10000  # Minimum 10k
-    ),
-    50000  # Maximum 50k
+# Rules, in order (utils/kernels.py classify_services, one pass per row):
+# 1. ungsanluong (Ứng sản lượng): voice_sms_pct > 70%, 80% of ARPU in [10k, 50k], 20% markup
+# 2. EasyCredit (Có phí 30%): nạp >= 1 lần/tháng, >= 50k (tổng hoặc trung bình), có nạp trong 2 tháng;
+#    25k (50k if ARPU > 100k), usage time UNLIMITED (-1)
+# 3. MBFG (Không phí - profit from unused): nạp >= 2 lần/tháng, 1.2x ARPU in [10k, 50k], 30% unused
+# Fallback: MBFG 10k. Usage time of ungsanluong / MBFG comes from the MBFG table (24-60 hours)
+
+# Indexed by the kernel's service code (rule order, then fallback)
+SERVICE_TYPES = np.array(['ungsanluong', 'EasyCredit', 'MBFG', 'MBFG'])
+SERVICE_REASONS = np.array(['voice_sms_pct > 70%', 'topup >= 50k/month, consistent 2 months',
+                            'topup >= 2 times/month, amount < 50k', 'fallback - default to MBFG 10k'])
+service_code, advance_amount, revenue_per_advance, usage_time_hours = kernels.classify_services(
+    df_latest['voice_sms_pct'], df_latest['arpu'], df_latest['topup_count_last_1m'],
+    df_latest['topup_amount_last_1m'], df_latest['avg_topup_amount'], df_latest['topup_count_last_2m'],
 )
-
-# Revenue for MBFG: Assume 30% unused on average (conservative estimate)
-df_latest.loc[mask_mbfg, 'revenue_per_advance'] = df_latest.loc[mask_mbfg, 'advance_amount'] * 0.30
-
-# Usage time for MBFG: From table
-df_latest.loc[mask_mbfg, 'usage_time_hours'] = df_latest.loc[mask_mbfg, 'advance_amount'].apply(get_usage_time_hours)
-
-# Fallback: For remaining subscribers (don't meet any criteria)
-# Assign to MBFG with minimum 10k
-mask_unknown = (df_latest['service_type'] == 'Unknown')
-if mask_unknown.sum() > 0:
-    df_latest.loc[mask_unknown, 'service_type'] = 'MBFG'
-    df_latest.loc[mask_unknown, 'advance_amount'] = 10000
-    df_latest.loc[mask_unknown, 'revenue_per_advance'] = 3000  # 30% of 10k
-    df_latest.loc[mask_unknown, 'usage_time_hours'] = 24
-    df_latest.loc[mask_unknown, 'classification_reason'] = 'fallback - default to MBFG 10k'
+df_latest['service_type'] = SERVICE_TYPES[service_code]
+# Amounts are whole thousands, revenues whole VND
+df_latest['advance_amount'] = advance_amount.astype(np.int64)
+df_latest['usage_time_hours'] = usage_time_hours
+df_latest['revenue_per_advance'] = revenue_per_advance.astype(np.int64)
+df_latest['classification_reason'] = SERVICE_REASONS[service_code]
 
 print(f"  ✓ Service types classified")
 
@@ -257,9 +192,12 @@ for label in advance_labels:
 # ==================== SAVE RESULTS ====================
 print("\n[7/7] Saving results...")
 
+# Original isdn is restored for the exported files
+df_latest['isdn'] = isdn_dict.decode(df_latest['isdn_id'])
+
 # Select final columns
 output_cols = [
-    'isdn', 'subscriber_type', 'service_type', 'advance_amount', 'usage_time_hours', 'revenue_per_advance',
+    'isdn', 'isdn_id', 'subscriber_type', 'service_type', 'advance_amount', 'usage_time_hours', 'revenue_per_advance',
     'arpu', 'arpu_call', 'arpu_sms', 'arpu_data', 'voice_sms_pct',
     'topup_count_last_1m', 'topup_amount_last_1m', 'avg_topup_amount',
     'classification_reason'
@@ -7,9 +7,25 @@ Ghép recommendations với logic lọc nợ xấu để ra file cuối cùng
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from pathlib import Path
+import argparse
+import sys
 import warnings
 warnings.filterwarnings('ignore')
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import kernels
+
+parser = argparse.ArgumentParser(description='Phase 4: bad debt risk filter')
+parser.add_argument('--kernels', choices=kernels.BACKENDS, default=None,
+                    help=f'Rule kernel backend (default: ${kernels.BACKEND_ENV} or auto = numba if installed)')
+args = parser.parse_args()
+if args.kernels:
+    try:
+        kernels.set_backend(args.kernels)
+    except ImportError as e:
+        parser.error(str(e))
+
 print("="*100)
 print("PHASE 4 - APPLY BAD DEBT RISK FILTER")
 print("Lọc bad debt risk từ recommendations với business rules")
@@ -32,7 +48,7 @@ for service in ['EasyCredit', 'MBFG', 'ungsanluong']:
 # ==================== CALCULATE BAD DEBT RISK ====================
 print("\n[2/5] Calculating bad debt risk...")
 
-# Initialize risk score
+# Initialize risk score (filled below; created first to keep the output column order)
 df['risk_score'] = 50  # Start at neutral
 
 # Feature 1: Topup vs Advance (MOST IMPORTANT - 40%)
@@ -43,51 +59,21 @@ df['topup_advance_ratio'] = np.where(
     0
 )
 
-# Apply topup-based risk adjustment
-df.loc[df['topup_amount_last_1m'] >= df['advance_amount'], 'risk_score'] -= 40  # Strong reduction
-df.loc[(df['topup_amount_last_1m'] > 0) & (df['topup_amount_last_1m'] < df['advance_amount']), 'risk_score'] -= 10  # Some reduction
-df.loc[df['topup_amount_last_1m'] == 0, 'risk_score'] += 40  # Strong increase
-
-# MBFG ADJUSTMENT: Free service relies on profit from unused portion, not direct topup
-# Users with topup_amount=0 are still valuable if they have good historical behavior
+# Risk score from neutral 50 (utils/kernels.py risk_scores, one pass per row):
+# - Topup vs advance (40%): -40 if topup >= advance, -10 if some topup, +40 if none
+#   (MBFG: +20 if none - free service relies on profit from unused portion)
+# - Topup frequency (20%): -15 / -10 / -5 for 3+ / 2 / 1 topups, +20 for none
+# - ARPU stability (20%): -15 / -10 / -5 from 5k / 2k / 1k, +10 under 500 (MBFG: extra -10 from 2k)
+# - Average topup amount (20%): -15 / -10 / -5 from 100k / 50k / 20k, +5 under 10k
+#   (MBFG: extra -10 from 20k)
+# Risk level: LOW <= 30 < MEDIUM <= 60 < HIGH
 mask_mbfg = df['service_type'] == 'MBFG'
-df.loc[mask_mbfg & (df['topup_amount_last_1m'] == 0), 'risk_score'] -= 20  # Reduce penalty from +40 to +20
-
-# Feature 2: Topup frequency (20%)
-df.loc[df['topup_count_last_1m'] >= 3, 'risk_score'] -= 15
-df.loc[df['topup_count_last_1m'] == 2, 'risk_score'] -= 10
-df.loc[df['topup_count_last_1m'] == 1, 'risk_score'] -= 5
-df.loc[df['topup_count_last_1m'] == 0, 'risk_score'] += 20
-
-# Feature 3: ARPU stability (20%)
-# MBFG ADJUSTMENT: Increase weight on ARPU since it indicates spending capacity
-df.loc[df['arpu'] >= 5000, 'risk_score'] -= 15
-df.loc[(df['arpu'] >= 2000) & (df['arpu'] < 5000), 'risk_score'] -= 10
-df.loc[(df['arpu'] >= 1000) & (df['arpu'] < 2000), 'risk_score'] -= 5
-df.loc[df['arpu'] < 500, 'risk_score'] += 10
-
-# MBFG BOOST: Extra reduction for ARPU >= 2000 (shows spending capacity)
-df.loc[mask_mbfg & (df['arpu'] >= 2000), 'risk_score'] -= 10
-
-# Feature 4: Average topup amount (20%)
-df.loc[df['avg_topup_amount'] >= 100000, 'risk_score'] -= 15
-df.loc[(df['avg_topup_amount'] >= 50000) & (df['avg_topup_amount'] < 100000), 'risk_score'] -= 10
-df.loc[(df['avg_topup_amount'] >= 20000) & (df['avg_topup_amount'] < 50000), 'risk_score'] -= 5
-df.loc[(df['avg_topup_amount'] > 0) & (df['avg_topup_amount'] < 10000), 'risk_score'] += 5
-
-# MBFG BOOST: Extra reduction for avg_topup >= 20k (historical good behavior)
-df.loc[mask_mbfg & (df['avg_topup_amount'] >= 20000), 'risk_score'] -= 10
-
-# Classify risk level based on risk_score
-def classify_risk(score):
-    if score <= 30:
-        return 'LOW'
-    elif score <= 60:
-        return 'MEDIUM'
-    else:
-        return 'HIGH'
-
-df['bad_debt_risk'] = df['risk_score'].apply(classify_risk)
+risk_score, risk_level = kernels.risk_scores(
+    df['topup_amount_last_1m'], df['advance_amount'], df['topup_count_last_1m'],
+    df['arpu'], df['avg_topup_amount'], mask_mbfg,
+)
+df['risk_score'] = risk_score
+df['bad_debt_risk'] = kernels.RISK_LEVELS[risk_level]
 
 print(f"  ✓ Bad debt risk calculated")
 
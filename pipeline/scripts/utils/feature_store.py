@@ -0,0 +1,305 @@
+"""
+FEATURE STORE: compact on-disk / in-memory layout of the Phase 2 features
+Phase 2 builds its columns as int64 / float64 / object. Before writing, the
+feature frame is compacted column by column:
+
+  flags (0/1 features)      int8
+  other integers            smallest of int8 / int16 / int32 / int64 holding the range
+  integral floats (no NaN)  the same integer types (window counts and sums)
+  other floats              float32 only if every value round-trips exactly (else float64:
+                            amounts, ARPU and debt keep every unit)
+  low-cardinality strings   category
+  keys (isdn_id, data_month), bool and datetime columns are kept as they are
+
+Optionally all flags are packed into one integer bitset column
+(FLAG_BITSET_COLUMN, bit i = flags[i]). The layout (flag order, packing and
+the original column order) is stored in the Parquet key-value metadata
+(LAYOUT_METADATA_KEY), so load_features() can unpack the flags and return the
+usual columns, in their usual order, whatever the file holds.
+Readers should use load_features() rather than pd.read_parquet().
+
+Phase 2 also publishes an uncompressed Arrow IPC (Feather v2) copy of the
+feature file next to it (same name, IPC_SUFFIX), with the same layout
+metadata. load_features() memory-maps that copy when it is current: selecting
+columns and months does not decode anything, numeric columns are handed to
+pandas without copying, and phases running on the same host share the file
+through the page cache.
+
+Next to the full history, Phase 2 writes the current snapshot: the latest
+month only, one row per subscriber (with its window / lag features already
+on the row), sorted by isdn_id with row-group statistics, plus
+SNAPSHOT_ADVANCE_COLUMN (any advance in the window). Its manifest
+(SNAPSHOT_MANIFEST) records the month it represents. Phases that only score
+the current month read it with load_snapshot().
+"""
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from utils.master_dataset import (MASTER_SORT_ORDER, parquet_sort_order, partition_dir, resolve_months,
+                                  write_sorted_parquet)
+
+FEATURES_FILE = Path('/data/ut360/output/datasets/dataset_with_features_202503-202508_CORRECTED.parquet')
+LAYOUT_METADATA_KEY = b'ut360.feature_layout'
+SNAPSHOT_FILE = Path('/data/ut360/output/datasets/features_snapshot_latest.parquet')
+SNAPSHOT_MANIFEST = SNAPSHOT_FILE.with_suffix('.json')
+SNAPSHOT_ADVANCE_COLUMN = 'advance_in_window'
+FLAG_BITSET_COLUMN = 'feature_flags'
+IPC_SUFFIX = '.arrow'
+CATEGORY_MAX_RATIO = 0.5
+KEEP_COLUMNS = tuple(MASTER_SORT_ORDER)
+
+INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def _smallest_int(values):
+    lo, hi = values.min(), values.max()
+    for dtype in INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return np.int64
+
+
+def downcast_column(series):
+    """Compact dtype for one column (unchanged if nothing smaller is exact enough)"""
+    dtype = series.dtype
+    if len(series) == 0 or pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+        return series
+    if isinstance(dtype, pd.CategoricalDtype):
+        return series
+    if pd.api.types.is_integer_dtype(dtype):
+        return series.astype(_smallest_int(series.to_numpy()))
+    if pd.api.types.is_float_dtype(dtype):
+        values = series.to_numpy(dtype=np.float64)
+        finite = np.isfinite(values)
+        if finite.all() and np.array_equal(values, np.round(values)):
+            return series.astype(_smallest_int(values))
+        narrow = values.astype(np.float32).astype(np.float64)
+        if np.array_equal(values, narrow, equal_nan=True):
+            return series.astype(np.float32)
+        return series
+    if pd.api.types.is_string_dtype(dtype) or dtype == object:
+        if series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series):
+            return series.astype('category')
+    return series
+
+
+def downcast_frame(df, keep=KEEP_COLUMNS):
+    """Copy of df with every column (except `keep`) in its compact dtype"""
+    return pd.DataFrame({col: df[col] if col in keep else downcast_column(df[col]) for col in df.columns},
+                        index=df.index)
+
+
+def pack_flags(df, flags):
+    """Replace the 0/1 columns `flags` with one bitset column (bit i = flags[i])"""
+    if len(flags) > 64:
+        raise ValueError(f"Cannot pack {len(flags)} flags into one 64-bit column")
+    bits = np.zeros(len(df), dtype=np.uint64)
+    for i, flag in enumerate(flags):
+        bits |= (df[flag].to_numpy().astype(np.uint64) & np.uint64(1)) << np.uint64(i)
+    width = next(dtype for dtype in (np.uint8, np.uint16, np.uint32, np.uint64) if np.iinfo(dtype).bits >= len(flags))
+    out = df.drop(columns=list(flags))
+    out[FLAG_BITSET_COLUMN] = bits.astype(width)
+    return out
+
+
+def unpack_flags(df, flags, columns=None):
+    """Restore int8 flag columns from the bitset column (only `columns` if given)"""
+    bits = df.pop(FLAG_BITSET_COLUMN).to_numpy().astype(np.uint64)
+    for i, flag in enumerate(flags):
+        if columns is None or flag in columns:
+            df[flag] = ((bits >> np.uint64(i)) & np.uint64(1)).astype(np.int8)
+    return df
+
+
+def compact_features(df, flags=(), pack=False):
+    """
+    Compacted copy of a feature frame for writing, plus the Parquet metadata
+    describing its layout: {LAYOUT_METADATA_KEY: json}.
+    """
+    flags = [flag for flag in flags if flag in df.columns]
+    layout = {'columns': list(df.columns), 'flags': flags, 'packed': bool(pack and flags)}
+    out = downcast_frame(df)
+    for flag in flags:
+        out[flag] = out[flag].astype(np.int8)
+    if layout['packed']:
+        out = pack_flags(out, flags)
+    return out, {LAYOUT_METADATA_KEY: json.dumps(layout).encode()}
+
+
+def _layout(schema):
+    raw = (schema.metadata or {}).get(LAYOUT_METADATA_KEY)
+    return json.loads(raw) if raw else None
+
+
+def file_layout(path):
+    """Layout recorded by compact_features, or None for files written without it"""
+    return _layout(pq.read_schema(path))
+
+
+def _to_table(df, metadata):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    merged = dict(table.schema.metadata or {})
+    merged.update(metadata or {})
+    return table.replace_schema_metadata(merged)
+
+
+def write_feature_file(df, path, metadata=None, compression='snappy'):
+    """Write a compacted feature frame with its layout metadata"""
+    pq.write_table(_to_table(df, metadata), path, compression=compression)
+
+
+def ipc_path(path=FEATURES_FILE):
+    """Arrow IPC copy of a feature file"""
+    return Path(path).with_suffix(IPC_SUFFIX)
+
+
+def write_feature_ipc(df, path, metadata=None):
+    """Write a compacted feature frame as an uncompressed Arrow IPC file (atomically)"""
+    path = Path(path)
+    tmp = path.with_name(path.name + f'.tmp{os.getpid()}')
+    table = _to_table(df, metadata)
+    with pa.OSFile(str(tmp), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+    return path
+
+
+def open_feature_ipc(path):
+    """Memory-mapped Arrow table of an IPC feature file (buffers point into the mapping)"""
+    return pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+
+
+def current_ipc(path):
+    """The IPC copy of a feature file if it was written after the file, else None"""
+    path = Path(path)
+    copy = ipc_path(path)
+    if not copy.exists():
+        return None
+    if path.exists() and copy.stat().st_mtime < path.stat().st_mtime:
+        return None
+    return copy
+
+
+def _stored_columns(layout, columns):
+    """Columns to read from a file with `layout` to return `columns`"""
+    if columns is None or layout is None or not layout['packed']:
+        return columns
+    stored = [col for col in columns if col not in layout['flags']]
+    if any(col in layout['flags'] for col in columns):
+        stored.append(FLAG_BITSET_COLUMN)
+    return stored
+
+
+def _read_file(path, columns, months=None):
+    if path.suffix == IPC_SUFFIX:
+        table = open_feature_ipc(path)
+        layout = _layout(table.schema)
+        if months is not None:
+            # Only the selected rows are copied; the rest stay in the mapping
+            table = table.filter(pc.is_in(table['data_month'], value_set=pa.array(list(months))))
+        read_cols = _stored_columns(layout, columns)
+        if read_cols is not None:
+            table = table.select(read_cols)
+        df = table.to_pandas(split_blocks=True)
+    else:
+        layout = file_layout(path)
+        filters = [('data_month', 'in', list(months))] if months is not None else None
+        df = pd.read_parquet(path, columns=_stored_columns(layout, columns), filters=filters)
+    if layout is None:
+        return df
+    if layout['packed'] and FLAG_BITSET_COLUMN in df.columns:
+        df = unpack_flags(df, layout['flags'], columns)
+    order = [col for col in (columns or layout['columns']) if col in df.columns]
+    return df[order + [col for col in df.columns if col not in order]]
+
+
+def load_features(path=FEATURES_FILE, columns=None, months=None, mmap=True):
+    """
+    Feature frame from a feature file or a partitioned feature dataset
+    (`months` selects months, default all), flags unpacked, columns in their
+    original order and compact dtypes. A feature file is read through its
+    memory-mapped IPC copy when that copy is current (mmap=False: never).
+    """
+    path = Path(path)
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+    if not path.is_dir():
+        copy = current_ipc(path) if mmap else None
+        return _read_file(copy or path, columns, months)
+
+    if columns is not None:
+        columns = list(dict.fromkeys(MASTER_SORT_ORDER + columns))
+    frames = []
+    contract = True
+    for month in resolve_months(path, months):
+        for part in sorted(partition_dir(path, month).glob('*.parquet')):
+            contract = contract and parquet_sort_order(part) == MASTER_SORT_ORDER
+            frames.append(_read_file(part, columns))
+    if not frames:
+        raise FileNotFoundError(f"No feature partitions found in {path}")
+    df = pd.concat(frames, ignore_index=True)
+    if contract and len(frames) > 1:
+        # Month-ordered runs of isdn-sorted parts: a stable argsort restores the order
+        df = df.take(np.argsort(df['isdn_id'].to_numpy(), kind='stable')).reset_index(drop=True)
+    # Parts compacted separately may disagree on widths / categories
+    return downcast_frame(df)
+
+
+def write_snapshot(df, month, window, metadata=None, path=SNAPSHOT_FILE):
+    """
+    Write the current snapshot (rows of `month`, sorted by isdn_id) and then
+    its manifest; both are replaced atomically.
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + f'.tmp{os.getpid()}')
+    write_sorted_parquet(df, tmp, metadata=metadata)
+    os.replace(tmp, path)
+    manifest = {
+        'data_month': month,
+        'window': list(window),
+        'rows': int(len(df)),
+        'file': path.name,
+        'written_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    manifest_path = path.with_suffix('.json')
+    with open(manifest_path.with_suffix('.json.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path.with_suffix('.json.tmp'), manifest_path)
+    return manifest
+
+
+def load_snapshot_manifest(path=SNAPSHOT_FILE):
+    manifest_path = Path(path).with_suffix('.json')
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def load_snapshot(month=None, columns=None, path=SNAPSHOT_FILE):
+    """
+    Current snapshot frame (one row per isdn_id, sorted by it); the month is
+    in df.attrs['data_month']. Raises if there is no snapshot, or it is not
+    of `month`.
+    """
+    manifest = load_snapshot_manifest(path)
+    if manifest is None or not Path(path).exists():
+        raise FileNotFoundError(f"No feature snapshot at {path} - run Phase 2 first")
+    if month is not None and manifest['data_month'] != month:
+        raise ValueError(f"Feature snapshot is of {manifest['data_month']}, not {month} - "
+                         f"rerun Phase 2 through {month}")
+    if columns is not None:
+        columns = list(dict.fromkeys(MASTER_SORT_ORDER + list(columns)))
+    df = _read_file(Path(path), columns)
+    df.attrs['data_month'] = manifest['data_month']
+    return df
@@ -6,8 +6,13 @@ Run this after pipeline completes to create lightweight summary files
 
 import pandas as pd
 import json
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.feature_store import FEATURES_FILE, load_features
+from utils.master_dataset import MASTER_DATASET_DIR, list_months, read_master
+
 output_dir = Path('/data/ut360/output/summaries')
 output_dir.mkdir(exist_ok=True)
 
@@ -16,25 +21,34 @@ print("Generating phase summaries...")
 # ==================== PHASE 1 SUMMARY ====================
 print("\n[1/5] Phase 1 - Data Loading...")
 try:
-    master_file = '/data/ut360/output/datasets/master_full_202503-202508.parquet'
-    df = pd.read_parquet(master_file)
-
-    # IMPORTANT: Master file has duplicate records per (isdn, month) due to multiple packages
-    # Need to deduplicate before calculating totals
-    df_dedup = df.groupby(['isdn', 'data_month'], as_index=False).agg({
-        'subscriber_type': 'first',
-        'has_advance_in_month': 'first',
-        'topup_count': 'first',
-        'total_advance_amount': 'first',
-        'total_topup_amount': 'first'
-    })
+    if list_months(MASTER_DATASET_DIR):
+        df = read_master(MASTER_DATASET_DIR, window=6)
+    else:
+        master_file = '/data/ut360/output/datasets/master_full_202503-202508.parquet'
+        df = pd.read_parquet(master_file)
+
+    # Subscriber key: integer isdn_id (legacy single-file masters still carry isdn)
+    key = 'isdn_id' if 'isdn_id' in df.columns else 'isdn'
+
+    # The isdn_id master is one row per (isdn_id, month). Legacy isdn-keyed masters
+    # had duplicate records per (isdn, month) due to multiple packages: deduplicate those
+    if key == 'isdn_id':
+        df_dedup = df
+    else:
+        df_dedup = df.groupby([key, 'data_month'], as_index=False).agg({
+            'subscriber_type': 'first',
+            'has_advance_in_month': 'first',
+            'topup_count': 'first',
+            'total_advance_amount': 'first',
+            'total_topup_amount': 'first'
+        })
 
     summary = {
         "total_records": int(len(df)),
-        "unique_subscribers": int(df['isdn'].nunique()),
+        "unique_subscribers": int(df[key].nunique()),
         "months": sorted(df['data_month'].unique().tolist()),
-        "advance_users": int(df_dedup[df_dedup['has_advance_in_month'] == True]['isdn'].nunique()),
-        "topup_users": int(df_dedup[df_dedup['topup_count'] > 0]['isdn'].nunique()),
+        "advance_users": int(df_dedup[df_dedup['has_advance_in_month'] == True][key].nunique()),
+        "topup_users": int(df_dedup[df_dedup['topup_count'] > 0][key].nunique()),
         "total_advance_amount": float(df_dedup['total_advance_amount'].sum()),
         "total_topup_amount": float(df_dedup['total_topup_amount'].sum())
     }
@@ -44,7 +58,7 @@ try:
 
     # Monthly statistics (use deduplicated data)
     monthly_stats = df_dedup.groupby('data_month').agg({
-        'isdn': 'nunique',
+        key: 'nunique',
         'total_topup_amount': 'sum',
         'total_advance_amount': 'sum'
     }).reset_index()
@@ -65,11 +79,11 @@ except Exception as e:
 # ==================== PHASE 2 SUMMARY ====================
 print("\n[2/5] Phase 2 - Feature Engineering...")
 try:
-    features_file = '/data/ut360/output/datasets/dataset_with_features_202503-202508_CORRECTED.parquet'
-    df = pd.read_parquet(features_file)
+    df = load_features(FEATURES_FILE)
 
     # Get feature columns
-    original_cols = ['isdn', 'subscriber_type', 'subscriber_status', 'data_month']
+    key = 'isdn_id' if 'isdn_id' in df.columns else 'isdn'
+    original_cols = [key, 'subscriber_type', 'subscriber_status', 'data_month']
     feature_cols = [col for col in df.columns if col not in original_cols]
 
     # Sample latest month
@@ -93,7 +107,7 @@ try:
             "advance_features": len(advance_features),
             "topup_features": len(topup_features),
             "financial_features": len(financial_features),
-            "total_subscribers": int(df_latest['isdn'].nunique())
+            "total_subscribers": int(df_latest[key].nunique())
         },
         "feature_categories": {
             "advance": advance_features[:10],
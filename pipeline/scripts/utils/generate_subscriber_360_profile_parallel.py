@@ -32,7 +32,7 @@ print(f"  Monthly records: {len(df_monthly):,}")
 
 print(f"\n[2/4] Calculating ARPU statistics (VECTORIZED)...")
 # Pure vectorized operations - no loops
-monthly_agg = df_monthly.groupby('isdn', as_index=False).agg({
+monthly_agg = df_monthly.groupby('isdn_id', as_index=False).agg({
     'arpu_total': ['mean', 'std', 'min', 'max', 'first', 'last'],
     'arpu_call': 'mean',
     'arpu_sms': 'mean',
@@ -40,7 +40,7 @@ monthly_agg = df_monthly.groupby('isdn', as_index=False).agg({
     'data_month': 'count'
 })
 
-monthly_agg.columns = ['isdn', 'arpu_avg_6m', 'arpu_std_6m', 'arpu_min_6m', 'arpu_max_6m',
+monthly_agg.columns = ['isdn_id', 'arpu_avg_6m', 'arpu_std_6m', 'arpu_min_6m', 'arpu_max_6m',
                        'arpu_first', 'arpu_last', 'arpu_call_avg', 'arpu_sms_avg', 
                        'arpu_data_avg', 'months_count']
 
@@ -62,7 +62,7 @@ monthly_agg['arpu_trend'] = np.select(conditions, choices, default='Ổn định
 print(f"  ✓ Stats for {len(monthly_agg):,} subscribers")
 
 print(f"\n[3/4] Merging and calculating profiles (VECTORIZED)...")
-df_profile = df_rec.merge(monthly_agg, on='isdn', how='left')
+df_profile = df_rec.merge(monthly_agg, on='isdn_id', how='left')
 
 # All calculations are vectorized - no Python loops
 df_profile['revenue_call_pct'] = np.where(
@@ -118,7 +118,7 @@ print(f"  ✓ All calculations completed")
 
 print(f"\n[4/4] Saving to parquet...")
 profile_columns = [
-    'isdn', 'subscriber_type', 'service_type', 'advance_amount', 'revenue_per_advance',
+    'isdn', 'isdn_id', 'subscriber_type', 'service_type', 'advance_amount', 'revenue_per_advance',
     'arpu', 'arpu_call', 'arpu_sms', 'arpu_data',
     'arpu_avg_6m', 'arpu_std_6m', 'arpu_min_6m', 'arpu_max_6m',
     'arpu_growth_rate', 'arpu_trend',
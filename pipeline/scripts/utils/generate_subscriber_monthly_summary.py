@@ -6,8 +6,12 @@ This allows fast lookup in API without loading 59M records parquet
 
 import pandas as pd
 import json
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.isdn_dictionary import ISDN_DICTIONARY_FILE, IsdnDictionary, id_membership, isin_ids
+
 print("="*80)
 print("GENERATING SUBSCRIBER MONTHLY SUMMARY")
 print("="*80)
@@ -22,9 +26,13 @@ print(f"\n[1/4] Loading recommendations file...")
 df_rec = pd.read_csv(recommendations_file)
 print(f"  Recommendations: {len(df_rec):,} subscribers")
 
-# Get list of recommended ISDNs
-recommended_isdns = set(df_rec['isdn'].unique())
-print(f"  Unique ISDNs: {len(recommended_isdns):,}")
+# Get list of recommended ISDNs (as an isdn_id membership table)
+isdn_dict = IsdnDictionary.load(ISDN_DICTIONARY_FILE)
+if 'isdn_id' not in df_rec.columns:
+    df_rec['isdn_id'] = isdn_dict.encode(df_rec['isdn'])
+recommended_ids = df_rec['isdn_id'].unique()
+recommended_table = id_membership(recommended_ids, size=len(isdn_dict))
+print(f"  Unique ISDNs: {len(recommended_ids):,}")
 
 print(f"\n[2/4] Loading master file (this may take a while)...")
 # Only load needed columns
@@ -33,17 +41,19 @@ df_master = pd.read_parquet(master_file, columns=columns_needed)
 print(f"  Total records: {len(df_master):,}")
 
 print(f"\n[3/4] Filtering for recommended subscribers only...")
-df_filtered = df_master[df_master['isdn'].isin(recommended_isdns)]
+df_master['isdn_id'] = isdn_dict.encode(df_master.pop('isdn'))
+df_filtered = df_master[isin_ids(df_master['isdn_id'], recommended_table)]
 print(f"  Filtered records: {len(df_filtered):,}")
 
 print(f"\n[4/4] Aggregating monthly data...")
 # Group by ISDN and month
-monthly_summary = df_filtered.groupby(['isdn', 'data_month']).agg({
+monthly_summary = df_filtered.groupby(['isdn_id', 'data_month']).agg({
     'arpu_call': 'mean',
     'arpu_sms': 'mean',
     'arpu_data': 'mean',
     'arpu_total': 'mean'
 }).reset_index()
+monthly_summary.insert(0, 'isdn', isdn_dict.decode(monthly_summary['isdn_id']))
 
 print(f"  Summary records: {len(monthly_summary):,}")
 
@@ -59,4 +69,4 @@ print("✅ COMPLETED!")
 print("="*80)
 print(f"\nOutput: {output_file}")
 print(f"Records: {len(monthly_summary):,}")
-print(f"Unique subscribers: {monthly_summary['isdn'].nunique():,}")
+print(f"Unique subscribers: {monthly_summary['isdn_id'].nunique():,}")
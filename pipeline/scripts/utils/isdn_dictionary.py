@@ -0,0 +1,121 @@
+"""
+ISDN DICTIONARY: dense integer surrogate keys for subscribers
+Phase 1 assigns every subscriber in N10 a dense int64 `isdn_id`; the master,
+the feature dataset and every intermediate file carry that id instead of the
+isdn string, so merges, isin filters, sorts and groupbys run on integers.
+The original isdn is restored with decode() only at output boundaries
+(recommendation CSVs, 360 profile, database / Redis sync).
+
+The dictionary is append-only: ids never change once assigned, so month
+partitions written by different (incremental) runs stay joinable. Each
+dictionary also carries a uid that is created with it and kept across saves;
+artifacts keyed on isdn_id (e.g. cached Phase 1 aggregates) record it, so a
+dictionary rebuilt from scratch invalidates them.
+"""
+
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ISDN_DICTIONARY_FILE = Path('/data/ut360/output/datasets/isdn_dictionary.parquet')
+UID_METADATA_KEY = b'ut360.dictionary_uid'
+
+
+def _as_keys(isdns):
+    # isdn is parsed as int by some readers and as str by others; the dictionary
+    # always keys on the string form so lookups match whatever the source dtype.
+    # A single blank isdn makes pandas parse the whole column as float: integral
+    # values are keyed as ints (not "849....0") and NaN gets a key that never matches
+    index = pd.Index(isdns)
+    if pd.api.types.is_float_dtype(index.dtype):
+        values = index.to_numpy(dtype=np.float64)
+        valid = np.isfinite(values)
+        valid[valid] = values[valid] == np.round(values[valid])
+        keys = np.full(len(values), '', dtype=object)
+        keys[valid] = values[valid].astype(np.int64).astype(str)
+        return pd.Index(keys).astype(str)
+    return index.astype(str)
+
+
+class IsdnDictionary:
+    """Bidirectional isdn <-> isdn_id mapping (isdn_id = position in insertion order)"""
+
+    def __init__(self, isdns=None, uid=None):
+        self._index = _as_keys(isdns if isdns is not None else [])
+        self.uid = uid or uuid.uuid4().hex
+
+    @classmethod
+    def load(cls, path=ISDN_DICTIONARY_FILE):
+        """Load the persisted dictionary, or start an empty one"""
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        table = pq.read_table(path)
+        uid = (table.schema.metadata or {}).get(UID_METADATA_KEY)
+        df = table.to_pandas().sort_values('isdn_id')
+        return cls(df['isdn'].to_numpy(), uid=uid.decode() if uid else None)
+
+    def save(self, path=ISDN_DICTIONARY_FILE):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + f'.tmp{os.getpid()}')
+        table = pa.Table.from_pandas(pd.DataFrame({
+            'isdn_id': np.arange(len(self._index), dtype=np.int64),
+            'isdn': self._index.to_numpy(),
+        }), preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[UID_METADATA_KEY] = self.uid.encode()
+        pq.write_table(table.replace_schema_metadata(metadata), tmp)
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self._index)
+
+    def extend(self, isdns):
+        """Assign ids to subscribers not seen before; returns the number of new ids"""
+        candidates = _as_keys(pd.unique(pd.Series(isdns).dropna()))
+        if len(self._index):
+            candidates = candidates[self._index.get_indexer(candidates) < 0]
+        if len(candidates) == 0:
+            return 0
+        if len(self._index) == 0:
+            self._index = candidates.sort_values()
+        else:
+            self._index = self._index.append(candidates.sort_values())
+        return len(candidates)
+
+    def encode(self, isdns):
+        """isdn values -> int64 ids (-1 for subscribers not in the dictionary)"""
+        if len(self._index) == 0:
+            return np.full(len(isdns), -1, dtype=np.int64)
+        return self._index.get_indexer(_as_keys(isdns)).astype(np.int64)
+
+    def decode(self, ids):
+        """int ids -> original isdn values"""
+        return self._index.to_numpy()[np.asarray(ids, dtype=np.int64)]
+
+
+def id_membership(ids, size=None):
+    """
+    Boolean lookup table over the dense id space: table[isdn_id] is True for
+    every id in `ids`. Replaces Series.isin(set_of_isdns) on the hot paths.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    size = size if size is not None else (int(ids.max()) + 1 if len(ids) else 0)
+    table = np.zeros(size, dtype=bool)
+    table[ids[(ids >= 0) & (ids < size)]] = True
+    return table
+
+
+def isin_ids(ids, table):
+    """Vectorized membership of ids against an id_membership table"""
+    ids = np.asarray(ids, dtype=np.int64)
+    inside = (ids >= 0) & (ids < len(table))
+    result = np.zeros(len(ids), dtype=bool)
+    result[inside] = table[ids[inside]]
+    return result
@@ -0,0 +1,392 @@
+"""
+KERNEL PACK: per-subscriber scans and per-row rule chains
+The hot loops shared by Phase 2 and Phase 3, each with two implementations
+that return identical arrays:
+
+  window_scan        lagged window sums, history flags and months-since counts
+                     over (isdn_id, data_month)-sorted rows (window_kernels.py)
+  risk_scores        Phase 4 bad debt risk score + level
+  classify_services  Phase 3b service type, advance amount, revenue, usage time
+
+Backends:
+  numpy   vectorized NumPy, always available (reference results)
+  numba   fused single-pass loops compiled with Numba, parallel over row
+          ranges (subscriber segments for window_scan); optional dependency
+  auto    numba when it is installed, else numpy (default)
+
+The backend is chosen with set_backend() (the scripts' --kernels flag), or the
+UT360_KERNELS environment variable. Run this file to check that both
+backends agree: without Numba the loops run interpreted, on a smaller sample.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    _jit = numba.njit(parallel=True, cache=True)
+    prange = numba.prange
+else:
+    def _jit(fn):
+        return fn
+    prange = range
+
+BACKENDS = ('auto', 'numpy', 'numba')
+BACKEND_ENV = 'UT360_KERNELS'
+
+RISK_LEVELS = np.array(['LOW', 'MEDIUM', 'HIGH'])
+# Service codes returned by classify_services, in rule order
+SERVICE_UNGSANLUONG, SERVICE_EASYCREDIT, SERVICE_MBFG, SERVICE_FALLBACK = range(4)
+
+_backend = None
+
+
+def set_backend(name):
+    """Select the kernel backend ('auto', 'numpy' or 'numba'); returns the one in use"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown kernel backend {name!r} (expected one of {BACKENDS})")
+    if name == 'numba' and numba is None:
+        raise ImportError("numba kernel backend requested but numba is not installed (pip install numba)")
+    _backend = 'numba' if name == 'auto' and numba is not None else ('numpy' if name == 'auto' else name)
+    return _backend
+
+
+def backend():
+    """Kernel backend in use (from UT360_KERNELS, default auto, until set_backend is called)"""
+    if _backend is None:
+        set_backend(os.environ.get(BACKEND_ENV, 'auto'))
+    return _backend
+
+
+# ==================== WINDOW SCAN ====================
+def _window_scan_numpy(starts, months, sums, lags, history, since, no_event):
+    n = len(starts)
+    positions = np.arange(n)
+    sums_out = np.zeros((len(sums), lags, n))
+    history_out = np.zeros((len(history), n), dtype=np.int64)
+    since_out = np.zeros((len(since), n), dtype=np.int64)
+
+    # Lag j is valid while it stays inside the row's own subscriber segment;
+    # window w is window w-1 plus lag w
+    lag_valid = {lag: positions - lag >= starts for lag in range(1, lags + 1)}
+    for k, values in enumerate(sums):
+        running = np.zeros(n)
+        for lag in range(1, lags + 1):
+            lagged = np.zeros(n)
+            if lag < n:
+                lagged[lag:] = values[:-lag]
+            running = running + np.where(lag_valid[lag], lagged, 0.0)
+            sums_out[k, lag - 1] = running
+
+    # Positive records strictly before each row, counted inside its segment
+    for k, values in enumerate(history):
+        positive = (values > 0).astype(np.int64)
+        before = np.concatenate(([0], np.cumsum(positive)[:-1])) if n else positive
+        history_out[k] = (before - before[starts]) > 0
+
+    # Latest positive record at or before each row, if it is in the same segment
+    for k, values in enumerate(since):
+        last = np.maximum.accumulate(np.where(values > 0, positions, -1)) if n else positions
+        has_event = last >= starts
+        since_out[k] = np.where(has_event, months - months[np.where(has_event, last, 0)], no_event)
+
+    return sums_out, history_out, since_out
+
+
+@_jit
+def _window_scan_loops(bounds, months, sums, lags, history, since, no_event):
+    n = months.shape[0]
+    sums_out = np.zeros((sums.shape[0], lags, n))
+    history_out = np.zeros((history.shape[0], n), dtype=np.int64)
+    since_out = np.zeros((since.shape[0], n), dtype=np.int64)
+    # One subscriber segment per iteration: every lag stays inside [lo, hi)
+    for seg in prange(bounds.shape[0] - 1):
+        lo = bounds[seg]
+        hi = bounds[seg + 1]
+        for k in range(sums.shape[0]):
+            for i in range(lo, hi):
+                running = 0.0
+                for lag in range(1, lags + 1):
+                    if i - lag >= lo:
+                        running += sums[k, i - lag]
+                    sums_out[k, lag - 1, i] = running
+        for k in range(history.shape[0]):
+            seen = 0
+            for i in range(lo, hi):
+                history_out[k, i] = seen
+                if history[k, i] > 0:
+                    seen = 1
+        for k in range(since.shape[0]):
+            last = -1
+            for i in range(lo, hi):
+                if since[k, i] > 0:
+                    last = i
+                since_out[k, i] = months[i] - months[last] if last >= 0 else no_event
+    return sums_out, history_out, since_out
+
+
+def window_scan(starts, months, sums, lags, history, since, no_event, backend_name=None):
+    """
+    Segmented window pass over n sorted rows.
+
+    starts:  first row of each row's subscriber segment (window_kernels.segment_starts)
+    months:  running calendar month number per row (int64)
+    sums:    (k, n) float64 without NaN -> (k, lags, n) sums of the previous 1..lags records
+    history: (h, n) float64 -> (h, n) int64, 1 if any previous record is > 0
+    since:   (s, n) float64 -> (s, n) int64 months since the latest record > 0, else no_event
+    """
+    months = np.asarray(months, dtype=np.int64)
+    if (backend_name or backend()) == 'numba':
+        n = len(starts)
+        bounds = np.append(np.flatnonzero(starts == np.arange(n)), n).astype(np.int64)
+        return _window_scan_loops(bounds, months, sums, lags, history, since, no_event)
+    return _window_scan_numpy(starts, months, sums, lags, history, since, no_event)
+
+
+# ==================== PHASE 4: BAD DEBT RISK ====================
+def _risk_numpy(topup_amount, advance_amount, topup_count, arpu, avg_topup, is_mbfg):
+    score = np.full(len(topup_amount), 50, dtype=np.int64)
+    # Topup vs advance (40%); MBFG relies on the unused portion, so no topup is penalised less
+    score -= 40 * (topup_amount >= advance_amount)
+    score -= 10 * ((topup_amount > 0) & (topup_amount < advance_amount))
+    score += 40 * (topup_amount == 0)
+    score -= 20 * (is_mbfg & (topup_amount == 0))
+    # Topup frequency (20%)
+    score -= 15 * (topup_count >= 3)
+    score -= 10 * (topup_count == 2)
+    score -= 5 * (topup_count == 1)
+    score += 20 * (topup_count == 0)
+    # ARPU stability (20%), MBFG boost for spending capacity
+    score -= 15 * (arpu >= 5000)
+    score -= 10 * ((arpu >= 2000) & (arpu < 5000))
+    score -= 5 * ((arpu >= 1000) & (arpu < 2000))
+    score += 10 * (arpu < 500)
+    score -= 10 * (is_mbfg & (arpu >= 2000))
+    # Average topup amount (20%), MBFG boost for historical good behavior
+    score -= 15 * (avg_topup >= 100000)
+    score -= 10 * ((avg_topup >= 50000) & (avg_topup < 100000))
+    score -= 5 * ((avg_topup >= 20000) & (avg_topup < 50000))
+    score += 5 * ((avg_topup > 0) & (avg_topup < 10000))
+    score -= 10 * (is_mbfg & (avg_topup >= 20000))
+    level = np.where(score <= 30, 0, np.where(score <= 60, 1, 2))
+    return score, level
+
+
+@_jit
+def _risk_loops(topup_amount, advance_amount, topup_count, arpu, avg_topup, is_mbfg):
+    n = topup_amount.shape[0]
+    score = np.empty(n, dtype=np.int64)
+    level = np.empty(n, dtype=np.int64)
+    for i in prange(n):
+        t = topup_amount[i]
+        a = advance_amount[i]
+        c = topup_count[i]
+        r = arpu[i]
+        g = avg_topup[i]
+        s = 50
+        if t >= a:
+            s -= 40
+        if t > 0 and t < a:
+            s -= 10
+        if t == 0:
+            s += 40
+            if is_mbfg[i]:
+                s -= 20
+        if c >= 3:
+            s -= 15
+        elif c == 2:
+            s -= 10
+        elif c == 1:
+            s -= 5
+        elif c == 0:
+            s += 20
+        if r >= 5000:
+            s -= 15
+        elif r >= 2000:
+            s -= 10
+        elif r >= 1000:
+            s -= 5
+        elif r < 500:
+            s += 10
+        if is_mbfg[i] and r >= 2000:
+            s -= 10
+        if g >= 100000:
+            s -= 15
+        elif g >= 50000:
+            s -= 10
+        elif g >= 20000:
+            s -= 5
+        elif g > 0 and g < 10000:
+            s += 5
+        if is_mbfg[i] and g >= 20000:
+            s -= 10
+        score[i] = s
+        level[i] = 0 if s <= 30 else (1 if s <= 60 else 2)
+    return score, level
+
+
+def risk_scores(topup_amount, advance_amount, topup_count, arpu, avg_topup, is_mbfg, backend_name=None):
+    """(risk score int64, level index into RISK_LEVELS) per recommendation"""
+    args = [np.asarray(values, dtype=np.float64) for values in
+            (topup_amount, advance_amount, topup_count, arpu, avg_topup)]
+    args.append(np.asarray(is_mbfg, dtype=bool))
+    if (backend_name or backend()) == 'numba':
+        return _risk_loops(*args)
+    return _risk_numpy(*args)
+
+
+# ==================== PHASE 3B: SERVICE CLASSIFICATION ====================
+def _round_thousands(values):
+    # Same as Series.round(-3): round half to even on values / 1000
+    return np.rint(values / 1000.0) * 1000.0
+
+
+def _usage_hours_numpy(amount):
+    """MBFG usage time table (hours by advance amount)"""
+    return np.where(amount <= 5000, 24, np.where(amount <= 15000, 36, np.where(amount <= 30000, 48, 60)))
+
+
+def _classify_numpy(voice_sms_pct, arpu, topup_count_1m, topup_amount_1m, avg_topup, topup_count_2m):
+    # Rule 1: ungsanluong (voice/SMS users), 80% of ARPU in [10k, 50k]
+    ungsanluong = voice_sms_pct > 70
+    # Rule 2: EasyCredit (30% fee), topup >= 50k/month and consistent over 2 months
+    easycredit = (~ungsanluong & (topup_count_1m >= 1) &
+                  ((topup_amount_1m >= 50000) | (avg_topup >= 50000)) & (topup_count_2m >= 1))
+    # Rule 3: MBFG (free, profit from unused), >= 2 topups/month, 1.2x ARPU in [10k, 50k]
+    mbfg = ~ungsanluong & ~easycredit & (topup_count_1m >= 2)
+    rules = [ungsanluong, easycredit, mbfg]
+
+    code = np.select(rules, [SERVICE_UNGSANLUONG, SERVICE_EASYCREDIT, SERVICE_MBFG], default=SERVICE_FALLBACK)
+    amount = np.select(rules, [
+        _round_thousands(np.minimum(np.maximum(arpu * 0.8, 10000), 50000)),
+        np.where(arpu > 100000, 50000.0, 25000.0),
+        np.minimum(np.maximum(_round_thousands(arpu * 1.2), 10000), 50000),
+    ], default=10000.0)
+    revenue = np.select(rules, [amount * 0.20, amount * 0.30, amount * 0.30], default=3000.0)
+    usage = np.select([easycredit, code == SERVICE_FALLBACK], [-1, 24], default=_usage_hours_numpy(amount))
+    return code, amount, revenue, usage.astype(np.int64)
+
+
+@_jit
+def _classify_loops(voice_sms_pct, arpu, topup_count_1m, topup_amount_1m, avg_topup, topup_count_2m):
+    n = arpu.shape[0]
+    code = np.empty(n, dtype=np.int64)
+    amount = np.empty(n)
+    revenue = np.empty(n)
+    usage = np.empty(n, dtype=np.int64)
+    for i in prange(n):
+        r = arpu[i]
+        if voice_sms_pct[i] > 70:
+            c = SERVICE_UNGSANLUONG
+            a = r * 0.8
+            if a < 10000:
+                a = 10000.0
+            if a > 50000:
+                a = 50000.0
+            a = np.rint(a / 1000.0) * 1000.0
+            v = a * 0.20
+        elif (topup_count_1m[i] >= 1 and (topup_amount_1m[i] >= 50000 or avg_topup[i] >= 50000)
+              and topup_count_2m[i] >= 1):
+            c = SERVICE_EASYCREDIT
+            a = 50000.0 if r > 100000 else 25000.0
+            v = a * 0.30
+        elif topup_count_1m[i] >= 2:
+            c = SERVICE_MBFG
+            a = np.rint(r * 1.2 / 1000.0) * 1000.0
+            if a < 10000:
+                a = 10000.0
+            if a > 50000:
+                a = 50000.0
+            v = a * 0.30
+        else:
+            c = SERVICE_FALLBACK
+            a = 10000.0
+            v = 3000.0
+        if c == SERVICE_EASYCREDIT:
+            u = -1
+        elif c == SERVICE_FALLBACK:
+            u = 24
+        elif a <= 5000:
+            u = 24
+        elif a <= 15000:
+            u = 36
+        elif a <= 30000:
+            u = 48
+        else:
+            u = 60
+        code[i] = c
+        amount[i] = a
+        revenue[i] = v
+        usage[i] = u
+    return code, amount, revenue, usage
+
+
+def classify_services(voice_sms_pct, arpu, topup_count_1m, topup_amount_1m, avg_topup, topup_count_2m,
+                      backend_name=None):
+    """(service code, advance amount, revenue per advance, usage time hours) per subscriber"""
+    args = [np.asarray(values, dtype=np.float64) for values in
+            (voice_sms_pct, arpu, topup_count_1m, topup_amount_1m, avg_topup, topup_count_2m)]
+    if (backend_name or backend()) == 'numba':
+        return _classify_loops(*args)
+    return _classify_numpy(*args)
+
+
+# ==================== PARITY CHECK ====================
+def _sample(n_subscribers, seed):
+    """Synthetic inputs covering segment edges, rule thresholds and NaN"""
+    rng = np.random.default_rng(seed)
+    records = rng.integers(1, 8, n_subscribers)
+    isdn_ids = np.repeat(np.arange(n_subscribers), records)
+    n = len(isdn_ids)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = isdn_ids[1:] != isdn_ids[:-1]
+    starts = np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+    months = 2025 * 12 + np.arange(n) - starts + rng.integers(0, 2, n).cumsum() % 3
+
+    def values(choices):
+        out = rng.choice(np.asarray(choices, dtype=np.float64), n)
+        out[rng.random(n) < 0.02] = np.nan
+        return out
+
+    amounts = values([0, 1000, 5000, 9999, 10000, 20000, 50000, 100000, 250000])
+    window = (starts, months, np.nan_to_num(np.vstack([amounts, values([0, 1, 2, 3])])), 3,
+              np.vstack([values([0, 1])]), np.vstack([values([0, 0, 1])]), 99)
+    risk = (amounts, values([0, 10000, 25000, 50000]), values([0, 1, 2, 3, 5]),
+            values([0, 499, 500, 1000, 1999, 2000, 4999, 5000, 9000]), amounts, rng.random(n) < 0.4)
+    classify = (values([0, 50, 70, 70.5, 100]), values([0, 4000, 8300, 12500, 40000, 100000, 100001]),
+                values([0, 1, 2, 3]), amounts, amounts, values([0, 1, 2]))
+    return window, risk, classify
+
+
+def check_parity(n_subscribers=None, seed=0):
+    """Assert that the numpy and numba backends return identical arrays; returns the row count"""
+    if n_subscribers is None:
+        n_subscribers = 200_000 if numba is not None else 2_000
+    window, risk, classify = _sample(n_subscribers, seed)
+    for name, fn, args in [('window_scan', window_scan, window),
+                           ('risk_scores', risk_scores, risk),
+                           ('classify_services', classify_services, classify)]:
+        expected = fn(*args, backend_name='numpy')
+        actual = fn(*args, backend_name='numba')
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            if not np.array_equal(e, a, equal_nan=e.dtype.kind == 'f'):
+                raise AssertionError(f"{name}: output {i} differs between the numpy and numba backends")
+    return len(window[0])
+
+
+if __name__ == '__main__':
+    mode = 'compiled' if numba is not None else 'interpreted (numba not installed)'
+    print(f"Kernel parity check: numpy vs numba loops, {mode}")
+    try:
+        rows = check_parity()
+    except AssertionError as e:
+        print(f"  ✗ {e}")
+        sys.exit(1)
+    print(f"  ✓ window_scan, risk_scores, classify_services identical on {rows:,} rows")
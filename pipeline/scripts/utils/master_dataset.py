@@ -0,0 +1,267 @@
+"""
+MASTER DATASET (partitioned by data_month)
+Layout written by Phase 1 and read by Phase 2 and the summary scripts:
+
+    master_full/
+        _manifest.json                      # per-month input fingerprint + row count
+        data_month=202503/part-0.parquet
+        data_month=202504/part-0.parquet
+        ...
+
+Each partition is replaced atomically, so an incremental Phase 1 run can
+rewrite a single month and leave every other partition untouched.
+The data_month column is kept inside each file as well (a YYYYMM string), so
+partitions can be read without hive partition inference. The dataset is not
+meant for hive readers: a plain pd.read_parquet(MASTER_DATASET_DIR) infers an
+integer data_month from the directory names and fails with ArrowTypeError
+against the string column. Read it with read_master, or pass
+partitioning=None to read the files as they are.
+A month may also consist of several part-PPP.parquet files, one per isdn hash
+partition (parallel Phase 2 features); they hold disjoint subscribers, are
+each sorted, and are staged then published as a whole month.
+
+Output contract: every master file is sorted by (isdn_id, data_month), written
+in row groups of ROW_GROUP_SIZE rows with column statistics, and records its
+sort order in the Parquet key-value metadata (SORT_METADATA_KEY) and in the
+row-group sorting_columns. Readers can therefore skip re-sorting and prune
+row groups by isdn_id range.
+
+The (isdn_id, data_month) key is unique: Phase 1 resolves N10 duplicates
+before the merge, and every write checks the key on the sorted frame
+(one adjacent-row comparison) and refuses to write duplicates.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MASTER_DATASET_DIR = Path('/data/ut360/output/datasets/master_full')
+MANIFEST_NAME = '_manifest.json'
+
+MASTER_SORT_ORDER = ['isdn_id', 'data_month']
+SORT_METADATA_KEY = b'ut360.sort_order'
+ROW_GROUP_SIZE = 1_000_000
+
+
+def partition_dir(dataset_dir, month):
+    """data_month=YYYYMM directory of `month`; the name is only used by this module (see above)"""
+    return Path(dataset_dir) / f'data_month={month}'
+
+
+def list_months(dataset_dir=MASTER_DATASET_DIR):
+    """Months that currently have a partition, sorted ascending"""
+    dataset_dir = Path(dataset_dir)
+    if not dataset_dir.exists():
+        return []
+    months = []
+    for p in dataset_dir.glob('data_month=*'):
+        if p.is_dir() and any(p.glob('*.parquet')):
+            months.append(p.name.split('=', 1)[1])
+    return sorted(months)
+
+
+def load_manifest(dataset_dir=MASTER_DATASET_DIR):
+    path = Path(dataset_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, dataset_dir=MASTER_DATASET_DIR):
+    path = Path(dataset_dir) / MANIFEST_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def sort_master(master):
+    """Order rows by MASTER_SORT_ORDER (stable)"""
+    return master.sort_values(MASTER_SORT_ORDER, kind='stable').reset_index(drop=True)
+
+
+def duplicate_key_count(df):
+    """
+    Rows whose (isdn_id, data_month) equals the previous row's.
+    O(n) on a frame sorted by MASTER_SORT_ORDER: duplicates are adjacent.
+    """
+    if len(df) < 2:
+        return 0
+    same = np.ones(len(df) - 1, dtype=bool)
+    for col in MASTER_SORT_ORDER:
+        values = df[col].to_numpy()
+        same &= values[1:] == values[:-1]
+    return int(same.sum())
+
+
+def assert_unique_keys(df):
+    """Raise ValueError if a sorted master frame repeats an (isdn_id, data_month) key"""
+    n_dup = duplicate_key_count(df)
+    if n_dup:
+        raise ValueError(
+            f"master has {n_dup:,} duplicate {tuple(MASTER_SORT_ORDER)} rows; "
+            f"N10 duplicates must be resolved before writing"
+        )
+
+
+def write_sorted_parquet(df, path, row_group_size=ROW_GROUP_SIZE, compression='snappy', metadata=None):
+    """
+    Write an already sorted master frame with fixed-size row groups, column
+    statistics and the sort order recorded in the file metadata (plus any
+    extra key-value `metadata`). Raises ValueError if the key is not unique.
+    """
+    assert_unique_keys(df)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    file_metadata = dict(table.schema.metadata or {})
+    file_metadata.update(metadata or {})
+    file_metadata[SORT_METADATA_KEY] = json.dumps(MASTER_SORT_ORDER).encode()
+    table = table.replace_schema_metadata(file_metadata)
+
+    kwargs = {}
+    if hasattr(pq, 'SortingColumn'):
+        kwargs['sorting_columns'] = [
+            pq.SortingColumn(table.schema.get_field_index(col)) for col in MASTER_SORT_ORDER
+        ]
+    pq.write_table(table, path, row_group_size=row_group_size, compression=compression,
+                   write_statistics=True, **kwargs)
+
+
+def parquet_sort_order(path):
+    """Sort order recorded by write_sorted_parquet, or None for files written without it"""
+    metadata = pq.read_schema(path).metadata or {}
+    raw = metadata.get(SORT_METADATA_KEY)
+    return json.loads(raw) if raw else None
+
+
+def write_month_partition(df_month, month, dataset_dir=MASTER_DATASET_DIR, row_group_size=ROW_GROUP_SIZE,
+                          metadata=None):
+    """Atomically replace one month's partition (df_month must already be sorted)"""
+    target = partition_dir(dataset_dir, month)
+    staging = target.with_name(target.name + f'.tmp{os.getpid()}')
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    write_sorted_parquet(df_month, staging / 'part-0.parquet', row_group_size, metadata=metadata)
+
+    _swap_in(staging, target)
+    return target / 'part-0.parquet'
+
+
+def _swap_in(staging, target):
+    """Replace the partition directory `target` with the complete directory `staging`"""
+    backup = None
+    if target.exists():
+        backup = target.with_name(target.name + f'.old{os.getpid()}')
+        os.replace(target, backup)
+    os.replace(staging, target)
+    if backup is not None:
+        shutil.rmtree(backup)
+
+
+def write_partition_part(df_month, month, part, staging_dir, row_group_size=ROW_GROUP_SIZE, metadata=None):
+    """
+    Write one hash partition's file of a month into a staging dataset
+    (df_month sorted); the staged months go live with publish_partitions.
+    """
+    path = partition_dir(staging_dir, month) / f'part-{part:03d}.parquet'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_sorted_parquet(df_month, path, row_group_size, metadata=metadata)
+    return path
+
+
+def publish_partitions(staging_dir, dataset_dir=MASTER_DATASET_DIR, fingerprints=None):
+    """Move every month staged under staging_dir into the dataset (one atomic swap per month) and record it"""
+    manifest = load_manifest(dataset_dir)
+    published = {}
+    for month in list_months(staging_dir):
+        staged = partition_dir(staging_dir, month)
+        rows = sum(pq.ParquetFile(part).metadata.num_rows for part in staged.glob('*.parquet'))
+        target = partition_dir(dataset_dir, month)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        _swap_in(staged, target)
+        manifest[month] = {
+            'fingerprint': (fingerprints or {}).get(month),
+            'rows': int(rows),
+            'written_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        published[month] = target
+    save_manifest(manifest, dataset_dir)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return published
+
+
+def write_master_partitions(master, dataset_dir=MASTER_DATASET_DIR, fingerprints=None, row_group_size=ROW_GROUP_SIZE,
+                            metadata=None):
+    """
+    Write every month present in `master` and record it in the manifest.
+    `master` must be sorted with sort_master; each month keeps that order.
+    """
+    manifest = load_manifest(dataset_dir)
+    written = {}
+    for month, df_month in master.groupby('data_month', sort=True):
+        path = write_month_partition(df_month, month, dataset_dir, row_group_size, metadata)
+        manifest[month] = {
+            'fingerprint': (fingerprints or {}).get(month),
+            'rows': int(len(df_month)),
+            'written_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        written[month] = path
+    save_manifest(manifest, dataset_dir)
+    return written
+
+
+def resolve_months(dataset_dir=MASTER_DATASET_DIR, months=None, window=None):
+    """Explicit month list, or the latest `window` partitions, or all partitions"""
+    available = list_months(dataset_dir)
+    if months:
+        missing = [m for m in months if m not in available]
+        if missing:
+            raise FileNotFoundError(f"Master dataset has no partition for months: {missing}")
+        return sorted(months)
+    if window:
+        return available[-window:]
+    return available
+
+
+def read_master(dataset_dir=MASTER_DATASET_DIR, months=None, window=None, columns=None, isdn_ids=None):
+    """
+    Read the rolling window of months a phase needs from the partitioned master.
+
+    When every partition carries the sort contract, the result is returned in
+    (isdn_id, data_month) order and df.attrs['sorted_by'] is set: partitions
+    are month-ordered runs already sorted by isdn_id, so a stable argsort on
+    isdn_id (timsort merging the runs) restores the global order.
+    isdn_ids restricts the read to those subscribers; row groups whose isdn_id
+    statistics exclude them are skipped.
+    """
+    selected = resolve_months(dataset_dir, months, window)
+    if not selected:
+        raise FileNotFoundError(f"No master partitions found in {dataset_dir}")
+    if columns is not None:
+        columns = list(dict.fromkeys(MASTER_SORT_ORDER + list(columns)))
+    filters = [('isdn_id', 'in', [int(i) for i in isdn_ids])] if isdn_ids is not None else None
+
+    frames = []
+    contract = True
+    for month in selected:
+        for part in sorted(partition_dir(dataset_dir, month).glob('*.parquet')):
+            contract = contract and parquet_sort_order(part) == MASTER_SORT_ORDER
+            frames.append(pd.read_parquet(part, columns=columns, filters=filters))
+    df = pd.concat(frames, ignore_index=True)
+
+    if contract:
+        if len(frames) > 1:
+            order = np.argsort(df['isdn_id'].to_numpy(), kind='stable')
+            df = df.take(order).reset_index(drop=True)
+        df.attrs['sorted_by'] = list(MASTER_SORT_ORDER)
+    return df
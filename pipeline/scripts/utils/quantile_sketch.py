@@ -0,0 +1,119 @@
+"""
+QUANTILE SKETCH: mergeable approximate quantiles (KLL-style compactors)
+A full-column .quantile() sorts every value and keeps nothing. A sketch keeps
+at most ~k items per level: level h items stand for 2**h input values. When a
+level holds more than k items it is sorted and every second item (alternating
+offset) moves up one level with double weight, so the total weight always
+equals the number of values seen.
+
+Sketches built per chunk, per partition or per month merge into the sketch
+of their union (merge), and persist as a small (level, value) frame whose
+attrs['flips'] holds each level's next compaction offset.
+While nothing has been compacted the sketch holds every value and
+quantile() equals pandas' linear-interpolated quantile exactly; after that
+the rank error is about log2(n / k) / k of n.
+Updates and merges are deterministic: the same inputs in the same order give
+the same sketch.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_K = 4096
+
+
+class QuantileSketch:
+    """Mergeable quantile summary of a numeric column (NaN values are skipped)"""
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = int(k)
+        self.levels = [np.empty(0)]
+        self._flips = [0]
+
+    @property
+    def n(self):
+        """Number of values summarized"""
+        return int(sum(len(items) << level for level, items in enumerate(self.levels)))
+
+    @property
+    def exact(self):
+        return all(len(items) == 0 for items in self.levels[1:])
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Fold another sketch (same k) into this one"""
+        if other.k != self.k:
+            raise ValueError(f"Cannot merge sketches with different k ({self.k} vs {other.k})")
+        for level, items in enumerate(other.levels):
+            self._ensure_level(level)
+            if len(items):
+                self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+        return self
+
+    def _ensure_level(self, level):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty(0))
+            self._flips.append(0)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                # An odd item stays behind, so no weight is lost
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                paired = items[:len(items) - len(keep)]
+                promoted = paired[self._flips[level]::2]
+                self._flips[level] ^= 1
+                self.levels[level] = keep
+                self._ensure_level(level + 1)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        """Value at quantile q (linear interpolation, like pandas), NaN if empty"""
+        if self.n == 0:
+            return float('nan')
+        if self.exact:
+            return float(np.quantile(self.levels[0], q))
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 1 << level, dtype=np.int64)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, weights = values[order], weights[order]
+        # Each item covers ranks [cum - w, cum - 1]; interpolate between their centres
+        cum = np.cumsum(weights)
+        centres = cum - (weights + 1) / 2.0
+        return float(np.interp(q * (self.n - 1), centres, values))
+
+    def to_frame(self):
+        """(level, value) rows with the per-level flips in attrs; with k this is the whole sketch"""
+        frame = pd.DataFrame({
+            'level': np.concatenate([np.full(len(items), level, dtype=np.int64)
+                                     for level, items in enumerate(self.levels)]),
+            'value': np.concatenate(self.levels),
+        })
+        frame.attrs['flips'] = list(self._flips)
+        return frame
+
+    @classmethod
+    def from_frame(cls, frame, k=DEFAULT_K):
+        """Inverse of to_frame; without attrs['flips'] every level restarts at offset 0"""
+        sketch = cls(k)
+        levels = frame['level'].to_numpy()
+        values = frame['value'].to_numpy(dtype=np.float64)
+        flips = [int(flip) for flip in frame.attrs.get('flips', [])]
+        sketch._ensure_level(max(int(levels.max()) if len(levels) else 0, len(flips) - 1))
+        for level in range(len(sketch.levels)):
+            sketch.levels[level] = values[levels == level]
+        sketch._flips[:len(flips)] = flips
+        return sketch
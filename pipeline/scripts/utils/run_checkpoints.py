@@ -0,0 +1,115 @@
+"""
+RUN CHECKPOINTS (Phase 1 / Phase 2 resume)
+A long phase saves its intermediate state after every major step, so a failed
+or timed-out run can continue with `--resume <run_id>` instead of restarting:
+
+    /data/ut360/staging/checkpoints/<run_id>/
+        phase1/
+            _checkpoints.json          # completed steps (order, key, info, files)
+            source-N10.df.parquet
+            source-N4.df.parquet
+            ...
+            merge.master.parquet
+        phase2/
+            tier1a.df.parquet
+            ...
+
+Every step is saved with a key (a fingerprint of the inputs and parameters it
+was computed from). On resume a step counts as done only if its key still
+matches, so changed inputs are recomputed rather than silently reused.
+Frames are written atomically; a step is recorded only after its frames exist.
+When a phase completes, its checkpoint frames are deleted and the manifest is
+marked finished.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+CHECKPOINT_DIR = Path('/data/ut360/staging/checkpoints')
+CHECKPOINT_MANIFEST = '_checkpoints.json'
+
+
+def new_run_id():
+    """Run id for a fresh run (sortable timestamp + pid)"""
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+
+class RunCheckpoints:
+    """Completed steps of one phase of one run"""
+
+    def __init__(self, phase, run_id, resume=False, root=CHECKPOINT_DIR):
+        self.phase = phase
+        self.run_id = run_id
+        self.resume = resume
+        self.dir = Path(root) / run_id / phase
+        manifest_path = self.dir / CHECKPOINT_MANIFEST
+
+        if resume and manifest_path.exists():
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            # A new run under an existing id starts over; so does a phase the
+            # resumed run never reached
+            if self.dir.exists():
+                shutil.rmtree(self.dir)
+            self.manifest = {'run_id': run_id, 'phase': phase, 'steps': {}, 'finished_at': None}
+
+    @property
+    def finished(self):
+        return self.manifest.get('finished_at') is not None
+
+    def steps(self):
+        """Completed steps in the order they were saved"""
+        return sorted(self.manifest['steps'], key=lambda step: self.manifest['steps'][step]['seq'])
+
+    def done(self, step, key=None):
+        """Step completed in this run with the same key (and its frames still kept)"""
+        entry = self.manifest['steps'].get(step)
+        return not self.finished and entry is not None and entry.get('key') == key
+
+    def save(self, step, frames=None, info=None, key=None):
+        """Persist the frames of a completed step, then record it in the manifest"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        files = {}
+        for name, df in (frames or {}).items():
+            path = self.dir / f'{step}.{name}.parquet'
+            tmp = path.with_name(path.name + f'.tmp{os.getpid()}')
+            df.to_parquet(tmp, compression='snappy', index=False)
+            os.replace(tmp, path)
+            files[name] = path.name
+
+        self.manifest['steps'][step] = {
+            'seq': len(self.manifest['steps']),
+            'key': key,
+            'info': info or {},
+            'files': files,
+            'completed_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        self._write_manifest()
+
+    def load(self, step):
+        """(frames, info) of a completed step"""
+        entry = self.manifest['steps'][step]
+        frames = {name: pd.read_parquet(self.dir / file) for name, file in entry['files'].items()}
+        return frames, entry['info']
+
+    def finish(self):
+        """Phase completed: drop the checkpoint frames, keep the manifest as a record"""
+        for entry in self.manifest['steps'].values():
+            for file in entry['files'].values():
+                (self.dir / file).unlink(missing_ok=True)
+            entry['files'] = {}
+        self.manifest['finished_at'] = datetime.now().isoformat(timespec='seconds')
+        self._write_manifest()
+
+    def _write_manifest(self):
+        path = self.dir / CHECKPOINT_MANIFEST
+        tmp = path.with_suffix('.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True, default=str)
+        os.replace(tmp, path)
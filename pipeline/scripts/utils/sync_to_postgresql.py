@@ -208,7 +208,9 @@ def load_recommendations(conn):
     profile_file = OUTPUT_DIR / "subscriber_360_profile.parquet"
     if profile_file.exists():
         df_profile = pd.read_parquet(profile_file)
-        df = df.merge(df_profile, on='isdn', how='left', suffixes=('', '_profile'))
+        # Integer isdn_id join when both files carry it (CSV and parquet isdn dtypes can differ)
+        join_key = 'isdn_id' if 'isdn_id' in df.columns and 'isdn_id' in df_profile.columns else 'isdn'
+        df = df.merge(df_profile, on=join_key, how='left', suffixes=('', '_profile'))
 
     # Calculate priority score
     df['priority_score'] = (
@@ -87,7 +87,9 @@ def load_recommendations(r):
     profile_file = OUTPUT_DIR / "subscriber_360_profile.parquet"
     if profile_file.exists():
         df_profile = pd.read_parquet(profile_file)
-        df = df.merge(df_profile, on='isdn', how='left', suffixes=('', '_profile'))
+        # Integer isdn_id join when both files carry it (CSV and parquet isdn dtypes can differ)
+        join_key = 'isdn_id' if 'isdn_id' in df.columns and 'isdn_id' in df_profile.columns else 'isdn'
+        df = df.merge(df_profile, on=join_key, how='left', suffixes=('', '_profile'))
 
     # Calculate priority score
     if 'customer_value_score' in df.columns and 'advance_readiness_score' in df.columns:
@@ -164,8 +166,12 @@ def load_360_profiles(r):
     # Load monthly ARPU
     monthly_file = OUTPUT_DIR / "subscriber_monthly_summary.parquet"
     df_monthly = None
+    monthly_by_key = {}
     if monthly_file.exists():
         df_monthly = pd.read_parquet(monthly_file)
+        # Group once by subscriber instead of filtering the whole frame per profile
+        monthly_key = 'isdn_id' if 'isdn_id' in df_monthly.columns and 'isdn_id' in df.columns else 'isdn'
+        monthly_by_key = {k: g for k, g in df_monthly.groupby(monthly_key, sort=False)}
 
     df = df.replace({np.nan: None})
 
@@ -228,8 +234,8 @@ def load_360_profiles(r):
         # Monthly ARPU
         monthly_arpu = []
         if df_monthly is not None:
-            monthly_data = df_monthly[df_monthly['isdn'] == isdn]
-            if not monthly_data.empty:
+            monthly_data = monthly_by_key.get(row[monthly_key])
+            if monthly_data is not None and not monthly_data.empty:
                 monthly_arpu = [
                     {
                         'month': m['data_month'],
@@ -280,7 +286,9 @@ def create_indexes(r):
 
     df = pd.read_csv(rec_file)
     df_profile = pd.read_parquet(profile_file)
-    df = df.merge(df_profile, on='isdn', how='left', suffixes=('', '_profile'))
+    # Integer isdn_id join when both files carry it (CSV and parquet isdn dtypes can differ)
+    join_key = 'isdn_id' if 'isdn_id' in df.columns and 'isdn_id' in df_profile.columns else 'isdn'
+    df = df.merge(df_profile, on=join_key, how='left', suffixes=('', '_profile'))
 
     # Calculate priority score
     if 'customer_value_score' in df.columns and 'advance_readiness_score' in df.columns:
@@ -348,7 +356,9 @@ def create_metadata(r):
     profile_file = OUTPUT_DIR / "subscriber_360_profile.parquet"
     if profile_file.exists():
         df_profile = pd.read_parquet(profile_file)
-        df = df.merge(df_profile, on='isdn', how='left', suffixes=('', '_profile'))
+        # Integer isdn_id join when both files carry it (CSV and parquet isdn dtypes can differ)
+        join_key = 'isdn_id' if 'isdn_id' in df.columns and 'isdn_id' in df_profile.columns else 'isdn'
+        df = df.merge(df_profile, on=join_key, how='left', suffixes=('', '_profile'))
 
     # Calculate stats (with new service_type names)
     metadata = {